@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+規則分析熱路徑微基準測試
+對 MoveCodeAnalyzer / RiskEngine 的規則分析路徑進行吞吐量與記憶體分配量測
+
+- analyze_package: 以合成的 normalized modules 取代 RPC
+- calculate_overall_risk: 以合成的包分析結果評估
+- analyze_with_ml_integration: 以固定回應取代 ML 服務
+
+使用範例:
+  # 執行基準測試並輸出 JSON
+  python benchmarks/bench_rule_analysis.py run --output bench_results.json
+
+  # 比較兩次結果，超過 10% 退化即標記
+  python benchmarks/bench_rule_analysis.py compare baseline.json bench_results.json --threshold 0.10
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# 添加 backend 目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.move_analyzer import MoveCodeAnalyzer
+from services.risk_engine import RiskEngine
+
+
+# ============================================
+# 合成語料
+# ============================================
+
+VERBS = [
+    "create", "update", "get", "set", "add", "remove", "deposit", "withdraw",
+    "transfer", "mint", "burn", "claim", "stake", "unstake", "swap", "borrow",
+    "repay", "liquidate", "approve", "delegate", "register", "close", "open", "upgrade"
+]
+
+NOUNS = [
+    "pool", "vault", "position", "reward", "coin", "balance", "order", "market",
+    "account", "config", "oracle", "fee", "share", "ticket", "admin", "owner"
+]
+
+FIELD_TYPES = [
+    "U64", "U128", "Bool", "Address",
+    {"Struct": {"address": "0x2", "module": "object", "name": "UID", "typeArguments": []}},
+    {"Struct": {"address": "0x2", "module": "balance", "name": "Balance", "typeArguments": [{"TypeParameter": 0}]}},
+    {"Vector": "U8"}
+]
+
+PARAM_TYPES = [
+    "U64", "Address", "Bool",
+    {"MutableReference": {"Struct": {"address": "0x2", "module": "tx_context", "name": "TxContext", "typeArguments": []}}},
+    {"Reference": {"Struct": {"address": "0x2", "module": "clock", "name": "Clock", "typeArguments": []}}},
+    {"Struct": {"address": "0x2", "module": "coin", "name": "Coin", "typeArguments": [{"TypeParameter": 0}]}}
+]
+
+
+def generate_normalized_package(rng: random.Random, total_functions: int,
+                                functions_per_module: int = 8) -> Dict:
+    """生成與 sui_getNormalizedMoveModulesByPackage 結構相同的合成包"""
+    modules = {}
+    module_count = max(1, -(-total_functions // functions_per_module))
+    remaining = total_functions
+
+    for m in range(module_count):
+        func_count = min(functions_per_module, remaining)
+        remaining -= func_count
+
+        structs = {}
+        for s in range(rng.randint(1, 4)):
+            struct_name = f"{rng.choice(NOUNS).capitalize()}{s}"
+            structs[struct_name] = {
+                "abilities": {"abilities": rng.sample(["Key", "Store", "Copy", "Drop"], 2)},
+                "typeParameters": [],
+                "fields": [
+                    {"name": f"{rng.choice(NOUNS)}_{f}", "type": rng.choice(FIELD_TYPES)}
+                    for f in range(rng.randint(1, 6))
+                ]
+            }
+
+        functions = {}
+        for f in range(func_count):
+            func_name = f"{rng.choice(VERBS)}_{rng.choice(NOUNS)}_{f}"
+            functions[func_name] = {
+                "visibility": rng.choice(["Public", "Public", "Friend"]),
+                "isEntry": rng.random() < 0.3,
+                "typeParameters": [],
+                "parameters": [rng.choice(PARAM_TYPES) for _ in range(rng.randint(0, 5))],
+                "return": []
+            }
+
+        modules[f"{rng.choice(NOUNS)}_module_{m}"] = {
+            "fileFormatVersion": 6,
+            "address": "0x" + "%064x" % rng.getrandbits(256),
+            "name": f"module_{m}",
+            "friends": [],
+            "structs": structs,
+            "exposedFunctions": functions
+        }
+
+    return modules
+
+
+def generate_move_source(rng: random.Random, target_bytes: int) -> str:
+    """生成約 target_bytes 大小的 Move 源代碼"""
+    parts = []
+    size = 0
+    module_index = 0
+
+    while size < target_bytes:
+        noun = rng.choice(NOUNS)
+        lines = [
+            f"module suiguard::{noun}_{module_index} {{",
+            "    use sui::object::{Self, UID};",
+            "    use sui::transfer;",
+            "    use sui::tx_context::{Self, TxContext};",
+            "    use sui::coin::{Self, Coin};",
+            "",
+            f"    /// {noun} 狀態",
+            f"    struct {noun.capitalize()} has key, store {{",
+            "        id: UID,",
+            "        owner: address,",
+            "        value: u64,",
+            "    }",
+            ""
+        ]
+        for f in range(rng.randint(4, 12)):
+            verb = rng.choice(VERBS)
+            entry = "entry " if rng.random() < 0.3 else ""
+            lines.extend([
+                f"    // {verb} {noun}",
+                f"    public {entry}fun {verb}_{noun}_{f}(obj: &mut {noun.capitalize()}, amount: u64, ctx: &mut TxContext) {{",
+                "        assert!(obj.owner == tx_context::sender(ctx), 0);",
+                "        obj.value = obj.value + amount;",
+                f"        if (amount > {rng.randint(1, 10_000)}) {{ transfer(obj, amount); }};",
+                "    }",
+                ""
+            ])
+        lines.append("}")
+        lines.append("")
+
+        block = "\n".join(lines)
+        parts.append(block)
+        size += len(block.encode("utf-8"))
+        module_index += 1
+
+    # 以位元組截斷（註解含中文，字元數少於位元組數），不完整的多位元組字元直接捨棄
+    return "\n".join(parts).encode("utf-8")[:target_bytes].decode("utf-8", errors="ignore")
+
+
+# ============================================
+# 被測對象（RPC / ML 已替換）
+# ============================================
+
+class StubbedMoveCodeAnalyzer(MoveCodeAnalyzer):
+    """以內存中的合成包取代 RPC"""
+
+    def __init__(self, packages: Dict[str, Dict]):
+        super().__init__()
+        self.packages = packages
+
+    async def fetch_normalized_modules(self, package_id: str) -> Optional[Dict]:
+        return self.packages.get(package_id)
+
+
+class StubbedRiskEngine(RiskEngine):
+    """以固定分類結果取代 ML 服務"""
+
+    ML_RESULT = {
+        "classification": "arithmetic_overflow",
+        "vulnerability_type": "Arithmetic Overflow (算術溢位)",
+        "probabilities": {
+            "capability_leak": 0.02,
+            "arithmetic_overflow": 0.9,
+            "cross_module_pollution": 0.02,
+            "unchecked_return": 0.02,
+            "resource_leak": 0.02,
+            "safe": 0.02
+        },
+        "max_probability": 0.9,
+        "risk_score": 85,
+        "risk_level": "HIGH",
+        "reasoning": "stub",
+        "model_version": "stub",
+        "processing_time": 0.0
+    }
+
+    async def classify_smart_contract_vulnerability(self, move_code: str) -> Dict:
+        return dict(self.ML_RESULT)
+
+
+# ============================================
+# 量測
+# ============================================
+
+def measure(name: str, params: Dict, op: Callable[[], None], repeat: int,
+            warmup: int, work_units: Dict[str, float]) -> Dict:
+    """量測單一操作的耗時與記憶體分配
+
+    Args:
+        name: 基準名稱
+        params: 場景參數
+        op: 無參數的同步操作
+        repeat: 計時次數
+        warmup: 預熱次數
+        work_units: 每次操作處理的工作量 (如 {"packages": 1, "kb": 12.5})，用於換算吞吐量
+    """
+    for _ in range(warmup):
+        op()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        op()
+        timings.append(time.perf_counter() - start)
+
+    # 記憶體分配量測（單獨執行，避免 tracemalloc 影響計時）
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    op()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # 快照差異只反映操作結束後仍存活的記憶體區塊（操作中分配又釋放的區塊不計入），分配量以 peak_alloc_bytes 為準
+    retained_blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, "lineno") if stat.count_diff > 0
+    )
+
+    mean_s = statistics.mean(timings)
+    sorted_timings = sorted(timings)
+    result = {
+        "name": name,
+        "params": params,
+        "repeat": repeat,
+        "mean_s": mean_s,
+        "stdev_s": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "p50_s": sorted_timings[len(sorted_timings) // 2],
+        "p95_s": sorted_timings[min(len(sorted_timings) - 1, int(len(sorted_timings) * 0.95))],
+        "ops_per_s": 1.0 / mean_s if mean_s > 0 else 0.0,
+        "peak_alloc_bytes": peak_bytes,
+        "retained_blocks": retained_blocks
+    }
+    for unit, amount in work_units.items():
+        result[f"{unit}_per_s"] = amount / mean_s if mean_s > 0 else 0.0
+
+    return result
+
+
+def run_benchmarks(function_counts: List[int], source_kbs: List[int], package_counts: List[int],
+                   repeat: int, warmup: int, seed: int) -> Dict:
+    """執行所有場景"""
+    # 相似度索引與部署者索引寫入臨時目錄（結束後刪除），避免污染工作目錄
+    with tempfile.TemporaryDirectory(prefix="suiguard_bench_") as bench_dir:
+        overrides = {
+            "SIMILARITY_INDEX_DIR": os.path.join(bench_dir, "similarity_index"),
+            "DEPLOYER_INDEX_PATH": os.path.join(bench_dir, "deployer_index.bin"),
+            "PACKAGE_REPUTATION_DIR": os.path.join(bench_dir, "package_reputation"),
+            "FEATURE_STORE_DIR": os.path.join(bench_dir, "feature_store")
+        }
+        previous = {key: os.environ.get(key) for key in overrides}
+        for key, value in overrides.items():
+            os.environ.setdefault(key, value)
+        try:
+            results = _run_scenarios(function_counts, source_kbs, package_counts, repeat, warmup, seed)
+        finally:
+            # 還原環境變數，不留下指向已刪除目錄的路徑
+            for key, value in previous.items():
+                if value is None:
+                    os.environ.pop(key, None)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "warmup": warmup,
+            "seed": seed
+        },
+        "results": results
+    }
+
+
+def _run_scenarios(function_counts: List[int], source_kbs: List[int], package_counts: List[int],
+                   repeat: int, warmup: int, seed: int) -> List[Dict]:
+    """依序量測 analyze_package、calculate_overall_risk 與 analyze_with_ml_integration"""
+    rng = random.Random(seed)
+    loop = asyncio.new_event_loop()
+    sink = io.StringIO()
+    results = []
+
+    def quiet(fn):
+        def wrapped():
+            with contextlib.redirect_stdout(sink):
+                fn()
+            sink.seek(0)
+            sink.truncate()
+        return wrapped
+
+    # analyze_package (RPC 已替換)
+    packages = {}
+    for count in function_counts:
+        package_id = "0x" + "%064x" % rng.getrandbits(256)
+        packages[package_id] = (count, generate_normalized_package(rng, count))
+
+    analyzer = StubbedMoveCodeAnalyzer({pid: modules for pid, (_, modules) in packages.items()})
+    package_analyses = []
+
+    for package_id, (count, modules) in packages.items():
+        source_kb = len(analyzer.render_normalized_modules(modules).encode("utf-8")) / 1024
+        op = quiet(lambda pid=package_id: loop.run_until_complete(analyzer.analyze_package(pid, "bench")))
+        results.append(measure(
+            "analyze_package",
+            {"functions": count, "modules": len(modules), "source_kb": round(source_kb, 2)},
+            op, repeat, warmup, {"packages": 1, "kb": source_kb}
+        ))
+        with contextlib.redirect_stdout(sink):
+            analysis = loop.run_until_complete(analyzer.analyze_package(package_id, "bench"))
+        package_analyses.append({"package_id": package_id, "analysis": analysis, "status": "success"})
+
+    # calculate_overall_risk
+    engine = StubbedRiskEngine()
+    for count in package_counts:
+        batch = [package_analyses[i % len(package_analyses)] for i in range(count)]
+        op = quiet(lambda b=batch: engine.calculate_overall_risk("bench.example.com", ["wallet:connect"], b))
+        results.append(measure(
+            "calculate_overall_risk",
+            {"packages": count},
+            op, repeat, warmup, {"packages": count}
+        ))
+
+    # analyze_with_ml_integration (ML 已替換)
+    for kb in source_kbs:
+        source = generate_move_source(rng, kb * 1024)
+        op = quiet(lambda s=source: loop.run_until_complete(engine.analyze_with_ml_integration(
+            "bench.example.com", ["wallet:connect"], package_analyses[:1], s
+        )))
+        results.append(measure(
+            "analyze_with_ml_integration",
+            {"source_kb": kb},
+            op, repeat, warmup, {"packages": 1, "kb": kb}
+        ))
+
+    loop.close()
+    return results
+
+
+def _result_key(result: Dict) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]"
+
+
+def compare_runs(baseline: Dict, current: Dict, threshold: float, alloc_threshold: float) -> List[Dict]:
+    """比較兩次結果，回傳每個場景的變化與是否退化"""
+    baseline_by_key = {_result_key(r): r for r in baseline["results"]}
+    comparisons = []
+
+    for result in current["results"]:
+        key = _result_key(result)
+        base = baseline_by_key.get(key)
+        if base is None:
+            continue
+
+        time_ratio = result["mean_s"] / base["mean_s"] if base["mean_s"] > 0 else 1.0
+        alloc_ratio = (
+            result["peak_alloc_bytes"] / base["peak_alloc_bytes"]
+            if base["peak_alloc_bytes"] > 0 else 1.0
+        )
+        comparisons.append({
+            "benchmark": key,
+            "baseline_mean_s": base["mean_s"],
+            "current_mean_s": result["mean_s"],
+            "time_change": time_ratio - 1.0,
+            "alloc_change": alloc_ratio - 1.0,
+            "regression": time_ratio - 1.0 > threshold or alloc_ratio - 1.0 > alloc_threshold
+        })
+
+    return comparisons
+
+
+def _parse_int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="SuiGuard 規則分析熱路徑基準測試",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="執行基準測試")
+    run_parser.add_argument("--output", type=str, default="bench_results.json",
+                            help="結果輸出路徑 (default: bench_results.json)")
+    run_parser.add_argument("--functions", type=str, default="10,50,100,250,500",
+                            help="每個包的函數數量 (default: 10,50,100,250,500)")
+    run_parser.add_argument("--source-kb", type=str, default="1,10,50,100",
+                            help="Move 源代碼大小 KB (default: 1,10,50,100)")
+    run_parser.add_argument("--packages", type=str, default="1,10,50",
+                            help="calculate_overall_risk 的包數量 (default: 1,10,50)")
+    run_parser.add_argument("--repeat", type=int, default=20, help="計時次數 (default: 20)")
+    run_parser.add_argument("--warmup", type=int, default=3, help="預熱次數 (default: 3)")
+    run_parser.add_argument("--seed", type=int, default=42, help="隨機種子 (default: 42)")
+
+    compare_parser = subparsers.add_parser("compare", help="比較兩次結果")
+    compare_parser.add_argument("baseline", type=str, help="基準結果 JSON")
+    compare_parser.add_argument("current", type=str, help="當前結果 JSON")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="耗時退化閾值 (default: 0.10 = 10%%)")
+    compare_parser.add_argument("--alloc-threshold", type=float, default=0.20,
+                                help="記憶體峰值退化閾值 (default: 0.20 = 20%%)")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "run":
+        report = run_benchmarks(
+            function_counts=_parse_int_list(args.functions),
+            source_kbs=_parse_int_list(args.source_kb),
+            package_counts=_parse_int_list(args.packages),
+            repeat=args.repeat,
+            warmup=args.warmup,
+            seed=args.seed
+        )
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        for r in report["results"]:
+            throughput = f"{r['kb_per_s']:.1f} KB/s" if "kb_per_s" in r else f"{r['packages_per_s']:.1f} pkg/s"
+            print(f"{r['name']:<30} {json.dumps(r['params'], ensure_ascii=False):<50} "
+                  f"{r['mean_s'] * 1000:9.3f} ms  {throughput:>16}  peak {r['peak_alloc_bytes'] / 1024:9.1f} KB")
+        print(f"\n✅ 結果已保存到: {args.output}")
+
+    elif args.command == "compare":
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+
+        comparisons = compare_runs(baseline, current, args.threshold, args.alloc_threshold)
+        regressions = [c for c in comparisons if c["regression"]]
+
+        for c in comparisons:
+            status = "❌" if c["regression"] else "✅"
+            print(f"{status} {c['benchmark']:<60} 耗時 {c['time_change'] * 100:+7.1f}%  記憶體 {c['alloc_change'] * 100:+7.1f}%")
+
+        print(json.dumps({"regressions": regressions, "compared": len(comparisons)}, ensure_ascii=False, indent=2))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
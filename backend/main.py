@@ -34,6 +34,7 @@ from middleware.rate_limiter import RateLimitMiddleware
 try:
     from services.move_analyzer import MoveCodeAnalyzer  
     from services.risk_engine import RiskEngine
+    from services.package_reputation import get_package_reputation_store
     from services.pkg_version_service import PackageVersionService
     from schedule.schedule_revoke_certificate import start_scheduler
     
@@ -359,6 +360,15 @@ async def analyze_connection(request: ConnectionRequest):
                     logger.warning(f"Invalid package_id format: {package_id}")
                     continue
                 
+                # 🚫 已知惡意包不取得源碼，交由 RiskEngine 直接判定
+                if get_package_reputation_store().is_blocked(package_id):
+                    package_analysis.append({
+                        "package_id": package_id,
+                        "analysis": {"package_id": package_id, "reputation": "blocked"},
+                        "status": "success"
+                    })
+                    continue
+                
                 # 🎯 直接從 Sui RPC 獲取完整合約 source code
                 code_analysis = await move_analyzer.analyze_package(package_id, "unknown_domain")
                 
@@ -462,8 +472,11 @@ async def request_certificate(request: CertificateRequest):
         move_analyzer = MoveCodeAnalyzer()
         risk_engine = RiskEngine()
         
-        # 分析package
-        code_analysis = await move_analyzer.analyze_package(package_id, "certificate_request")
+        # 分析package（已知惡意包不取得源碼）
+        if get_package_reputation_store().is_blocked(package_id):
+            code_analysis = {"package_id": package_id, "reputation": "blocked"}
+        else:
+            code_analysis = await move_analyzer.analyze_package(package_id, "certificate_request")
         source_code = code_analysis.get("source_code", "")
         
         # 風險分析
@@ -486,7 +499,8 @@ async def request_certificate(request: CertificateRequest):
         risk_scores = {
             "LOW": 85,
             "MEDIUM": 60,
-            "HIGH": 30
+            "HIGH": 30,
+            "CRITICAL": 0
         }
         base_score = risk_scores.get(risk_level, 50)
         
@@ -533,8 +547,11 @@ async def analyze_contract_for_monitor(request: ContractAnalysisRequest):
         move_analyzer = MoveCodeAnalyzer()
         risk_engine = RiskEngine()
         
-        # 分析合約
-        code_analysis = await move_analyzer.analyze_package(package_id, request.protocol)
+        # 分析合約（已知惡意包不取得源碼）
+        if get_package_reputation_store().is_blocked(package_id):
+            code_analysis = {"package_id": package_id, "reputation": "blocked"}
+        else:
+            code_analysis = await move_analyzer.analyze_package(package_id, request.protocol)
         source_code = code_analysis.get("source_code", "")
         
         # 風險分析
@@ -543,6 +560,7 @@ async def analyze_contract_for_monitor(request: ContractAnalysisRequest):
             permissions=[],
             package_analyses=[{
                 "package_id": package_id,
+                "deployer": request.deployer,
                 "analysis": code_analysis,
                 "status": "success"
             }],
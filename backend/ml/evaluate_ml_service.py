@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+ML Service 評估工具
+在標註數據集上直接呼叫 ml_service 的推論路徑（不經 HTTP），評估準確率與機率校準
+
+使用範例:
+  # 擬合標籤評分的溫度與偏置，寫入 LoRA 目錄下的 score_calibration.json
+  python ml/evaluate_ml_service.py calibrate
+
+  # 只擬合溫度（樣本少時避免偏置過擬合）
+  python ml/evaluate_ml_service.py calibrate --no-bias
+
+  # 比較各推論設定檔的準確率、記憶體與延遲（第一個設定檔為參考基準）
+  python ml/evaluate_ml_service.py profiles --profiles fp32,bf16,int8,int4
+
+  # 比較各推論後端的標籤一致性與延遲（同一台機器，第一個後端為參考基準，標籤不一致時返回非零）
+  python ml/evaluate_ml_service.py backends --backends pytorch,sdpa,compile,onnx --generate 5
+
+  # 比較輸入壓縮前後的 token 數與標籤（壓縮是否改變模型的判斷）
+  python ml/evaluate_ml_service.py compaction
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+# 添加 backend 目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from ml_service import ml_model
+from services.similarity_index import label_from_dataset_output
+
+
+def load_labeled_samples(path: str) -> List[Tuple[str, str]]:
+    """載入數據集，返回 (代碼, 標籤) 列表"""
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("//") or line.startswith("#"):
+                continue
+            data = json.loads(line)
+            label = label_from_dataset_output(data.get("output", ""))
+            if label is not None:
+                samples.append((data["input"], label))
+    print(f"✅ 載入了 {len(samples)} 個標註樣本")
+    return samples
+
+
+async def compute_label_scores(samples: List[Tuple[str, str]], batch_size: int) -> torch.Tensor:
+    """以標籤評分模式計算每個樣本各標籤的對數似然"""
+    await ml_model.ensure_model_loaded()
+    scorer = ml_model._label_scorer
+    scores = []
+    for start in range(0, len(samples), batch_size):
+        # 與服務相同：依 ML_INPUT_COMPACTION 壓縮後再分詞
+        batch = [ml_model.encode_prompt(ml_model._compact(code)[0]) for code, _ in samples[start:start + batch_size]]
+        scores.append(scorer.score(ml_model._model, batch, ml_model._tokenizer.pad_token_id, ml_model._device,
+                                   prefix_cache=ml_model._prefix_cache))
+        print(f"   評分進度: {min(start + batch_size, len(samples))}/{len(samples)}")
+    return torch.cat(scores)
+
+
+def calibration_metrics(logits: torch.Tensor, targets: torch.Tensor, labels: List[str], n_bins: int = 10) -> Dict:
+    """準確率、負對數似然、期望校準誤差 (ECE) 與各類別準確率"""
+    probs = torch.softmax(logits, dim=-1)
+    confidence, predicted = probs.max(dim=-1)
+    correct = (predicted == targets).float()
+
+    ece = 0.0
+    bins = torch.linspace(0, 1, n_bins + 1)
+    for low, high in zip(bins[:-1], bins[1:]):
+        in_bin = (confidence > low) & (confidence <= high)
+        if in_bin.any():
+            ece += in_bin.float().mean().item() * abs(confidence[in_bin].mean().item() - correct[in_bin].mean().item())
+
+    per_class = {}
+    for index, label in enumerate(labels):
+        mask = targets == index
+        if mask.any():
+            per_class[label] = round(correct[mask].mean().item(), 4)
+
+    return {
+        "accuracy": round(correct.mean().item(), 4),
+        "nll": round(torch.nn.functional.cross_entropy(logits, targets).item(), 4),
+        "ece": round(ece, 4),
+        "per_class_accuracy": per_class
+    }
+
+
+def fit_calibration(scores: torch.Tensor, targets: torch.Tensor, fit_bias: bool = True,
+                    bias_l2: float = 0.01) -> Tuple[float, torch.Tensor]:
+    """以 LBFGS 最小化負對數似然，擬合溫度與各標籤偏置"""
+    log_temperature = torch.zeros(1, requires_grad=True)
+    bias = torch.zeros(scores.shape[1], requires_grad=fit_bias)
+    params = [log_temperature, bias] if fit_bias else [log_temperature]
+    optimizer = torch.optim.LBFGS(params, lr=0.1, max_iter=200)
+
+    def closure():
+        optimizer.zero_grad()
+        logits = scores / log_temperature.exp() + bias
+        loss = torch.nn.functional.cross_entropy(logits, targets) + bias_l2 * (bias ** 2).sum()
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    bias = bias.detach()
+    return log_temperature.exp().item(), bias - bias.mean()
+
+
+def cmd_calibrate(args):
+    samples = load_labeled_samples(args.dataset)
+    start_time = time.time()
+    scores = asyncio.run(compute_label_scores(samples, args.batch_size))
+    elapsed = time.time() - start_time
+
+    labels = ml_model._label_scorer.labels
+    targets = torch.tensor([labels.index(label) for _, label in samples])
+
+    before = calibration_metrics(scores, targets, labels)
+    temperature, bias = fit_calibration(scores, targets, fit_bias=not args.no_bias)
+    after = calibration_metrics(scores / temperature + bias, targets, labels)
+
+    print(f"\n📊 標籤評分 {len(samples)} 個樣本，耗時 {elapsed:.1f}s ({elapsed / len(samples) * 1000:.0f} ms/樣本)")
+    print(f"   校準前: 準確率 {before['accuracy']:.2%}, NLL {before['nll']:.3f}, ECE {before['ece']:.3f}")
+    print(f"   校準後: 準確率 {after['accuracy']:.2%}, NLL {after['nll']:.3f}, ECE {after['ece']:.3f}")
+    print(f"   溫度: {temperature:.3f}")
+    if not args.no_bias:
+        for label, value in zip(labels, bias.tolist()):
+            print(f"   偏置 {label}: {value:+.3f}")
+
+    calibration = {
+        "temperature": round(temperature, 6),
+        "bias": {label: round(value, 6) for label, value in zip(labels, bias.tolist())} if not args.no_bias else {},
+        "dataset": args.dataset,
+        "samples": len(samples),
+        "metrics": {"before": before, "after": after},
+        "timestamp": datetime.now().isoformat()
+    }
+
+    output_path = args.output or ml_model.score_calibration_path
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, ensure_ascii=False, indent=2)
+    print(f"✅ 校準參數已保存到: {output_path}")
+
+
+def cmd_profiles(args):
+    samples = load_labeled_samples(args.dataset)
+    if args.limit:
+        samples = samples[:args.limit]
+    profiles = [profile.strip() for profile in args.profiles.split(",") if profile.strip()]
+
+    report = {
+        "dataset": args.dataset,
+        "samples": len(samples),
+        "reference": profiles[0],
+        "max_accuracy_drop": args.max_accuracy_drop,
+        "profiles": {},
+        "timestamp": datetime.now().isoformat()
+    }
+    reference = None
+
+    for profile in profiles:
+        print(f"\n⚙️ 評估設定檔: {profile}")
+        ml_model.unload_model()
+        ml_model.inference_profile = profile
+        asyncio.run(ml_model.ensure_model_loaded())
+
+        start_time = time.time()
+        scores = asyncio.run(compute_label_scores(samples, args.batch_size))
+        elapsed = time.time() - start_time
+
+        labels = ml_model._label_scorer.labels
+        targets = torch.tensor([labels.index(label) for _, label in samples])
+        logits = ml_model._label_scorer.calibrated_logits(
+            scores, ml_model.score_calibration["temperature"], ml_model.score_calibration["bias"])
+        metrics = calibration_metrics(logits, targets, labels)
+        probs = torch.softmax(logits, dim=-1)
+        if reference is None:
+            reference = {"probs": probs, "accuracy": metrics["accuracy"]}
+
+        entry = {
+            **metrics,
+            "agreement_with_reference": round((probs.argmax(-1) == reference["probs"].argmax(-1)).float().mean().item(), 4),
+            "max_probability_diff": round((probs - reference["probs"]).abs().max().item(), 4),
+            "passed": metrics["accuracy"] >= reference["accuracy"] - args.max_accuracy_drop,
+            "ms_per_sample": round(elapsed / len(samples) * 1000, 1),
+            **ml_model._load_stats
+        }
+        report["profiles"][ml_model.inference_profile] = entry
+
+    ml_model.unload_model()
+
+    print(f"\n📊 設定檔比較 ({len(samples)} 個樣本，參考基準 {profiles[0]})")
+    print(f"   {'設定檔':<8}{'準確率':>8}{'一致率':>8}{'最大機率差':>10}{'權重MB':>10}{'RSS MB':>10}{'ms/樣本':>10}  結果")
+    for profile, entry in report["profiles"].items():
+        print(f"   {profile:<8}{entry['accuracy']:>8.2%}{entry['agreement_with_reference']:>8.2%}"
+              f"{entry['max_probability_diff']:>10.4f}{entry['model_memory_mb']:>10.1f}"
+              f"{entry['rss_after_load_mb']:>10.1f}{entry['ms_per_sample']:>10.1f}  "
+              f"{'✅ 通過' if entry['passed'] else '❌ 準確率下降過多'}")
+
+    output_path = args.output or ml_model.profile_report_path
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 評估報告已保存到: {output_path}")
+
+
+def cmd_backends(args):
+    samples = load_labeled_samples(args.dataset)
+    if args.limit:
+        samples = samples[:args.limit]
+    backends = [backend.strip() for backend in args.backends.split(",") if backend.strip()]
+    generate_samples = samples[:args.generate]
+
+    report = {
+        "dataset": args.dataset,
+        "samples": len(samples),
+        "generate_samples": len(generate_samples),
+        "reference": backends[0],
+        "profile": ml_model.inference_profile,
+        "threads": torch.get_num_threads(),
+        "backends": {},
+        "timestamp": datetime.now().isoformat()
+    }
+    reference = None
+
+    for backend in backends:
+        print(f"\n⚙️ 評估推論後端: {backend}")
+        ml_model.unload_model()
+        ml_model.inference_backend = backend
+        asyncio.run(ml_model.ensure_model_loaded())
+        if ml_model.inference_backend != backend:
+            print(f"⚠️ 推論後端 {backend} 無法使用，略過")
+            continue
+
+        # 預熱一個批次（torch.compile 在此編譯，ONNX Runtime 在此配置記憶體），不計入延遲
+        warmup_started = time.time()
+        asyncio.run(compute_label_scores(samples[:args.batch_size], args.batch_size))
+        warmup_s = time.time() - warmup_started
+
+        start_time = time.time()
+        scores = asyncio.run(compute_label_scores(samples, args.batch_size))
+        elapsed = time.time() - start_time
+
+        logits = ml_model._label_scorer.calibrated_logits(
+            scores, ml_model.score_calibration["temperature"], ml_model.score_calibration["bias"])
+        probs = torch.softmax(logits, dim=-1)
+
+        # 結構化生成：逐一生成，比較輸出的 JSON
+        outputs = []
+        generate_started = time.time()
+        for code, _ in generate_samples:
+            outputs.append(ml_model._generate_batch([ml_model.encode_prompt(ml_model._compact(code)[0])])[0]["json"])
+        generate_elapsed = time.time() - generate_started
+
+        if reference is None:
+            reference = {"probs": probs, "outputs": outputs}
+        label_agreement = (probs.argmax(-1) == reference["probs"].argmax(-1)).float().mean().item()
+        output_agreement = (sum(a == b for a, b in zip(outputs, reference["outputs"])) / len(outputs)
+                            if outputs else None)
+
+        entry = {
+            "label_agreement": round(label_agreement, 4),
+            "max_probability_diff": round((probs - reference["probs"]).abs().max().item(), 6),
+            "generate_agreement": round(output_agreement, 4) if output_agreement is not None else None,
+            "passed": label_agreement == 1.0,
+            "ms_per_sample": round(elapsed / len(samples) * 1000, 1),
+            "generate_ms_per_sample": round(generate_elapsed / len(outputs) * 1000, 1) if outputs else None,
+            "warmup_s": round(warmup_s, 2),
+            "load_time_s": ml_model._load_stats.get("load_time_s"),
+            "rss_after_load_mb": ml_model._load_stats.get("rss_after_load_mb"),
+            "details": ml_model._backend.get_stats()
+        }
+        report["backends"][backend] = entry
+
+    ml_model.unload_model()
+
+    print(f"\n📊 推論後端比較 ({len(samples)} 個樣本，參考基準 {backends[0]}，{report['threads']} 執行緒)")
+    print(f"   {'後端':<10}{'標籤一致':>10}{'最大機率差':>12}{'生成一致':>10}{'ms/樣本':>10}{'生成ms':>10}"
+          f"{'載入s':>8}{'預熱s':>8}  結果")
+    for backend, entry in report["backends"].items():
+        generate_agreement = entry["generate_agreement"]
+        print(f"   {backend:<10}{entry['label_agreement']:>10.2%}{entry['max_probability_diff']:>12.6f}"
+              f"{(f'{generate_agreement:.2%}' if generate_agreement is not None else '-'):>10}"
+              f"{entry['ms_per_sample']:>10.1f}{(entry['generate_ms_per_sample'] or 0):>10.1f}"
+              f"{entry['load_time_s']:>8.1f}{entry['warmup_s']:>8.1f}  "
+              f"{'✅ 一致' if entry['passed'] else '❌ 標籤不一致'}")
+
+    output_path = args.output or ml_model.backend_report_path
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 評估報告已保存到: {output_path}")
+
+    if not all(entry["passed"] for entry in report["backends"].values()):
+        sys.exit(1)
+
+
+def cmd_compaction(args):
+    samples = load_labeled_samples(args.dataset)
+    if args.limit:
+        samples = samples[:args.limit]
+    asyncio.run(ml_model.ensure_model_loaded())
+
+    original_tokens = [len(ml_model.encode_prompt(code, truncate=False)) for code, _ in samples]
+    compacted_tokens = [len(ml_model.encode_prompt(ml_model._compact(code)[0], truncate=False))
+                        for code, _ in samples]
+
+    results = {}
+    for enabled in (False, True):
+        ml_model.input_compaction = enabled
+        scores = asyncio.run(compute_label_scores(samples, args.batch_size))
+        labels = ml_model._label_scorer.labels
+        targets = torch.tensor([labels.index(label) for _, label in samples])
+        logits = ml_model._label_scorer.calibrated_logits(
+            scores, ml_model.score_calibration["temperature"], ml_model.score_calibration["bias"])
+        results[enabled] = {"predictions": logits.argmax(-1), **calibration_metrics(logits, targets, labels)}
+    ml_model.unload_model()
+
+    total_original, total_compacted = sum(original_tokens), sum(compacted_tokens)
+    limit = ml_model.max_prompt_tokens
+    report = {
+        "dataset": args.dataset,
+        "samples": len(samples),
+        "original_tokens": total_original,
+        "compacted_tokens": total_compacted,
+        "saved_ratio": round((total_original - total_compacted) / total_original, 4) if total_original else 0.0,
+        "tokens_saved_per_sample": round((total_original - total_compacted) / len(samples), 1),
+        "over_limit": {
+            "original": sum(tokens > limit for tokens in original_tokens),
+            "compacted": sum(tokens > limit for tokens in compacted_tokens)
+        },
+        "accuracy": {"original": results[False]["accuracy"], "compacted": results[True]["accuracy"]},
+        "label_agreement": round((results[False]["predictions"] == results[True]["predictions"]).float().mean().item(), 4),
+        "timestamp": datetime.now().isoformat()
+    }
+
+    print(f"\n📊 輸入壓縮 ({len(samples)} 個樣本)")
+    print(f"   token: {total_original} -> {total_compacted} (節省 {report['saved_ratio']:.1%}，"
+          f"平均每個樣本 {report['tokens_saved_per_sample']:.0f})")
+    print(f"   超過 {limit} token: {report['over_limit']['original']} -> {report['over_limit']['compacted']}")
+    print(f"   準確率: {report['accuracy']['original']:.2%} -> {report['accuracy']['compacted']:.2%}，"
+          f"標籤一致率 {report['label_agreement']:.2%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ 評估報告已保存到: {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="SuiGuard ML Service 評估工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--dataset", type=str,
+                        default=os.getenv("DATASET_PATH", "ml/contract_bug_dataset.jsonl"),
+                        help="標註數據集路徑 (default: ml/contract_bug_dataset.jsonl)")
+    parser.add_argument("--batch-size", type=int, default=8, help="評估批次大小 (default: 8)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    calibrate_parser = subparsers.add_parser("calibrate", help="擬合標籤評分的溫度與偏置")
+    calibrate_parser.add_argument("--no-bias", action="store_true", help="只擬合溫度，不擬合各標籤偏置")
+    calibrate_parser.add_argument("--output", type=str, default=None,
+                                  help="校準參數輸出路徑 (default: ML_SCORE_CALIBRATION_PATH)")
+
+    profiles_parser = subparsers.add_parser("profiles", help="比較各推論設定檔的準確率、記憶體與延遲")
+    profiles_parser.add_argument("--profiles", type=str, default="fp32,bf16,int8,int4",
+                                 help="逗號分隔的設定檔，第一個作為參考基準 (default: fp32,bf16,int8,int4)")
+    profiles_parser.add_argument("--limit", type=int, default=None, help="只評估前 N 個樣本")
+    profiles_parser.add_argument("--max-accuracy-drop", type=float, default=0.02,
+                                 help="相對參考基準允許的準確率下降 (default: 0.02)")
+    profiles_parser.add_argument("--output", type=str, default=None,
+                                 help="評估報告輸出路徑 (default: ML_PROFILE_REPORT_PATH)")
+
+    backends_parser = subparsers.add_parser("backends", help="比較各推論後端的標籤一致性與延遲")
+    backends_parser.add_argument("--backends", type=str, default="pytorch,sdpa,compile,onnx",
+                                 help="逗號分隔的推論後端，第一個作為參考基準 (default: pytorch,sdpa,compile,onnx)")
+    backends_parser.add_argument("--limit", type=int, default=None, help="只評估前 N 個樣本")
+    backends_parser.add_argument("--generate", type=int, default=0,
+                                 help="另以結構化生成比較前 N 個樣本的輸出與延遲 (default: 0)")
+    backends_parser.add_argument("--output", type=str, default=None,
+                                 help="評估報告輸出路徑 (default: ML_BACKEND_REPORT_PATH)")
+
+    compaction_parser = subparsers.add_parser("compaction", help="比較輸入壓縮前後的 token 數與標籤")
+    compaction_parser.add_argument("--limit", type=int, default=None, help="只評估前 N 個樣本")
+    compaction_parser.add_argument("--output", type=str, default=None, help="評估報告輸出路徑（不指定則只輸出到終端）")
+
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        cmd_calibrate(args)
+    elif args.command == "profiles":
+        cmd_profiles(args)
+    elif args.command == "backends":
+        cmd_backends(args)
+    elif args.command == "compaction":
+        cmd_compaction(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+合併 LoRA 並匯出模型
+將 LoRA adapter 合併進基礎模型權重（merge_and_unload），可選 4-bit 預量化，
+寫成分片 safetensors 與 merged_manifest.json，供 ml_service 以 ML_MERGED_MODEL_PATH 記憶體映射載入
+
+使用範例:
+  # 以 bfloat16 匯出合併後的模型
+  python ml/export_merged_model.py --dtype bf16 --output ./merged_model
+
+  # 匯出 4-bit 預量化的模型
+  python ml/export_merged_model.py --quantize int4 --output ./merged_model_int4
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+# 添加 backend 目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from peft import PeftModel
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from ml_serving.merged_checkpoint import (EXPORT_DTYPES, MANIFEST_NAME, adapter_fingerprint, load_merged_model,
+                                          shard_files)
+from ml_serving.quantization import apply_profile, model_memory_bytes
+
+VERIFY_PROMPT = "請分析以下 Sui Move 智能合約代碼，找出潛在的安全漏洞\n\n```move\nmodule demo::coin {}\n```\n\n分析結果："
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="SuiGuard LoRA 合併匯出工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--base-model", type=str,
+                        default=os.getenv("BASE_MODEL_NAME", "mistralai/Mistral-7B-Instruct-v0.2"),
+                        help="基礎模型名稱或路徑 (default: BASE_MODEL_NAME)")
+    parser.add_argument("--lora-path", type=str, default=os.getenv("LORA_MODEL_PATH", "./lora_models"),
+                        help="LoRA adapter 目錄 (default: LORA_MODEL_PATH)")
+    parser.add_argument("--output", type=str, default=os.getenv("ML_MERGED_MODEL_PATH", "./merged_model"),
+                        help="輸出目錄 (default: ML_MERGED_MODEL_PATH 或 ./merged_model)")
+    parser.add_argument("--dtype", choices=list(EXPORT_DTYPES), default="bf16",
+                        help="合併後權重的精度 (default: bf16)")
+    parser.add_argument("--quantize", choices=["none", "int4"], default="none",
+                        help="預量化解碼器線性層 (default: none)")
+    parser.add_argument("--int4-group-size", type=int, default=int(os.getenv("ML_INT4_GROUP_SIZE", "128")),
+                        help="4-bit 量化的分組大小 (default: 128)")
+    parser.add_argument("--max-shard-size", type=str, default="2GB", help="單一分片大小上限 (default: 2GB)")
+    parser.add_argument("--skip-verify", action="store_true", help="跳過匯出後的重新載入與輸出比對")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.lora_path):
+        print(f"❌ 找不到 LoRA adapter: {args.lora_path}")
+        sys.exit(1)
+
+    start_time = time.time()
+    dtype = EXPORT_DTYPES[args.dtype]
+    print(f"🧠 載入基礎模型: {args.base_model} ({args.dtype})")
+    tokenizer = AutoTokenizer.from_pretrained(args.base_model)
+    base_model = AutoModelForCausalLM.from_pretrained(args.base_model, torch_dtype=dtype, low_cpu_mem_usage=True)
+
+    print(f"🎯 載入並合併 LoRA: {args.lora_path}")
+    model = PeftModel.from_pretrained(base_model, args.lora_path, torch_dtype=dtype)
+    model.eval()
+    verify_ids = tokenizer(VERIFY_PROMPT, return_tensors="pt")["input_ids"]
+    with torch.no_grad():
+        reference_logits = model(input_ids=verify_ids).logits[:, -1].float()
+    model = model.merge_and_unload()
+
+    if args.quantize == "int4":
+        model = apply_profile(model, "int4", args.int4_group_size)
+
+    os.makedirs(args.output, exist_ok=True)
+    print(f"💾 寫入分片 safetensors: {args.output}")
+    model.save_pretrained(args.output, safe_serialization=True, max_shard_size=args.max_shard_size)
+    tokenizer.save_pretrained(args.output)
+
+    memory = model_memory_bytes(model)
+    manifest = {
+        "base_model": args.base_model,
+        "lora_path": os.path.abspath(args.lora_path),
+        "adapter_fingerprint": adapter_fingerprint(args.lora_path),
+        "dtype": args.dtype,
+        "quantization": args.quantize if args.quantize != "none" else None,
+        "int4_group_size": args.int4_group_size if args.quantize == "int4" else None,
+        "shards": [os.path.basename(path) for path in shard_files(args.output)],
+        "weight_bytes": memory["total"],
+        "timestamp": datetime.now().isoformat()
+    }
+
+    manifest_path = os.path.join(args.output, MANIFEST_NAME)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    if not args.skip_verify:
+        # 以服務相同的方式（記憶體映射）重新載入，與合併前的輸出比對
+        del model
+        load_started = time.time()
+        merged, _ = load_merged_model(args.output)
+        load_time = time.time() - load_started
+        with torch.no_grad():
+            merged_logits = merged(input_ids=verify_ids).logits[:, -1].float()
+        max_diff = (merged_logits - reference_logits).abs().max().item()
+        same_top = bool((merged_logits.argmax(-1) == reference_logits.argmax(-1)).all())
+        manifest["verification"] = {
+            "max_logit_diff": round(max_diff, 6),
+            "same_top_token": same_top,
+            "mmap_load_time_s": round(load_time, 3)
+        }
+        print(f"🔍 重新載入耗時 {load_time:.2f}s，與未合併模型的最大 logit 差 {max_diff:.5f}"
+              f"{'' if same_top else ' ⚠️ 下一個 token 預測不同'}")
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ 匯出完成: {len(manifest['shards'])} 個分片，權重 {memory['total'] / 1024**3:.2f} GB，"
+          f"耗時 {time.time() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
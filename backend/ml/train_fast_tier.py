@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+快速分類層訓練工具
+以標註數據集加上 LoRA 模型對未標註合約產生的偽標籤，訓練 n-gram 邏輯迴歸快速分類器，
+在保留集上掃描信心度門檻，建議 ML_FAST_TIER_THRESHOLD，輸出供 ml_service 載入的 fast_tier.npz
+
+使用範例:
+  # 只用標註數據集訓練
+  python ml/train_fast_tier.py
+
+  # 加入未標註的合約（.move 檔、目錄或含 code 欄位的 JSONL），由 LoRA 模型產生偽標籤
+  python ml/train_fast_tier.py --unlabeled ./contracts --unlabeled ./more_contracts.jsonl
+
+  # 要求快速層直接回答的部分至少 98% 與參考標籤一致
+  python ml/train_fast_tier.py --target-accuracy 0.98
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+# 添加 backend 目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml_serving.fast_tier import (CONSERVATIVE_THRESHOLD, DEFAULT_FEATURE_DIM, suggest_threshold, threshold_sweep,
+                                  train_classifier)
+from ml_serving.label_scoring import LABEL_VERBALIZATIONS
+from services.similarity_index import label_from_dataset_output
+
+LABELS = list(LABEL_VERBALIZATIONS)
+
+
+def load_labeled_samples(path: str) -> List[Tuple[str, str]]:
+    """載入數據集，返回 (代碼, 標籤) 列表"""
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("//") or line.startswith("#"):
+                continue
+            data = json.loads(line)
+            label = label_from_dataset_output(data.get("output", ""))
+            if label is not None:
+                samples.append((data["input"], label))
+    print(f"✅ 載入了 {len(samples)} 個標註樣本")
+    return samples
+
+
+def load_unlabeled_code(paths: List[str]) -> List[str]:
+    """讀取未標註的合約：.move 檔、目錄（遞迴搜尋 .move）或 JSONL（code / move_code / input 欄位）"""
+    codes = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith(".move"):
+                        with open(os.path.join(root, name), "r", encoding="utf-8", errors="ignore") as f:
+                            codes.append(f.read())
+        elif path.endswith(".jsonl"):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith("//"):
+                        continue
+                    data = json.loads(line)
+                    code = data.get("code") or data.get("move_code") or data.get("input")
+                    if code:
+                        codes.append(code)
+        else:
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                codes.append(f.read())
+    return [code for code in codes if code.strip()]
+
+
+def code_digest(code: str) -> str:
+    return hashlib.sha256(code.strip().encode("utf-8")).hexdigest()
+
+
+def split_by_digest(samples: List[Tuple], fraction: float, seed: int) -> Tuple[List[Tuple], List[Tuple]]:
+    """以代碼 digest 分組切出保留集，相同代碼（含標註與偽標籤的重複）不會同時出現在兩邊
+
+    保留集每個 digest 只取一個樣本（優先使用標註樣本），避免重複代碼重複計分
+
+    Returns:
+        (保留集, 訓練集)
+    """
+    groups: Dict[str, List[Tuple]] = {}
+    for sample in samples:
+        groups.setdefault(code_digest(sample[0]), []).append(sample)
+
+    digests = list(groups)
+    random.Random(seed).shuffle(digests)
+    holdout_size = max(1, int(len(digests) * fraction)) if fraction > 0 else 0
+    holdout = [min(groups[digest], key=lambda sample: sample[3] != "dataset") for digest in digests[:holdout_size]]
+    train = [sample for digest in digests[holdout_size:] for sample in groups[digest]]
+    return holdout, train
+
+
+def load_pseudo_labels(path: str) -> Dict[str, Dict]:
+    """讀取已產生的偽標籤快取（digest -> {label, confidence, code}）"""
+    cached = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    cached[entry["digest"]] = entry
+    return cached
+
+
+async def pseudo_label(codes: List[str], concurrency: int) -> List[Dict]:
+    """以 LoRA 模型（標籤評分模式）標註合約，經由服務的批次排程器合併推論"""
+    from ml_service import ml_model
+
+    # 偽標籤必須來自 LoRA 模型本身，不經過快速層
+    ml_model.fast_tier = None
+    await ml_model.ensure_model_loaded()
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def label_one(code: str) -> Dict:
+        nonlocal done
+        async with semaphore:
+            result = await ml_model.classify_vulnerability(code, mode="score")
+        done += 1
+        if done % 20 == 0 or done == len(codes):
+            print(f"   偽標籤進度: {done}/{len(codes)}")
+        return {
+            "digest": code_digest(code),
+            "label": result["classification"],
+            "confidence": round(result["max_probability"], 6),
+            "code": code
+        }
+
+    return await asyncio.gather(*[label_one(code) for code in codes])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="SuiGuard 快速分類層訓練工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    lora_path = os.getenv("LORA_MODEL_PATH", "./lora_models")
+    parser.add_argument("--dataset", type=str,
+                        default=os.getenv("DATASET_PATH", "ml/contract_bug_dataset.jsonl"),
+                        help="標註數據集路徑 (default: ml/contract_bug_dataset.jsonl)")
+    parser.add_argument("--unlabeled", action="append", default=[],
+                        help="未標註的合約來源（.move 檔、目錄或 JSONL），可重複指定")
+    parser.add_argument("--pseudo-labels", type=str, default=os.path.join(lora_path, "fast_tier_pseudo_labels.jsonl"),
+                        help="偽標籤快取，已標註過的合約不再重新推論 (default: <LORA_MODEL_PATH>/fast_tier_pseudo_labels.jsonl)")
+    parser.add_argument("--pseudo-min-confidence", type=float, default=0.6,
+                        help="LoRA 信心度低於此值的偽標籤不用於訓練 (default: 0.6)")
+    parser.add_argument("--pseudo-weight", type=float, default=0.5, help="偽標籤樣本的權重 (default: 0.5)")
+    parser.add_argument("--concurrency", type=int, default=8, help="產生偽標籤的並發請求數 (default: 8)")
+    parser.add_argument("--holdout", type=float, default=0.2, help="用於掃描門檻的保留比例 (default: 0.2)")
+    parser.add_argument("--target-accuracy", type=float, default=0.95,
+                        help="快速層直接回答部分的目標正確率，用於建議門檻 (default: 0.95)")
+    parser.add_argument("--min-holdout", type=int, default=100,
+                        help=f"建議門檻所需的最少保留集樣本數，不足時使用保守門檻 {CONSERVATIVE_THRESHOLD} (default: 100)")
+    parser.add_argument("--min-answered", type=int, default=30,
+                        help="門檻以上至少要有多少保留集樣本才採用該門檻 (default: 30)")
+    parser.add_argument("--dim", type=int, default=DEFAULT_FEATURE_DIM,
+                        help=f"特徵雜湊維度 (default: {DEFAULT_FEATURE_DIM})")
+    parser.add_argument("--epochs", type=int, default=200, help="訓練輪數 (default: 200)")
+    parser.add_argument("--seed", type=int, default=42, help="隨機種子 (default: 42)")
+    parser.add_argument("--output", type=str,
+                        default=os.getenv("ML_FAST_TIER_PATH", os.path.join(lora_path, "fast_tier.npz")),
+                        help="模型輸出路徑 (default: ML_FAST_TIER_PATH 或 <LORA_MODEL_PATH>/fast_tier.npz)")
+    args = parser.parse_args()
+
+    # (代碼, 標籤, 權重, 來源)
+    samples = [(code, label, 1.0, "dataset") for code, label in load_labeled_samples(args.dataset)]
+
+    if args.unlabeled:
+        codes = load_unlabeled_code(args.unlabeled)
+        cached = load_pseudo_labels(args.pseudo_labels)
+        pending = list({code_digest(code): code for code in codes if code_digest(code) not in cached}.values())
+        print(f"📂 未標註合約 {len(codes)} 個，其中 {len(pending)} 個需要 LoRA 模型標註")
+        if pending:
+            start_time = time.time()
+            labeled = asyncio.run(pseudo_label(pending, args.concurrency))
+            print(f"   標註耗時 {time.time() - start_time:.1f}s")
+            output_dir = os.path.dirname(args.pseudo_labels)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            with open(args.pseudo_labels, "a", encoding="utf-8") as f:
+                for entry in labeled:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    cached[entry["digest"]] = entry
+
+        wanted = {code_digest(code) for code in codes}
+        pseudo = [entry for digest, entry in cached.items()
+                  if digest in wanted and entry["confidence"] >= args.pseudo_min_confidence]
+        print(f"✅ 使用 {len(pseudo)} 個偽標籤樣本 (LoRA 信心度 >= {args.pseudo_min_confidence})")
+        samples += [(entry["code"], entry["label"], args.pseudo_weight, "pseudo") for entry in pseudo]
+
+    if len(samples) < 2:
+        print("❌ 訓練樣本不足")
+        sys.exit(1)
+
+    # 保留集：評估正確率（標註樣本）與和 LoRA 的一致率（偽標籤樣本），並掃描門檻
+    holdout, train = split_by_digest(samples, args.holdout, args.seed)
+
+    evaluation = {}
+    suggested = None
+    threshold_source = "default"
+    if holdout:
+        model = train_classifier([(code, label, weight) for code, label, weight, _ in train], LABELS,
+                                 dim=args.dim, epochs=args.epochs, seed=args.seed)
+        confidences, correct = [], []
+        by_source = {}
+        for code, label, _, source in holdout:
+            predicted, confidence, _ = model.predict(code)
+            confidences.append(confidence)
+            correct.append(predicted == label)
+            stats = by_source.setdefault(source, {"samples": 0, "correct": 0})
+            stats["samples"] += 1
+            stats["correct"] += int(predicted == label)
+        sweep = threshold_sweep(confidences, correct)
+        if len(holdout) >= args.min_holdout:
+            suggested = suggest_threshold(sweep, args.target_accuracy, args.min_answered)
+            threshold_source = "holdout" if suggested is not None else "unreachable"
+        evaluation = {
+            "holdout_samples": len(holdout),
+            "accuracy": round(sum(correct) / len(correct), 4),
+            # dataset: 與人工標註的正確率；pseudo: 與 LoRA 模型的一致率
+            "by_source": {
+                source: {**stats, "accuracy": round(stats["correct"] / stats["samples"], 4)}
+                for source, stats in by_source.items()
+            },
+            "threshold_sweep": sweep
+        }
+
+        print(f"\n📊 保留集 {len(holdout)} 個樣本: 正確率 {evaluation['accuracy']:.2%}")
+        for source, stats in evaluation["by_source"].items():
+            print(f"   {source}: {stats['accuracy']:.2%} ({stats['correct']}/{stats['samples']})")
+        print("   門檻     覆蓋率    直接回答的正確率")
+        for row in sweep:
+            accuracy = f"{row['accuracy']:.2%}" if row["accuracy"] is not None else "-"
+            print(f"   {row['threshold']:.2f}     {row['coverage']:>6.1%}    {accuracy}")
+        if threshold_source == "holdout":
+            print(f"💡 建議門檻: ML_FAST_TIER_THRESHOLD={suggested} (正確率 >= {args.target_accuracy:.0%})")
+        elif threshold_source == "unreachable":
+            print(f"⚠️ 沒有門檻能在至少 {args.min_answered} 個樣本上達到 {args.target_accuracy:.0%} 的正確率，"
+                  f"快速層將全部升級到 LoRA 模型")
+    if threshold_source == "default":
+        print(f"⚠️ 保留集只有 {len(holdout)} 個樣本 (< --min-holdout {args.min_holdout})，"
+              f"不估計門檻，使用保守門檻 {CONSERVATIVE_THRESHOLD}")
+
+    # 以全部樣本訓練最終模型
+    start_time = time.time()
+    model = train_classifier([(code, label, weight) for code, label, weight, _ in samples], LABELS,
+                             dim=args.dim, epochs=args.epochs, seed=args.seed)
+    model.metadata = {
+        "trained_at": datetime.now().isoformat(),
+        "dataset": args.dataset,
+        "samples": {
+            "dataset": sum(1 for sample in samples if sample[3] == "dataset"),
+            "pseudo": sum(1 for sample in samples if sample[3] == "pseudo")
+        },
+        "dim": args.dim,
+        "target_accuracy": args.target_accuracy,
+        # 保留集太小時使用保守門檻；沒有門檻達標時設為 1.01：所有請求都升級
+        "suggested_threshold": {"holdout": suggested, "unreachable": 1.01,
+                                "default": CONSERVATIVE_THRESHOLD}[threshold_source],
+        "threshold_source": threshold_source,
+        "evaluation": evaluation
+    }
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    model.save(args.output)
+    print(f"✅ 快速分類器已保存到: {args.output} (訓練耗時 {time.time() - start_time:.1f}s, 指紋 {model.fingerprint})")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,18 +4,53 @@
 支援懶加載和單例模式以優化記憶體使用
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 import os
+import gc
+import hashlib
+import hmac
+import json
+import random
 import logging
+import time
+from collections import deque
+from contextlib import AsyncExitStack, ExitStack, aclosing, contextmanager
 from datetime import datetime
+from functools import partial
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, LogitsProcessorList, StoppingCriteriaList
 from peft import PeftModel, LoraConfig, get_peft_model
 import asyncio
-from threading import Lock
+import psutil
+from threading import Event, Lock
+
+from ml_serving.adapters import (DEFAULT_ADAPTER, VERSION_SEPARATOR, AdapterNotAvailable, LoadedAdapter,
+                                 adapter_memory_bytes, adapter_name, parse_adapter_specs)
+from ml_serving.backends import INFERENCE_BACKENDS, create_backend
+from ml_serving.batching import BatchScheduler, percentile
+from ml_serving.compaction import CompactedCode, compact_code
+from ml_serving.executor import InferenceExecutor, InferenceQueueFull
+from ml_serving.fast_tier import CONSERVATIVE_THRESHOLD, CascadeMonitor, FastTierClassifier
+from ml_serving.hot_swap import CANARY_SNIPPETS, AdapterWatcher, SwapConflict
+from ml_serving.merged_checkpoint import EXPORT_DTYPES, adapter_fingerprint, load_merged_model, read_manifest
+from ml_serving.label_scoring import LabelScorer, left_pad, load_calibration
+from ml_serving.lifecycle import ModelLifecycle
+from ml_serving.metrics import (InferenceMetrics, PrometheusWriter, StepTimer, current_profile, peak_memory_bytes,
+                                process_rss_bytes, profile_stage, profiling, reset_peak_memory)
+from ml_serving.prefix_cache import PrefixCache
+from ml_serving.quantization import INFERENCE_PROFILES, apply_profile, load_dtype, model_memory_bytes, requires_merge
+from ml_serving.result_cache import ResultCache
+from ml_serving.speculative import (DecodingMonitor, ForwardCounter, count_generated, decoding_info,
+                                    load_draft_model)
+from ml_serving.structured_decoding import (
+    CancellationCriteria, StreamingStructuredProcessor, StructuredOutputProgram, StructuredOutputProcessor
+)
+from ml_serving.windowing import CodeWindow, pick_max_risk, split_windows
+from ml_serving.worker_pool import WorkerPool
 
 # 日誌配置
 logging.basicConfig(
@@ -64,10 +99,43 @@ class VulnerabilityAnalysisRequest(BaseModel):
     """漏洞分析請求"""
     move_code: str
     timeout: Optional[int] = 30  # 秒
+    mode: Optional[str] = None  # score（單次前向評分）或 generate（生成分析文本），預設依 ML_INFERENCE_MODE
+    speculative: Optional[bool] = None  # generate 模式是否使用草稿模型推測解碼，預設依 ML_SPECULATIVE_DEFAULT
+    profile: Optional[bool] = False  # 在結果中附上各階段耗時（profile 欄位）
+    adapter: Optional[str] = None  # 使用的 LoRA adapter（ML_LORA_ADAPTERS 中的名稱），預設為 LORA_MODEL_PATH
     
     class Config:
         min_anystr_length = 1
 
+class BatchAnalysisItem(BaseModel):
+    """批次分析的單一項目"""
+    id: Optional[str] = None  # 呼叫端的識別碼，原樣返回（預設為索引）
+    move_code: str
+
+class AdapterSwapRequest(BaseModel):
+    """adapter 熱更新請求"""
+    path: str  # 新版本的 adapter 目錄（含 adapter_config.json）
+
+class BatchAnalysisRequest(BaseModel):
+    """批次漏洞分析請求（mode 與 speculative 套用於所有項目）"""
+    items: List[BatchAnalysisItem]
+    mode: Optional[str] = None
+    speculative: Optional[bool] = None
+    profile: Optional[bool] = False
+    adapter: Optional[str] = None
+
+# 支援的推論模式
+INFERENCE_MODES = ("score", "generate")
+
+# 單一請求的代碼大小上限（字元）
+MAX_CODE_LENGTH = 100000
+
+# 切分窗口時預留的 token 數（分段計數與整段分詞的差異）
+WINDOW_TOKEN_MARGIN = 16
+
+# 所有提示詞共用的開頭（指令 + 代碼區塊起始），其 KV cache 在模型載入時預先計算
+PROMPT_PREFIX = "請分析以下 Sui Move 智能合約代碼，找出潛在的安全漏洞，並評估危險等級（高/中/低）\n\n```move\n"
+
 # ML 模型單例管理器
 class MLModelSingleton:
     """ML 模型單例 - 懶加載，全局共享"""
@@ -77,8 +145,12 @@ class MLModelSingleton:
     _model = None
     _tokenizer = None
     _initialized = False
-    _loading = False
     _device = None  # 計算設備（cuda 或 cpu）
+    _label_scorer = None  # 標籤評分器（模型載入後建立）
+    _structured_program = None  # 結構化解碼程式（模型載入後建立）
+    _prefix_cache = None  # 指令前綴的 KV cache（模型載入後建立）
+    _draft_model = None  # 推測解碼的草稿模型（設定 ML_DRAFT_MODEL_NAME 時與主模型一起載入）
+    _worker_pool = None  # 多進程推論 worker 池（ML_NUM_WORKERS > 1 時於模型載入後 fork）
     
     def __new__(cls):
         if cls._instance is None:
@@ -92,6 +164,25 @@ class MLModelSingleton:
         if not hasattr(self, '_config_loaded'):
             self.model_path = os.getenv("LORA_MODEL_PATH", "./lora_models")
             self.base_model_name = os.getenv("BASE_MODEL_NAME", "mistralai/Mistral-7B-Instruct-v0.2")
+            # 預先合併 LoRA 的檢查點（ml/export_merged_model.py 匯出），設定後優先以記憶體映射載入
+            self.merged_model_path = os.getenv("ML_MERGED_MODEL_PATH", "")
+            # 附加在同一個基礎模型上的額外 adapter（名稱=路徑，逗號分隔），請求以 adapter 欄位選擇
+            self.lora_adapters = {DEFAULT_ADAPTER: self.model_path,
+                                  **parse_adapter_specs(os.getenv("ML_LORA_ADAPTERS", ""))}
+            self._adapters: Dict[str, LoadedAdapter] = {}  # 名稱 -> 新請求使用的版本
+            self._adapter_versions: Dict[str, LoadedAdapter] = {}  # key -> 模型上已附加的所有版本
+            self._active_adapter = DEFAULT_ADAPTER
+            self._adapter_requests = {name: 0 for name in self.lora_adapters}
+            
+            # adapter 熱更新：管理端點需要 ML_ADMIN_TOKEN；ML_ADAPTER_WATCH_INTERVAL > 0 時監看 adapter 目錄
+            self.admin_token = os.getenv("ML_ADMIN_TOKEN", "")
+            self._swap_lock = asyncio.Lock()
+            self._swap_serial = 0
+            self._swap_history = deque(maxlen=20)
+            self._swap_tasks = set()
+            watch_interval = float(os.getenv("ML_ADAPTER_WATCH_INTERVAL", "0"))
+            self.adapter_watcher = AdapterWatcher(self._watched_adapters, self.swap_adapter, watch_interval) \
+                if watch_interval > 0 else None
             
             # 智能選擇設備（優先 GPU）
             if self._device is None:
@@ -124,110 +215,229 @@ class MLModelSingleton:
                 "low_confidence": 0.4
             }
             
+            # 推論模式：score 只做一次前向傳播比較各標籤的似然，generate 以結構化 JSON 生成分析
+            self.inference_mode = os.getenv("ML_INFERENCE_MODE", "score").lower()
+            if self.inference_mode not in INFERENCE_MODES:
+                logger.warning(f"⚠️ 未知的推論模式 {self.inference_mode}，改用 score")
+                self.inference_mode = "score"
+            # 標籤機率校準（由 ml/evaluate_ml_service.py calibrate 擬合，預設存放在 LoRA 目錄）
+            self.score_calibration_path = os.getenv(
+                "ML_SCORE_CALIBRATION_PATH", os.path.join(self.model_path, "score_calibration.json"))
+            self.score_calibration = load_calibration(
+                self.score_calibration_path, float(os.getenv("ML_SCORE_TEMPERATURE", "1.0")))
+            # generate 模式下 reason 欄位的 token 上限
+            self.reason_max_tokens = int(os.getenv("ML_STRUCTURED_REASON_MAX_TOKENS", "96"))
+            
+            # 推論精度設定檔：fp32 / bf16 / int8（動態量化）/ int4（4-bit 權重量化）
+            self.inference_profile = os.getenv("ML_INFERENCE_PROFILE", "fp32").lower()
+            if self.inference_profile not in INFERENCE_PROFILES:
+                logger.warning(f"⚠️ 未知的推論設定檔 {self.inference_profile}，改用 fp32")
+                self.inference_profile = "fp32"
+            self.int4_group_size = int(os.getenv("ML_INT4_GROUP_SIZE", "128"))
+            # 各設定檔的準確率檢查結果（由 ml/evaluate_ml_service.py profiles 產生）
+            self.profile_report_path = os.getenv(
+                "ML_PROFILE_REPORT_PATH", os.path.join(self.model_path, "profile_report.json"))
+            # 推論後端：pytorch / sdpa / compile / onnx（同一套評分與生成邏輯，在不同執行引擎上運行）
+            self.inference_backend = os.getenv("ML_INFERENCE_BACKEND", "pytorch").lower()
+            if self.inference_backend not in INFERENCE_BACKENDS:
+                logger.warning(f"⚠️ 未知的推論後端 {self.inference_backend}，改用 pytorch")
+                self.inference_backend = "pytorch"
+            self.onnx_dir = os.getenv("ML_ONNX_DIR", os.path.join(self.model_path, "onnx"))
+            # 各後端的一致性與延遲比較結果（由 ml/evaluate_ml_service.py backends 產生）
+            self.backend_report_path = os.getenv(
+                "ML_BACKEND_REPORT_PATH", os.path.join(self.model_path, "backend_report.json"))
+            self._backend = None
+            self._load_stats = {}
+            self._latencies = {mode: deque(maxlen=1000) for mode in INFERENCE_MODES}
+            # 各批次的 token 數、prefill / decode 時間與記憶體峰值（/stats 與 /metrics）
+            self.metrics = InferenceMetrics()
+            # CPU 上以 /proc/self/clear_refs 重設整個進程的 VmHWM 來量測批次峰值，需要保留進程峰值時關閉
+            self.batch_peak_rss = os.getenv("ML_BATCH_PEAK_RSS", "true").lower() == "true"
+            
+            # 指令前綴 KV cache 重用
+            self.prefix_cache_enabled = os.getenv("ML_PREFIX_CACHE", "true").lower() == "true"
+            
+            # 推論結果快取：以正規化代碼 + 模型版本為索引（記憶體 LRU + SQLite 磁碟層 + single-flight）
+            self.result_cache = None
+            if os.getenv("ML_RESULT_CACHE", "true").lower() == "true":
+                self.result_cache = ResultCache(
+                    memory_size=int(os.getenv("ML_RESULT_CACHE_SIZE", "1024")),
+                    db_path=os.getenv("ML_RESULT_CACHE_PATH", "./ml_result_cache/results.sqlite3") or None,
+                    ttl_seconds=float(os.getenv("ML_RESULT_CACHE_TTL_HOURS", "168")) * 3600,
+                    rename_identifiers=os.getenv("ML_CACHE_RENAME_IDENTIFIERS", "false").lower() == "true"
+                )
+            self._model_version = None
+            
+            # 超過提示詞上限的合約切成重疊窗口（關閉時維持截斷）
+            self.max_prompt_tokens = int(os.getenv("ML_MAX_PROMPT_TOKENS", "2048"))
+            self.sliding_window_enabled = os.getenv("ML_SLIDING_WINDOW", "true").lower() == "true"
+            self.window_overlap_tokens = int(os.getenv("ML_WINDOW_OVERLAP_TOKENS", "256"))
+            self._window_stats = {"windowed_requests": 0, "windows": 0}
+            
+            # 分詞前壓縮輸入：移除註解、空行、重複的 use 與樣板，依安全相關性排序
+            self.input_compaction = os.getenv("ML_INPUT_COMPACTION", "true").lower() == "true"
+            self._compaction_stats = {"requests": 0, "original_tokens": 0, "tokens": 0}
+            
+            # 級聯推論：快速分類層信心度達門檻時直接回答，否則升級到 LoRA 模型（僅標籤評分模式）
+            self.fast_tier_path = os.getenv("ML_FAST_TIER_PATH", os.path.join(self.model_path, "fast_tier.npz"))
+            self.fast_tier = None
+            if os.getenv("ML_FAST_TIER", "true").lower() == "true" and os.path.exists(self.fast_tier_path):
+                self.fast_tier = FastTierClassifier.load(self.fast_tier_path)
+            fast_tier_threshold = os.getenv("ML_FAST_TIER_THRESHOLD")
+            self.fast_tier_threshold = float(fast_tier_threshold) if fast_tier_threshold else float(
+                self.fast_tier.metadata.get("suggested_threshold", CONSERVATIVE_THRESHOLD) if self.fast_tier
+                else CONSERVATIVE_THRESHOLD)
+            # 快速層直接回答的請求中，抽樣在背景送 LoRA 模型比對，統計門檻以上的一致率
+            self.fast_tier_audit_rate = float(os.getenv("ML_FAST_TIER_AUDIT_RATE", "0.05"))
+            self.cascade = CascadeMonitor()
+            self._audit_tasks = set()
+            if self.fast_tier is not None:
+                logger.info(f"✅ 快速分類層已載入: {self.fast_tier_path} (門檻 {self.fast_tier_threshold}，"
+                            f"指紋 {self.fast_tier.fingerprint})")
+            
+            # SSE 串流：首個事件（標籤）的延遲
+            self._stream_stats = {"streams": 0, "completed": 0, "cancelled": 0}
+            self._ttft = deque(maxlen=1000)
+            
+            # 批次端點：單一請求的項目上限，以及同時送入推論排程器的不重複項目數（避免超過排隊上限）
+            self.batch_max_items = int(os.getenv("ML_BATCH_API_MAX_ITEMS", "256"))
+            self.batch_concurrency = max(1, int(os.getenv("ML_BATCH_API_CONCURRENCY", "16")))
+            self._batch_api_stats = {"requests": 0, "items": 0, "unique_items": 0, "errors": 0, "cancelled": 0}
+            
+            # 推測解碼：小型草稿模型提出候選 token，由主模型驗證（輸出與貪婪解碼相同）
+            self.draft_model_name = os.getenv("ML_DRAFT_MODEL_NAME", "")
+            self.draft_num_tokens = max(1, int(os.getenv("ML_DRAFT_NUM_TOKENS", "5")))
+            self.draft_confidence_threshold = float(os.getenv("ML_DRAFT_CONFIDENCE_THRESHOLD", "0.4"))
+            self.speculative_default = os.getenv("ML_SPECULATIVE_DEFAULT", "false").lower() == "true"
+            self.decoding = DecodingMonitor()
+            
+            # 多進程推論：載入模型後 fork 出 N 個 worker，以 copy-on-write 共享權重
+            self.num_workers = max(1, int(os.getenv("ML_NUM_WORKERS", "1")))
+            if self.num_workers > 1 and self._device == "cuda":
+                logger.warning("⚠️ 多進程推論僅支援 CPU，GPU 模式使用單一進程")
+                self.num_workers = 1
+            worker_threads = os.getenv("ML_WORKER_THREADS")
+            self.worker_threads = int(worker_threads) if worker_threads else None
+            self.worker_affinity = os.getenv("ML_WORKER_AFFINITY", "auto")
+            
+            # 動態微批次：窗口內到達的請求合併為一次推論
+            batch_config = {
+                "max_batch_size": int(os.getenv("ML_BATCH_MAX_SIZE", "8")),
+                "max_wait_ms": float(os.getenv("ML_BATCH_MAX_WAIT_MS", "10")),
+                "max_batch_tokens": int(os.getenv("ML_BATCH_MAX_TOKENS", "8192")),
+                "max_concurrent_batches": self.num_workers,
+                "max_queue_depth": int(os.getenv("ML_MAX_QUEUE_DEPTH", "64"))
+            }
+            # 專用推論執行緒：推論與模型載入都不在事件迴圈上執行
+            self.executor = InferenceExecutor(int(os.getenv("ML_EXECUTOR_QUEUE_SIZE", "8")))
+            self.batch_scheduler = BatchScheduler(partial(self._run_batch, "generate"), name="generate", **batch_config)
+            self.score_scheduler = BatchScheduler(partial(self._run_batch, "score"), name="score", **batch_config)
+            # assisted decoding 只支援單一序列，推測解碼的請求不合併批次
+            self.speculative_scheduler = BatchScheduler(partial(self._run_batch, "speculative"), name="speculative",
+                                                        **{**batch_config, "max_batch_size": 1})
+            # 串流請求逐 token 回傳，每個生成只服務一個請求
+            self.stream_scheduler = BatchScheduler(partial(self._run_batch, "stream"), name="stream",
+                                                   **{**batch_config, "max_batch_size": 1})
+            
+            # 生命週期：啟動時背景預載入（ML_PRELOAD），閒置超過 ML_IDLE_UNLOAD_MINUTES 分鐘後卸載
+            self.preload_enabled = os.getenv("ML_PRELOAD", "false").lower() == "true"
+            self.lifecycle = ModelLifecycle(
+                self._run_load, self._run_unload,
+                idle_unload_seconds=float(os.getenv("ML_IDLE_UNLOAD_MINUTES", "0")) * 60
+            )
+            
             self._config_loaded = True
             logger.info("✅ ML 模型配置已載入")
     
+    @property
+    def is_loading(self) -> bool:
+        return self.lifecycle.state == "loading"
+    
     async def ensure_model_loaded(self):
-        """確保模型已載入（懶加載）"""
-        if self._initialized:
-            return True
+        """確保模型已載入（懶加載，或等待背景預載入完成）
         
-        # 防止重複載入
-        if self._loading:
-            # 等待其他請求完成載入
-            while self._loading:
-                await asyncio.sleep(0.5)
-            return self._initialized
-        
-        with self._lock:
-            if self._initialized:
-                return True
-            
-            self._loading = True
-            try:
-                await self._load_model()
-                self._initialized = True
-                logger.info("✅ ML 模型載入完成")
-                return True
-            except Exception as e:
-                logger.error(f"❌ ML 模型載入失敗: {e}")
-                raise
-            finally:
-                self._loading = False
+        第一個請求建立載入工作，之後的請求直接 await 同一個工作（不輪詢）；閒置卸載進行中時先等卸載完成再重新載入。
+        載入失敗時所有等待者都收到同一個例外，下一個請求會重新嘗試載入
+        """
+        await self.lifecycle.ensure_ready()
+        return True
     
-    async def _load_model(self):
+    async def _run_load(self):
+        try:
+            # 在推論執行緒上載入，事件迴圈在載入期間仍可回應其他請求
+            await self.executor.run(self._load_model)
+            self._initialized = True
+            logger.info("✅ ML 模型載入完成")
+        except Exception as e:
+            logger.error(f"❌ ML 模型載入失敗: {e}")
+            raise
+    
+    async def _run_unload(self):
+        # 在推論執行緒上卸載：排在已提交的推論之後執行
+        await self.executor.run(self.unload_model)
+    
+    def _load_model(self):
         """實際載入模型（私有方法）"""
         try:
-            logger.info(f"🔄 開始載入 LoRA 模型: {self.base_model_name}")
+            if self.num_workers > 1:
+                # fork 之後子進程無法使用主進程已啟動的 OpenMP 執行緒池，主進程全程保持單執行緒
+                torch.set_num_threads(1)
             
-            # 載入 tokenizer
-            logger.info("📚 載入 tokenizer...")
-            self._tokenizer = AutoTokenizer.from_pretrained(self.base_model_name)
-            if self._tokenizer.pad_token is None:
-                self._tokenizer.pad_token = self._tokenizer.eos_token
+            load_started = time.time()
+            profile = self.inference_profile
+            if self._device == "cuda" and profile == "int8":
+                # 動態量化只支援 CPU
+                logger.warning("⚠️ int8 動態量化僅支援 CPU，GPU 上改用 fp32 設定檔")
+                profile = self.inference_profile = "fp32"
+            dtype = load_dtype(profile, self._device)
+            logger.info(f"⚙️ 推論設定檔: {profile} (載入精度 {str(dtype).replace('torch.', '')})")
             
-            # 根據設備類型配置模型載入參數
-            if self._device == "cuda":
-                # GPU 模式：使用 float16 加速，支援記憶體限制
-                max_memory_gb = int(os.getenv("ML_MAX_MEMORY_GB", "10"))
-                logger.info(f"💾 GPU 記憶體限制: {max_memory_gb}GB")
-                
-                logger.info("🧠 載入基礎模型 (GPU 模式)...")
-                base_model = AutoModelForCausalLM.from_pretrained(
-                    self.base_model_name,
-                    torch_dtype=torch.float16,  # GPU 使用 FP16 加速
-                    device_map="cuda:0",
-                    low_cpu_mem_usage=True
-                )
-            else:
-                # CPU 模式：使用 float32，不需要 device_map
-                logger.info("🧠 載入基礎模型 (CPU 模式)...")
-                base_model = AutoModelForCausalLM.from_pretrained(
-                    self.base_model_name,
-                    torch_dtype=torch.float32,  # CPU 使用 FP32
-                    low_cpu_mem_usage=True
-                )
-                base_model = base_model.to(self._device)
+            manifest = read_manifest(self.merged_model_path) if self.merged_model_path else None
+            if self.merged_model_path and manifest is None:
+                logger.warning(f"⚠️ 未找到合併檢查點: {self.merged_model_path}，改為載入基礎模型與 LoRA")
             
-            # 載入 LoRA 微調權重
-            if os.path.exists(self.model_path):
-                logger.info(f"🎯 載入 LoRA 微調權重: {self.model_path}")
-                try:
-                    if self._device == "cuda":
-                        # GPU 模式
-                        self._model = PeftModel.from_pretrained(
-                            base_model, 
-                            self.model_path,
-                            torch_dtype=torch.float16
-                        )
-                    else:
-                        # CPU 模式
-                        self._model = PeftModel.from_pretrained(
-                            base_model, 
-                            self.model_path,
-                            torch_dtype=torch.float32
-                        )
-                    logger.info("✅ LoRA 模型載入成功")
-                except Exception as e:
-                    logger.warning(f"⚠️ LoRA 載入失敗，直接使用基礎模型: {e}")
-                    # 如果 LoRA 載入失敗，直接使用基礎模型
-                    self._model = base_model
-                    logger.info("✅ 使用基礎模型（無 LoRA）")
+            if manifest is not None:
+                profile = self._load_merged_checkpoint(manifest, profile, dtype)
             else:
-                logger.warning(f"⚠️ 未找到 LoRA 模型路徑: {self.model_path}")
-                lora_config = LoraConfig(
-                    r=8,
-                    lora_alpha=16,
-                    target_modules=["q_proj", "v_proj"],
-                    lora_dropout=0.05,
-                    bias="none",
-                    task_type="CAUSAL_LM"
-                )
-                self._model = get_peft_model(base_model, lora_config)
+                self._load_base_with_lora(dtype)
+            
+            # 量化設定檔：先將 LoRA 合併進基礎權重，再量化解碼器線性層（預量化的檢查點已完成）
+            if requires_merge(profile) and not (manifest and manifest.get("quantization") == profile):
+                if isinstance(self._model, PeftModel):
+                    self._model = self._model.merge_and_unload()
+                    logger.info("🔗 LoRA 權重已合併進基礎模型")
+                self._model = apply_profile(self._model, profile, self.int4_group_size)
+                gc.collect()
             
             # 設置為評估模式
             self._model.eval()
             
+            # 權重記憶體在後端轉換前統計（ONNX 後端的權重由 ONNX Runtime 持有）
+            memory = model_memory_bytes(self._model)
+            weights = self._weights_fingerprint(manifest, profile)
+            self._prepare_backend(profile, weights)
+            
+            # 建立標籤評分器（預先分詞各標籤的續寫）與結構化解碼程式
+            self._label_scorer = LabelScorer(self._tokenizer)
+            self._structured_program = StructuredOutputProgram(self._tokenizer, self.reason_max_tokens)
+            
+            # 額外的 adapter 須在 fork worker 之前附加，與基礎權重一樣以 copy-on-write 共享
+            self._attach_adapters(dtype)
+            
+            # 預先計算指令前綴的 KV cache（須在量化之後，與實際推論使用相同的權重；每個 adapter 各一份）
+            if self.prefix_cache_enabled:
+                prefix_ids = self._tokenizer(PROMPT_PREFIX)["input_ids"]
+                for adapter in self._adapters.values():
+                    self._use_adapter(adapter.key)
+                    adapter.prefix_cache = PrefixCache(self._model, prefix_ids, self._device)
+                self._use_adapter(DEFAULT_ADAPTER)
+            
+            # 草稿模型須在 fork worker 之前載入，與主模型一樣以 copy-on-write 共享
+            if self.draft_model_name and self._backend.supports_speculative:
+                self._load_draft_model(dtype, profile)
+            elif self.draft_model_name:
+                logger.warning(f"⚠️ 推論後端 {self._backend.name} 不支援推測解碼，略過草稿模型")
+            
             # 記憶體使用報告
             if self._device == "cuda":
                 memory_allocated = torch.cuda.memory_allocated() / 1024**3  # GB
@@ -236,46 +446,413 @@ class MLModelSingleton:
             else:
                 logger.info("📊 CPU 模式運行中")
             
+            self._load_stats = {
+                "source": "merged_checkpoint" if manifest is not None else "base_with_lora",
+                "backend": self._backend.name,
+                "load_time_s": round(time.time() - load_started, 2),
+                "model_memory_mb": round(memory["total"] / 1024**2, 1),
+                "model_memory_by_dtype_mb": {
+                    dtype_name: round(size / 1024**2, 1) for dtype_name, size in memory["by_dtype"].items()
+                },
+                "rss_after_load_mb": round(psutil.Process().memory_info().rss / 1024**2, 1)
+            }
+            if self._draft_model is not None:
+                self._load_stats["draft_model_memory_mb"] = round(
+                    model_memory_bytes(self._draft_model)["total"] / 1024**2, 1)
+            logger.info(f"📊 模型權重記憶體: {self._load_stats['model_memory_mb']:.1f} MB "
+                        f"(設定檔 {profile}，載入耗時 {self._load_stats['load_time_s']:.1f}s)")
+            
+            self._model_version = self._compute_model_version(weights, profile)
+            for adapter in self._adapters.values():
+                adapter.version = self._adapter_version(adapter)
+            
+            if self.num_workers > 1:
+                self._worker_pool = self._start_worker_pool()
+            
             logger.info(f"✅ ML 模型載入完成 (設備: {self._device})")
             
         except Exception as e:
             logger.error(f"❌ 模型載入失敗: {e}")
             raise
     
-    def extract_label(self, output_text: str) -> str:
-        """從輸出文本提取漏洞標籤 - 對應5種類型"""
-        output_lower = output_text.lower()
-        
-        # Resource Leak (資源洩漏)
-        if "resource leak" in output_lower or "資源洩漏" in output_text or "资源泄漏" in output_text:
-            return "resource_leak"
-        # Arithmetic Overflow (算術溢位)
-        elif "overflow" in output_lower or "溢位" in output_text or "溢出" in output_text or "arithmetic" in output_lower:
-            return "arithmetic_overflow"
-        # Unchecked Return (未檢查返回值)
-        elif "unchecked" in output_lower or "return" in output_lower or "未檢查" in output_text or "返回值" in output_text:
-            return "unchecked_return"
-        # Cross-Module Pollution (跨模組污染)
-        elif "cross-module" in output_lower or "pollution" in output_lower or "跨模組" in output_text or "污染" in output_text:
-            return "cross_module_pollution"
-        # Capability Leak (權限洩漏)
-        elif "capability" in output_lower or "access control" in output_lower or "權限" in output_text or "存取控制" in output_text:
-            return "capability_leak"
-        # Safe (未發現明顯漏洞)
-        elif "未發現明顯漏洞" in output_text or "未發現漏洞" in output_text or "安全" in output_text or "safe" in output_lower:
-            return "safe"
+    def _start_worker_pool(self) -> WorkerPool:
+        """fork 出推論 worker 池（worker 繼承目前模型上已附加的所有 adapter 版本）"""
+        pool = WorkerPool(
+            {kind: partial(self._execute_batch, kind) for kind in ("score", "generate", "speculative")},
+            self.num_workers, self.worker_threads, self.worker_affinity
+        )
+        pool.start()
+        return pool
+    
+    def _load_draft_model(self, dtype: torch.dtype, profile: str):
+        """載入推測解碼的草稿模型（失敗時只停用推測解碼，不影響主模型）"""
+        logger.info(f"🪶 載入推測解碼草稿模型: {self.draft_model_name}")
+        try:
+            draft = load_draft_model(self.draft_model_name, dtype, self._device, self._model, self.draft_num_tokens,
+                                     self.draft_confidence_threshold)
+            # 草稿模型與主模型使用相同的量化設定檔
+            self._draft_model = apply_profile(draft, profile, self.int4_group_size)
+            logger.info(f"✅ 草稿模型載入完成 (每輪 {self.draft_num_tokens} 個候選 token)")
+        except Exception as e:
+            self._draft_model = None
+            logger.warning(f"⚠️ 草稿模型載入失敗，推測解碼停用: {e}")
+    
+    def _attach_adapters(self, dtype: torch.dtype):
+        """登記預設 adapter，並將 ML_LORA_ADAPTERS 的 adapter 附加到同一個 PeftModel
+        
+        合併檢查點、需要合併 LoRA 的量化設定檔與 ONNX 後端已沒有獨立的 LoRA 權重，只提供預設 adapter
+        """
+        self._adapters = {DEFAULT_ADAPTER: LoadedAdapter(
+            DEFAULT_ADAPTER, self.model_path,
+            adapter_fingerprint(self.model_path) if os.path.exists(self.model_path) else None,
+            self.score_calibration, memory_bytes=adapter_memory_bytes(self._model, DEFAULT_ADAPTER))}
+        self._active_adapter = DEFAULT_ADAPTER
+        extra = {name: path for name, path in self.lora_adapters.items() if name != DEFAULT_ADAPTER}
+        if extra and not isinstance(self._model, PeftModel):
+            logger.warning(f"⚠️ 目前的模型已合併 LoRA（設定檔 {self.inference_profile}，後端 {self._backend.name}），"
+                           f"無法附加 adapter: {', '.join(extra)}")
+            extra = {}
+        
+        for name, path in extra.items():
+            try:
+                adapter = self._load_adapter_version(name, path, dtype)
+            except Exception as e:
+                logger.warning(f"⚠️ adapter {name} 載入失敗: {path} ({e})")
+                continue
+            self._adapters[name] = adapter
+            logger.info(f"🧩 已附加 adapter {name}: {path} ({adapter.memory_bytes / 1024**2:.1f} MB)")
+        self._adapter_versions = {adapter.key: adapter for adapter in self._adapters.values()}
+    
+    def _load_adapter_version(self, name: str, path: str, dtype: torch.dtype, key: Optional[str] = None
+                              ) -> LoadedAdapter:
+        """以 PEFT 具名 adapter 附加一個 adapter 版本（key 為模型上的名稱，預設與 adapter 名稱相同）"""
+        key = key or name
+        self._model.load_adapter(path, adapter_name=key, torch_dtype=dtype)
+        return LoadedAdapter(
+            name, path, adapter_fingerprint(path),
+            load_calibration(os.path.join(path, "score_calibration.json"),
+                             float(os.getenv("ML_SCORE_TEMPERATURE", "1.0"))),
+            memory_bytes=adapter_memory_bytes(self._model, key), key=key)
+    
+    def _use_adapter(self, key: str):
+        """切換作用中的 adapter 版本與對應的前綴 cache（在執行推論的進程中呼叫，同一進程一次只執行一個批次）"""
+        adapter = self._adapter_versions[key]
+        if key != self._active_adapter:
+            self._model.set_adapter(key)
+            self._active_adapter = key
+        self._prefix_cache = adapter.prefix_cache
+    
+    def _adapter_version(self, adapter: LoadedAdapter) -> str:
+        """啟動時載入的預設 adapter 沿用模型版本（既有快取仍有效），其他版本加上其權重指紋與校準"""
+        if adapter.key == DEFAULT_ADAPTER:
+            return self._model_version
+        version = json.dumps({
+            "model": self._model_version,
+            "adapter": adapter.fingerprint,
+            "calibration": adapter.calibration
+        }, sort_keys=True)
+        return hashlib.sha256(version.encode("utf-8")).hexdigest()[:16]
+    
+    def _resolve_adapter(self, name: Optional[str]) -> str:
+        """請求的 adapter 名稱（None 為預設），未設定時拋出 AdapterNotAvailable"""
+        name = name or DEFAULT_ADAPTER
+        if name not in self.lora_adapters:
+            raise AdapterNotAvailable(f"Unknown adapter: {name} (available: {', '.join(self.lora_adapters)})")
+        return name
+    
+    def _loaded_adapter(self, name: str) -> LoadedAdapter:
+        """模型載入後取得 adapter 目前的版本，設定了但未能附加時拋出 AdapterNotAvailable"""
+        adapter = self._adapters.get(name)
+        if adapter is None:
+            raise AdapterNotAvailable(f"Adapter not loaded: {name}")
+        return adapter
+    
+    @contextmanager
+    def _pinned_adapter(self, name: str):
+        """將請求固定在 adapter 目前的版本上，返回版本的 key
+        
+        熱更新切換後，進行中的請求仍以舊版本完成；被取代的版本在最後一個請求結束後從模型上刪除
+        """
+        adapter = self._loaded_adapter(name)
+        with self._pinned_version(adapter):
+            yield adapter.key
+    
+    @contextmanager
+    def _pinned_version(self, adapter: LoadedAdapter):
+        adapter.refs += 1
+        try:
+            yield
+        finally:
+            adapter.refs -= 1
+            if adapter.retired and adapter.refs == 0:
+                self._schedule_free(adapter)
+    
+    def _schedule_free(self, adapter: LoadedAdapter):
+        async def free():
+            # 在推論執行緒上刪除，排在已提交的批次之後；佇列已滿時稍後重試
+            for attempt in range(10):
+                try:
+                    await self.executor.run(self._free_adapter_version, adapter)
+                    return
+                except InferenceQueueFull:
+                    await asyncio.sleep(0.5 * (attempt + 1))
+                except Exception as e:
+                    logger.warning(f"⚠️ 釋放 adapter 版本 {adapter.key} 失敗: {e}")
+                    return
+        
+        task = asyncio.get_running_loop().create_task(free())
+        self._swap_tasks.add(task)
+        task.add_done_callback(self._swap_tasks.discard)
+    
+    def _free_adapter_version(self, adapter: LoadedAdapter):
+        """從模型上刪除 adapter 版本（模型已卸載或重新載入時略過）"""
+        # 排程後又被固定（例如快取中的共用推論）時略過，最後一個使用者結束時會再排程
+        if self._adapter_versions.get(adapter.key) is not adapter or adapter.refs > 0:
+            return
+        self._model.delete_adapter(adapter.key)
+        del self._adapter_versions[adapter.key]
+        adapter.prefix_cache = None
+        if self._active_adapter == adapter.key:
+            # PEFT 刪除作用中的 adapter 後會改用其他 adapter（並發出警告），下一個批次重新設定
+            self._active_adapter = None
+            self._prefix_cache = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        logger.info(f"🗑️ 已釋放 adapter {adapter.name} 的舊版本 {adapter.key}")
+    
+    def _prepare_backend(self, profile: str, weights: str):
+        """套用推論後端；後端不支援目前的設備或設定檔時退回 pytorch"""
+        backend = self.inference_backend
+        if backend == "onnx" and (self._device == "cuda" or profile != "fp32"):
+            logger.warning(f"⚠️ ONNX 後端僅支援 CPU 與 fp32 設定檔（目前 {self._device} / {profile}），改用 pytorch")
+            backend = self.inference_backend = "pytorch"
+        self._backend = create_backend(
+            backend,
+            onnx_dir=self.onnx_dir,
+            fingerprint=hashlib.sha256(weights.encode("utf-8")).hexdigest()[:16],
+            compile_mode=os.getenv("ML_COMPILE_MODE") or None
+        )
+        if backend != "pytorch":
+            logger.info(f"⚙️ 推論後端: {backend}")
+        self._model = self._backend.prepare(self._model, self._device)
+        gc.collect()
+    
+    def _weights_fingerprint(self, manifest: Optional[Dict], profile: str) -> str:
+        """載入的權重（基礎模型、adapter 或合併檢查點、設定檔），ONNX 匯出圖以此區分"""
+        if manifest is not None:
+            weights = f"merged:{manifest.get('adapter_fingerprint')}:{manifest.get('dtype')}:{manifest.get('quantization')}"
+        elif os.path.exists(self.model_path):
+            weights = f"lora:{adapter_fingerprint(self.model_path)}"
         else:
-            # 默認根據常見關鍵字判斷
-            if "邏輯" in output_text or "logic" in output_lower:
-                return "arithmetic_overflow"
-            elif "隨機" in output_text or "random" in output_lower:
-                return "unchecked_return"
-            else:
-                return "safe"
+            weights = "base"
+        return f"{self.base_model_name}|{weights}|{profile}"
     
-    async def classify_vulnerability(self, move_code: str) -> Dict:
-        """使用 LoRA 模型分類智能合約漏洞"""
-        import time
+    def _compute_model_version(self, weights: str, profile: str) -> str:
+        """影響推論結果的模型版本指紋（權重、設定檔、後端、校準），作為結果快取索引的一部分"""
+        version = json.dumps({
+            "base_model": self.base_model_name,
+            "weights": weights,
+            "profile": profile,
+            "backend": self.inference_backend,
+            "calibration": self.score_calibration,
+            "reason_max_tokens": self.reason_max_tokens,
+            "prefix_cache": self.prefix_cache_enabled,
+            "input_compaction": self.input_compaction
+        }, sort_keys=True)
+        return hashlib.sha256(version.encode("utf-8")).hexdigest()[:16]
+    
+    def _load_merged_checkpoint(self, manifest: Dict, profile: str, dtype: torch.dtype) -> str:
+        """以記憶體映射載入預先合併的檢查點，返回實際使用的設定檔"""
+        logger.info(f"📦 載入合併檢查點 (記憶體映射): {self.merged_model_path}")
+        self._tokenizer = AutoTokenizer.from_pretrained(self.merged_model_path)
+        if self._tokenizer.pad_token is None:
+            self._tokenizer.pad_token = self._tokenizer.eos_token
+        
+        if os.path.exists(self.model_path) and manifest.get("adapter_fingerprint"):
+            if adapter_fingerprint(self.model_path) != manifest["adapter_fingerprint"]:
+                logger.warning("⚠️ LoRA adapter 在匯出後已變更，合併檢查點可能過期，請重新執行 export_merged_model.py")
+        
+        self._model, _ = load_merged_model(self.merged_model_path, self._device)
+        
+        quantization = manifest.get("quantization")
+        if quantization:
+            if quantization != profile:
+                logger.info(f"⚙️ 合併檢查點已預量化為 {quantization}，推論設定檔改為 {quantization}")
+            profile = self.inference_profile = quantization
+        elif not requires_merge(profile) and EXPORT_DTYPES.get(manifest.get("dtype")) != dtype:
+            # 精度與設定檔不同時需要轉換（會複製權重，失去記憶體映射的共享）
+            logger.warning(f"⚠️ 合併檢查點精度為 {manifest.get('dtype')}，轉換為設定檔 {profile} 的精度")
+            self._model = self._model.to(dtype)
+        return profile
+    
+    def _load_base_with_lora(self, dtype: torch.dtype):
+        """載入基礎模型並套用 LoRA 微調權重"""
+        logger.info(f"🔄 開始載入 LoRA 模型: {self.base_model_name}")
+        
+        # 載入 tokenizer
+        logger.info("📚 載入 tokenizer...")
+        self._tokenizer = AutoTokenizer.from_pretrained(self.base_model_name)
+        if self._tokenizer.pad_token is None:
+            self._tokenizer.pad_token = self._tokenizer.eos_token
+        
+        # 根據設備類型配置模型載入參數
+        if self._device == "cuda":
+            # GPU 模式：預設 float16 加速，支援記憶體限制
+            max_memory_gb = int(os.getenv("ML_MAX_MEMORY_GB", "10"))
+            logger.info(f"💾 GPU 記憶體限制: {max_memory_gb}GB")
+            
+            logger.info("🧠 載入基礎模型 (GPU 模式)...")
+            base_model = AutoModelForCausalLM.from_pretrained(
+                self.base_model_name,
+                torch_dtype=dtype,
+                device_map="cuda:0",
+                low_cpu_mem_usage=True
+            )
+        else:
+            # CPU 模式：依設定檔選擇 float32 / bfloat16，不需要 device_map
+            logger.info("🧠 載入基礎模型 (CPU 模式)...")
+            base_model = AutoModelForCausalLM.from_pretrained(
+                self.base_model_name,
+                torch_dtype=dtype,
+                low_cpu_mem_usage=True
+            )
+            base_model = base_model.to(self._device)
+        
+        # 載入 LoRA 微調權重
+        if os.path.exists(self.model_path):
+            logger.info(f"🎯 載入 LoRA 微調權重: {self.model_path}")
+            try:
+                self._model = PeftModel.from_pretrained(
+                    base_model, 
+                    self.model_path,
+                    torch_dtype=dtype
+                )
+                logger.info("✅ LoRA 模型載入成功")
+            except Exception as e:
+                logger.warning(f"⚠️ LoRA 載入失敗，直接使用基礎模型: {e}")
+                # 如果 LoRA 載入失敗，直接使用基礎模型
+                self._model = base_model
+                logger.info("✅ 使用基礎模型（無 LoRA）")
+        else:
+            logger.warning(f"⚠️ 未找到 LoRA 模型路徑: {self.model_path}")
+            lora_config = LoraConfig(
+                r=8,
+                lora_alpha=16,
+                target_modules=["q_proj", "v_proj"],
+                lora_dropout=0.05,
+                bias="none",
+                task_type="CAUSAL_LM"
+            )
+            self._model = get_peft_model(base_model, lora_config)
+    
+    async def classify_vulnerability(self, move_code: str, mode: Optional[str] = None,
+                                     speculative: Optional[bool] = None, profile: bool = False,
+                                     adapter: Optional[str] = None) -> Dict:
+        """分類智能合約漏洞：快速分類層有把握時直接回答，否則使用 LoRA 模型
+        
+        speculative 只影響 generate 模式（是否以草稿模型推測解碼），None 時依 ML_SPECULATIVE_DEFAULT；
+        profile 為 True 時在結果的 profile 欄位附上各階段耗時（快速分類層、壓縮、分詞、排隊、prefill、decode）；
+        adapter 選擇 ML_LORA_ADAPTERS 中的 adapter（None 為預設），快速分類層只代替預設 adapter 回答
+        """
+        adapter = self._resolve_adapter(adapter)
+        self._adapter_requests[adapter] += 1
+        with profiling(profile) as request_profile:
+            result = await self._classify_tiered(move_code, mode, speculative, adapter)
+        if request_profile is not None:
+            result["profile"] = request_profile.summary()
+        return result
+    
+    async def _classify_tiered(self, move_code: str, mode: Optional[str], speculative: Optional[bool],
+                               adapter: str) -> Dict:
+        start_time = time.time()
+        mode = (mode or self.inference_mode).lower()
+        speculative = self.speculative_default if speculative is None else speculative
+        
+        fast = None
+        if self.fast_tier is not None and mode == "score" and adapter == DEFAULT_ADAPTER:
+            with profile_stage("fast_tier"):
+                fast = self.fast_tier.predict(move_code)
+            label, confidence, probabilities = fast
+            if confidence >= self.fast_tier_threshold:
+                self.cascade.record_fast(time.time() - start_time)
+                # 稽核不為此載入模型（模型未載入或已閒置卸載時略過）
+                if self._initialized and random.random() < self.fast_tier_audit_rate:
+                    self._schedule_audit(move_code, label, confidence)
+                result = self._classification_result(
+                    label, probabilities, self._score_risk_level(label, confidence),
+                    f"快速分類: {self.vulnerability_names.get(label, label)} (機率 {confidence:.2f})")
+                result.update(self._result_metadata(mode, time.time() - start_time))
+                result["model_version"] = f"fast-tier-{self.fast_tier.fingerprint}"
+                result["tier"] = "fast"
+                return result
+            self.cascade.record_escalation()
+        
+        result = await self._classify_lora(move_code, mode, start_time, speculative, adapter)
+        if fast is not None:
+            self.cascade.record_comparison(fast[0], fast[1], result["classification"])
+            result["tier"] = "lora"
+            result["fast_tier"] = {"classification": fast[0], "confidence": round(fast[1], 4)}
+        return result
+    
+    def _schedule_audit(self, move_code: str, fast_label: str, fast_confidence: float):
+        """背景以 LoRA 模型重新分類快速層已回答的請求，只用於統計一致率
+        
+        稽核不經過結果快取，也不計入延遲統計，避免影響使用者請求的命中率與延遲分位數
+        """
+        async def audit():
+            try:
+                async with self.lifecycle.use():
+                    with self._pinned_adapter(DEFAULT_ADAPTER) as adapter:
+                        result = await self._classify_uncached(move_code, "score", adapter=adapter, record_stats=False)
+            except Exception as e:
+                logger.debug(f"快速層稽核略過: {e}")
+                return
+            self.cascade.record_comparison(fast_label, fast_confidence, result["classification"], audit=True)
+        
+        task = asyncio.get_running_loop().create_task(audit())
+        self._audit_tasks.add(task)
+        task.add_done_callback(self._audit_tasks.discard)
+    
+    async def _classify_lora(self, move_code: str, mode: str, start_time: float, speculative: bool = False,
+                             adapter: str = DEFAULT_ADAPTER) -> Dict:
+        """使用 LoRA 模型分類（相同的正規化代碼直接返回快取結果）
+        
+        推測解碼與標準解碼的輸出相同，兩者共用快取；各 adapter 版本的快取以其模型版本區分
+        """
+        # 使用期間模型不會被閒置卸載（等待載入的時間記為 model_load 階段），adapter 固定在目前的版本
+        async with AsyncExitStack() as stack:
+            with profile_stage("model_load"):
+                await stack.enter_async_context(self.lifecycle.use())
+            adapter = stack.enter_context(self._pinned_adapter(adapter))
+            if self.result_cache is None:
+                return await self._classify_uncached(move_code, mode, speculative, adapter)
+            
+            # 模型版本在載入後才確定（設定檔可能因合併檢查點或設備而改變）
+            loaded = self._adapter_versions[adapter]
+            version = f"{loaded.version}:{mode}"
+            digest = self.result_cache.digest(move_code, version)
+            
+            async def compute() -> Dict:
+                # 推論在快取擁有的任務中執行，發起的請求取消後仍供其他相同請求使用，因此自行固定模型與 adapter 版本
+                async with self.lifecycle.use():
+                    with self._pinned_version(loaded):
+                        return await self._classify_uncached(move_code, mode, speculative, adapter)
+            
+            result = await self.result_cache.get_or_compute(digest, version, compute)
+        if result["cache"]["hit"]:
+            result["processing_time"] = round(time.time() - start_time, 2)
+            result["timestamp"] = datetime.now().isoformat() + "Z"
+            # 權重與校準相同的 adapter 版本共用快取項目
+            result.update(adapter=adapter_name(adapter), adapter_version=adapter)
+        return result
+    
+    async def _classify_uncached(self, move_code: str, mode: str, speculative: bool = False,
+                                 adapter: str = DEFAULT_ADAPTER, record_stats: bool = True) -> Dict:
+        """實際執行推論（超過提示詞上限的合約切成重疊窗口，以最大風險聚合；adapter 為固定的版本 key）
+        
+        record_stats 為 False 時（背景稽核）不計入延遲、窗口與壓縮統計
+        """
         start_time = time.time()
         
         try:
@@ -285,103 +862,660 @@ class MLModelSingleton:
             if not self._model or not self._tokenizer:
                 raise Exception("模型未正確初始化")
             
-            # 構建提示詞
-            instruction = "請分析以下 Sui Move 智能合約代碼，找出潛在的安全漏洞，並評估危險等級（高/中/低）"
-            prompt = f"{instruction}\n\n```move\n{move_code}\n```\n\n分析結果："
-            
-            # 分詞
-            inputs = self._tokenizer(
-                prompt,
-                return_tensors="pt",
-                max_length=2048,
-                truncation=True,
-                padding=True
-            )
+            code, compacted, input_ids, compaction = await asyncio.to_thread(self._prepare_prompt, move_code)
             
-            # 移至正確設備（GPU 或 CPU）
-            inputs = {k: v.to(self._device) for k, v in inputs.items()}
-            
-            # 生成預測 - 使用確定性推理（greedy decoding）
-            with torch.no_grad():
-                outputs = self._model.generate(
-                    **inputs,
-                    max_new_tokens=256,
-                    do_sample=False,  # 關閉隨機採樣，使用貪婪解碼
-                    num_beams=1,      # 不使用 beam search，保持一致性
-                    pad_token_id=self._tokenizer.pad_token_id,
-                    eos_token_id=self._tokenizer.eos_token_id
-                )
+            windows = None
+            if len(input_ids) > self.max_prompt_tokens:
+                # 長合約：各窗口同時送入排程器，與其他請求一起組成批次
+                windows, window_inputs = await asyncio.to_thread(self._encode_windows, code)
+                window_results = await asyncio.gather(
+                    *[self._classify_input(window_ids, mode, speculative, adapter) for window_ids in window_inputs])
+                offending = pick_max_risk(window_results)
+                result = dict(window_results[offending])
+                if record_stats:
+                    self._window_stats["windowed_requests"] += 1
+                    self._window_stats["windows"] += len(windows)
+            else:
+                result = await self._classify_input(input_ids, mode, speculative, adapter)
             
-            # 解碼輸出
-            output_text = self._tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # 提取分析結果部分
-            if "分析結果：" in output_text:
-                output_text = output_text.split("分析結果：", 1)[1].strip()
-            
-            # 提取分類標籤
-            classification = self.extract_label(output_text)
-            
-            # 解析危險等級和信心度
-            confidence = 0.5  # 默認信心度
-            risk_level = "MEDIUM"
-            
-            if "危險等級：高" in output_text or "高風險" in output_text or "嚴重" in output_text:
-                confidence = 0.9
-                risk_level = "HIGH"
-            elif "危險等級：中" in output_text or "中風險" in output_text or "中等" in output_text:
-                confidence = 0.6
-                risk_level = "MEDIUM"
-            elif "危險等級：低" in output_text or "低風險" in output_text or "輕微" in output_text:
-                confidence = 0.3
-                risk_level = "LOW"
-            elif classification == "safe":
-                confidence = 0.8
-                risk_level = "SAFE"
-            
-            # 構建概率分布 - 更新為6種類型
-            probabilities = {
-                "capability_leak": 0.0,
-                "arithmetic_overflow": 0.0,
-                "cross_module_pollution": 0.0,
-                "unchecked_return": 0.0,
-                "resource_leak": 0.0,
-                "safe": 0.0
-            }
+            # 計算處理時間
+            processing_time = time.time() - start_time
+            if record_stats:
+                self._latencies[mode].append(processing_time)
             
-            # 根據分類設置概率
-            probabilities[classification] = confidence
-            remaining_prob = 1.0 - confidence
-            other_count = len(probabilities) - 1
-            for key in probabilities:
-                if key != classification:
-                    probabilities[key] = remaining_prob / other_count
+            result.update(self._result_metadata(mode, processing_time, adapter))
+            if compaction is not None:
+                result["compaction"] = self._record_compaction(compaction) if record_stats else compaction
+            if windows is not None:
+                # 窗口位置以原始代碼的行號表示
+                lines = [compacted.original_range(window.start_line, window.end_line) if compacted is not None
+                         else (window.start_line, window.end_line) for window in windows]
+                result["windows"] = {
+                    "count": len(windows),
+                    "total_tokens": len(input_ids),
+                    "offending_window": {
+                        "index": offending,
+                        "start_line": lines[offending][0],
+                        "end_line": lines[offending][1]
+                    },
+                    "results": [
+                        {
+                            "index": window.index,
+                            "start_line": lines[window.index][0],
+                            "end_line": lines[window.index][1],
+                            "classification": window_result["classification"],
+                            "max_probability": window_result["max_probability"],
+                            "risk_score": window_result["risk_score"]
+                        }
+                        for window, window_result in zip(windows, window_results)
+                    ]
+                }
+            return result
             
-            # 計算風險分數 (0-100)
-            risk_score = self._calculate_risk_score(classification, confidence)
+        except Exception as e:
+            logger.error(f"❌ 漏洞分類失敗: {e}")
+            raise
+    
+    def _compact(self, move_code: str) -> Tuple[str, Optional[CompactedCode]]:
+        """返回送入模型的代碼（未啟用壓縮或壓縮後為空時使用原始代碼）"""
+        if not self.input_compaction:
+            return move_code, None
+        compacted = compact_code(move_code)
+        if not compacted.text.strip():
+            return move_code, None
+        return compacted.text, compacted
+    
+    def _prepare_prompt(self, move_code: str) -> Tuple[str, Optional[CompactedCode], List[int], Optional[Dict]]:
+        """壓縮並分詞（在背景執行緒執行，不阻塞事件迴圈），返回 (送入模型的代碼, 壓縮結果, 提示詞 token, 壓縮統計)"""
+        with profile_stage("compaction"):
+            code, compacted = self._compact(move_code)
+        # 構建提示詞並分詞（padding 在批次中統一處理）
+        with profile_stage("tokenize"):
+            input_ids = self.encode_prompt(code, truncate=not self.sliding_window_enabled)
+        compaction = None
+        if compacted is not None:
+            with profile_stage("compaction"):
+                compaction = self._compaction_info(move_code, compacted, len(input_ids))
+        return code, compacted, input_ids, compaction
+    
+    def _encode_windows(self, code: str) -> Tuple[List[CodeWindow], List[List[int]]]:
+        """切分窗口並分詞（在背景執行緒執行）"""
+        with profile_stage("windowing"):
+            windows = self.split_windows(code)
+            return windows, [self.encode_prompt(window.text) for window in windows]
+    
+    def _compaction_info(self, move_code: str, compacted: CompactedCode, prompt_tokens: int) -> Dict:
+        """每個請求節省的 token 數（以完整提示詞計算，不受截斷影響；壓縮沒有改變代碼時不重新分詞）"""
+        tokens = len(self.encode_prompt(compacted.text, truncate=False)) if not self.sliding_window_enabled \
+            else prompt_tokens
+        original_tokens = tokens if compacted.text == move_code else len(self.encode_prompt(move_code, truncate=False))
+        return {
+            "original_tokens": original_tokens,
+            "tokens": tokens,
+            "tokens_saved": original_tokens - tokens,
+            "saved_ratio": round((original_tokens - tokens) / original_tokens, 4) if original_tokens else 0.0,
+            "removed": {key: value for key, value in compacted.stats.items() if key != "reordered_items"},
+            "reordered_items": compacted.stats["reordered_items"]
+        }
+    
+    def _record_compaction(self, compaction: Dict) -> Dict:
+        """累計壓縮統計（在事件迴圈上呼叫），返回 compaction 本身"""
+        self._compaction_stats["requests"] += 1
+        self._compaction_stats["original_tokens"] += compaction["original_tokens"]
+        self._compaction_stats["tokens"] += compaction["tokens"]
+        return compaction
+    
+    async def _classify_input(self, input_ids: List[int], mode: str, speculative: bool = False,
+                              adapter: str = DEFAULT_ADAPTER) -> Dict:
+        """對一段已分詞的提示詞推論，返回分類、機率與風險（只與使用相同 adapter 的請求合併批次）"""
+        submitted = time.time()
+        if mode == "score":
+            # 單次前向評分：各標籤續寫的對數似然 -> 溫度縮放後的機率分布
+            scores, batch = await self.score_scheduler.submit(input_ids, cost=len(input_ids), group=adapter)
+            self._profile_batch(batch, submitted)
+            calibration = self._adapter_versions[adapter].calibration
+            probabilities = self._label_scorer.probabilities(
+                scores.unsqueeze(0), calibration["temperature"], calibration["bias"])[0]
+            classification = max(probabilities, key=probabilities.get)
+            confidence = probabilities[classification]
+            output_text = f"標籤評分: {self.vulnerability_names.get(classification, classification)} (機率 {confidence:.2f})"
+            return self._classification_result(classification, probabilities,
+                                               self._score_risk_level(classification, confidence), output_text)
+        
+        if speculative and self._draft_model is None:
+            self.decoding.record_fallback()
+            speculative = False
+        if speculative:
+            # 推測解碼：單一序列由草稿模型提出候選、主模型驗證
+            structured, batch = await self.speculative_scheduler.submit(input_ids, cost=len(input_ids), group=adapter)
+        else:
+            # 結構化生成 {label, severity, reason}，交由批次排程器與其他請求合併推論
+            structured, batch = await self.batch_scheduler.submit(input_ids, cost=len(input_ids), group=adapter)
+        self._profile_batch(batch, submitted)
+        self.decoding.record(structured["decoding"])
+        return self._structured_result(structured)
+    
+    @staticmethod
+    def _profile_batch(batch: Dict, submitted: float):
+        """目前請求有啟用 profile 時記錄所在批次的排隊、prefill 與 decode 時間"""
+        profile = current_profile()
+        if profile is not None:
+            profile.add_batch(batch, time.time() - submitted)
+    
+    def _score_risk_level(self, classification: str, confidence: float) -> str:
+        """依分類與信心度決定風險等級（生成模式則由模型輸出的危險等級決定）"""
+        if classification == "safe":
+            return "SAFE"
+        if confidence >= self.confidence_thresholds["high_confidence"]:
+            return "HIGH"
+        if confidence >= self.confidence_thresholds["medium_confidence"]:
+            return "MEDIUM"
+        return "LOW"
+    
+    def _classification_result(self, classification: str, probabilities: Dict[str, float],
+                               risk_level: str, reasoning: str) -> Dict:
+        confidence = probabilities[classification]
+        return {
+            "classification": classification,
+            "vulnerability_type": self.vulnerability_names.get(classification, classification),  # 中文名稱
+            "probabilities": probabilities,
+            "max_probability": confidence,
+            "risk_score": self._calculate_risk_score(classification, confidence),  # 0-100
+            "risk_level": risk_level,
+            "reasoning": reasoning
+        }
+    
+    def _structured_result(self, structured: Dict) -> Dict:
+        """結構化生成的輸出 -> 分類結果"""
+        classification = structured["label"]
+        risk_level = "SAFE" if classification == "safe" else structured["risk_level"]
+        result = self._classification_result(classification, structured["probabilities"], risk_level,
+                                             structured["reason"])
+        result["severity"] = structured["severity"]
+        result["structured_output"] = structured["json"]
+        result["decoding"] = structured["decoding"]
+        return result
+    
+    def _result_metadata(self, mode: str, processing_time: float, adapter: str = DEFAULT_ADAPTER) -> Dict:
+        return {
+            "inference_mode": mode,
+            "adapter": adapter_name(adapter),
+            "adapter_version": adapter,
+            "inference_profile": self.inference_profile,
+            "inference_backend": self.inference_backend,
+            "model_version": "LoRA-Mistral-7B-v1.0",
+            "processing_time": round(processing_time, 2),
+            "timestamp": datetime.now().isoformat() + "Z"
+        }
+    
+    async def stream_vulnerability(self, move_code: str,
+                                   adapter: Optional[str] = None) -> AsyncIterator[Tuple[str, Dict]]:
+        """串流結構化生成：標籤一決定就送出，接著逐步送出 reason 文字，最後送出完整結果
+        
+        產生 (事件類型, 資料)：label、severity、token、done。呼叫端停止迭代（客戶端斷線）時
+        正在執行的生成會在下一步停止，尚未開始的生成直接從推論佇列移除
+        """
+        start_time = time.time()
+        mode = "generate"
+        adapter = self._resolve_adapter(adapter)
+        self._adapter_requests[adapter] += 1
+        self._stream_stats["streams"] += 1
+        # 串流期間模型不會被閒置卸載，adapter 固定在目前的版本
+        async with AsyncExitStack() as stack:
+            await stack.enter_async_context(self.lifecycle.use())
+            adapter = stack.enter_context(self._pinned_adapter(adapter))
+            digest = version = None
+            if self.result_cache is not None:
+                version = f"{self._adapter_versions[adapter].version}:{mode}"
+                digest = self.result_cache.digest(move_code, version)
+                cached = await self.result_cache.lookup(digest, count_miss=True)
+                if cached is not None:
+                    cached["processing_time"] = round(time.time() - start_time, 2)
+                    cached.update(adapter=adapter_name(adapter), adapter_version=adapter)
+                    for event in self._result_events(cached):
+                        yield event
+                    self._stream_stats["completed"] += 1
+                    return
             
-            # 獲取漏洞類型的中文名稱
-            vulnerability_name = self.vulnerability_names.get(classification, classification)
+            _, _, input_ids, compaction = await asyncio.to_thread(self._prepare_prompt, move_code)
+            if len(input_ids) > self.max_prompt_tokens:
+                # 長合約需要多個窗口的最大風險聚合，無法逐 token 串流
+                result = await self._classify_uncached(move_code, mode, adapter=adapter)
+                for event in self._result_events(result):
+                    yield event
+                self._stream_stats["completed"] += 1
+                return
             
-            # 計算處理時間
-            processing_time = time.time() - start_time
+            loop = asyncio.get_running_loop()
+            events: asyncio.Queue = asyncio.Queue()
+            cancelled = Event()
             
-            return {
-                "classification": classification,
-                "vulnerability_type": vulnerability_name,  # 添加中文名稱
-                "probabilities": probabilities,
-                "max_probability": confidence,
-                "risk_score": risk_score,
-                "risk_level": risk_level,
-                "reasoning": output_text,
-                "model_version": "LoRA-Mistral-7B-v1.0",
-                "processing_time": round(processing_time, 2),
-                "timestamp": datetime.now().isoformat() + "Z"
-            }
+            def emit(kind: str, data: Dict):
+                try:
+                    loop.call_soon_threadsafe(events.put_nowait, (kind, data))
+                except RuntimeError:
+                    cancelled.set()
             
+            # 與其他串流共用排程器的排隊上限；多進程模式下在 worker 中生成，事件經結果佇列送回
+            generation = asyncio.ensure_future(self.stream_scheduler.submit(
+                (input_ids, emit, cancelled), cost=len(input_ids), group=adapter))
+            try:
+                while True:
+                    next_event = asyncio.ensure_future(events.get())
+                    await asyncio.wait({next_event, generation}, return_when=asyncio.FIRST_COMPLETED)
+                    if not next_event.done():
+                        next_event.cancel()
+                        break
+                    kind, data = next_event.result()
+                    if kind == "label":
+                        self._ttft.append(time.time() - start_time)
+                        data = self._classification_result(data["label"], data["probabilities"],
+                                                           "SAFE" if data["label"] == "safe" else None, "")
+                        del data["reasoning"]
+                    yield kind, data
+                
+                structured, batch = generation.result()
+                self.decoding.record(structured["decoding"])
+                # 生成結束前送出的事件都已排在佇列中
+                while not events.empty():
+                    yield events.get_nowait()
+                
+                processing_time = time.time() - start_time
+                self._latencies[mode].append(processing_time)
+                result = self._structured_result(structured)
+                result.update(self._result_metadata(mode, processing_time, adapter))
+                if compaction is not None:
+                    result["compaction"] = self._record_compaction(compaction)
+                if digest is not None and structured["complete"]:
+                    self.result_cache.store(digest, version, result)
+                self._stream_stats["completed"] += 1
+                yield "done", result
+            finally:
+                if not generation.done():
+                    cancelled.set()
+                    generation.cancel()
+                    self._stream_stats["cancelled"] += 1
+                    logger.info("🛑 串流已取消，停止生成")
+        
+    async def classify_batch(self, codes: List[str], mode: Optional[str] = None, speculative: Optional[bool] = None,
+                             profile: bool = False, adapter: Optional[str] = None
+                             ) -> AsyncIterator[Tuple[List[int], Dict]]:
+        """批次分類：相同的代碼只推論一次，依完成順序產生 (索引列表, 結果或錯誤)
+        
+        各項目經 classify_vulnerability 送入同一個微批次排程器（與其他請求一起組成批次）；
+        同時進行的不重複項目不超過 batch_concurrency，排程器佇列已滿時稍後重試。單一項目失敗只影響該項目，
+        呼叫端停止迭代時尚未完成的項目直接取消
+        """
+        unique: Dict[str, List[int]] = {}
+        for index, code in enumerate(codes):
+            unique.setdefault(code, []).append(index)
+        self._batch_api_stats["requests"] += 1
+        self._batch_api_stats["items"] += len(codes)
+        self._batch_api_stats["unique_items"] += len(unique)
+        
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        
+        async def classify(code: str, indices: List[int]) -> Tuple[List[int], Dict]:
+            async with semaphore:
+                for attempt in range(3):
+                    try:
+                        return indices, await self.classify_vulnerability(code, mode=mode, speculative=speculative,
+                                                                          profile=profile, adapter=adapter)
+                    except InferenceQueueFull as e:
+                        if attempt < 2:
+                            await asyncio.sleep(0.5 * (attempt + 1))
+                            continue
+                        error = {"error": f"ML service overloaded: {e}", "status_code": 503}
+                    except AdapterNotAvailable as e:
+                        error = {"error": str(e), "status_code": 400}
+                    except Exception as e:
+                        error = {"error": f"Analysis failed: {e}", "status_code": 500}
+                    self._batch_api_stats["errors"] += 1
+                    return indices, error
+        
+        tasks = [asyncio.ensure_future(classify(code, indices)) for code, indices in unique.items()]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            self._batch_api_stats["cancelled"] += len(pending)
+    
+    def _result_events(self, result: Dict):
+        """完整結果（快取或窗口聚合）轉為串流事件"""
+        label = {key: result[key] for key in ("classification", "vulnerability_type", "probabilities",
+                                              "max_probability", "risk_score")}
+        label["risk_level"] = "SAFE" if result["classification"] == "safe" else None
+        yield "label", label
+        if result.get("severity"):
+            yield "severity", {"severity": result["severity"], "risk_level": result["risk_level"]}
+        yield "token", {"text": result["reasoning"]}
+        yield "done", result
+    
+    async def swap_adapter(self, name: str, path: str) -> Dict:
+        """熱更新 adapter：在背景附加新版本，以 canary 提示詞預熱與檢查後原子地切換新請求
+        
+        進行中的請求以舊版本完成，舊版本在最後一個請求結束後刪除；多進程模式下先從附加了新版本的主進程 fork
+        新的 worker 池，切換後舊池處理完已送入的批次即停止。模型未載入時只更新路徑，下次載入時生效
+        """
+        self._resolve_adapter(name)
+        if not os.path.exists(os.path.join(path, "adapter_config.json")):
+            raise AdapterNotAvailable(f"Adapter not found: {path}")
+        if self._swap_lock.locked():
+            raise SwapConflict("Another adapter swap is in progress")
+        
+        async with self._swap_lock:
+            started = time.time()
+            if self.lifecycle.state == "unloaded":
+                self._set_adapter_path(name, path)
+                result = {"adapter": name, "path": path, "status": "configured"}
+            else:
+                async with self.lifecycle.use():
+                    result = await self._swap_loaded_adapter(name, path)
+            result["swap_s"] = round(time.time() - started, 2)
+            self._swap_history.append({**result, "timestamp": datetime.now().isoformat() + "Z"})
+            return result
+    
+    async def _swap_loaded_adapter(self, name: str, path: str) -> Dict:
+        if not isinstance(self._model, PeftModel):
+            raise SwapConflict(f"The model has merged LoRA weights (profile {self.inference_profile}, "
+                               f"backend {self._backend.name}); reload the service to change adapters")
+        previous = self._adapters.get(name)
+        self._swap_serial += 1
+        key = f"{name}{VERSION_SEPARATOR}{self._swap_serial}"
+        logger.info(f"🔄 熱更新 adapter {name}: {path} (版本 {key})")
+        
+        adapter = pool = None
+        try:
+            adapter = await self.executor.run(self._attach_adapter_version, name, path, key)
+            if self._worker_pool is not None:
+                # 新的 worker 須從已附加新版本的主進程 fork
+                pool = await self.executor.run(self._start_worker_pool)
+            canary = await self._run_canaries(adapter, previous, pool)
         except Exception as e:
-            logger.error(f"❌ 漏洞分類失敗: {e}")
+            logger.error(f"❌ adapter {name} 熱更新失敗，繼續使用目前的版本: {e}")
+            if pool is not None:
+                await asyncio.to_thread(pool.stop, unfreeze=False)
+            if adapter is not None:
+                self._schedule_free(adapter)
             raise
+        
+        # 原子切換：之後的請求固定在新版本、批次送入新的 worker 池（事件迴圈上執行，中間沒有 await）
+        old_pool = self._worker_pool
+        self._adapters[name] = adapter
+        if pool is not None:
+            self._worker_pool = pool
+        self._set_adapter_path(name, path, adapter.calibration)
+        if previous is not None:
+            previous.retired = True
+            if previous.refs == 0:
+                self._schedule_free(previous)
+        logger.info(f"✅ adapter {name} 已切換到 {key}"
+                    f"{f'，{previous.refs} 個進行中的請求以 {previous.key} 完成' if previous is not None else ''}")
+        
+        if old_pool is not None:
+            await asyncio.to_thread(old_pool.drain_and_stop)
+        return {
+            "adapter": name,
+            "path": path,
+            "status": "swapped",
+            "version": key,
+            "previous_version": previous.key if previous is not None else None,
+            "model_version": adapter.version,
+            "fingerprint": adapter.fingerprint[:16] if adapter.fingerprint else None,
+            "memory_mb": round(adapter.memory_bytes / 1024**2, 2),
+            "canary": canary
+        }
+    
+    def _attach_adapter_version(self, name: str, path: str, key: str) -> LoadedAdapter:
+        """在推論執行緒上附加新版本並建立其前綴 KV cache（不影響目前的版本）"""
+        adapter = self._load_adapter_version(name, path, load_dtype(self.inference_profile, self._device), key)
+        self._adapter_versions[key] = adapter
+        try:
+            if self.prefix_cache_enabled:
+                active = self._active_adapter
+                self._use_adapter(key)
+                adapter.prefix_cache = PrefixCache(self._model, self._tokenizer(PROMPT_PREFIX)["input_ids"],
+                                                   self._device)
+                if active in self._adapter_versions:
+                    self._use_adapter(active)
+            adapter.version = self._adapter_version(adapter)
+        except Exception:
+            self._free_adapter_version(adapter)
+            raise
+        return adapter
+    
+    async def _run_canaries(self, adapter: LoadedAdapter, previous: Optional[LoadedAdapter],
+                            pool: Optional[WorkerPool]) -> Dict:
+        """以 canary 提示詞評分：每個 worker 各預熱一次，分數必須有限；與舊版本的標籤一致率只供參考"""
+        canary_ids = [self.encode_prompt(code) for code in CANARY_SNIPPETS]
+        
+        def labels(version: LoadedAdapter, runs: List[List[Tuple[Any, Dict]]]) -> List[str]:
+            scores = [torch.stack([result for result, _ in outputs]) for outputs in runs]
+            if not all(torch.isfinite(run_scores).all() for run_scores in scores):
+                raise RuntimeError(f"Canary scores of {version.key} are not finite")
+            probabilities = self._label_scorer.probabilities(
+                scores[0], version.calibration["temperature"], version.calibration["bias"])
+            return [max(row, key=row.get) for row in probabilities]
+        
+        started = time.time()
+        if pool is not None:
+            runs = await asyncio.gather(*[pool.run("score", canary_ids, adapter.key) for _ in range(pool.num_workers)])
+        else:
+            runs = [await self.executor.run(partial(self._execute_batch, "score"), canary_ids, adapter.key)]
+        new_labels = labels(adapter, runs)
+        canary = {
+            "prompts": len(canary_ids),
+            "labels": new_labels,
+            "latency_ms": round((time.time() - started) * 1000, 1)
+        }
+        
+        if previous is not None:
+            if pool is not None:
+                runs = [await pool.run("score", canary_ids, previous.key)]
+            else:
+                runs = [await self.executor.run(partial(self._execute_batch, "score"), canary_ids, previous.key)]
+            previous_labels = labels(previous, runs)
+            canary["previous_labels"] = previous_labels
+            canary["agreement_with_previous"] = round(
+                sum(a == b for a, b in zip(new_labels, previous_labels)) / len(new_labels), 4)
+        return canary
+    
+    def _set_adapter_path(self, name: str, path: str, calibration: Optional[Dict] = None):
+        """更新 adapter 的設定路徑（模型重新載入時使用新版本）"""
+        self.lora_adapters[name] = path
+        if name == DEFAULT_ADAPTER:
+            self.model_path = path
+            self.score_calibration_path = os.path.join(path, "score_calibration.json")
+            self.score_calibration = calibration or load_calibration(
+                self.score_calibration_path, float(os.getenv("ML_SCORE_TEMPERATURE", "1.0")))
+    
+    def _watched_adapters(self) -> Dict[str, Tuple[str, Optional[str]]]:
+        """AdapterWatcher 監看的 adapter：{名稱: (設定路徑, 目前版本的指紋)}，無法熱更新時為空"""
+        if self.lifecycle.state != "ready" or self._swap_lock.locked() or not isinstance(self._model, PeftModel):
+            return {}
+        return {name: (self.lora_adapters[name], adapter.fingerprint) for name, adapter in self._adapters.items()}
+    
+    def unload_model(self):
+        """釋放已載入的模型（切換設定檔、重新載入或閒置卸載時使用）"""
+        with self._lock:
+            if self._worker_pool is not None:
+                self._worker_pool.stop()
+                self._worker_pool = None
+            self._model = None
+            self._label_scorer = None
+            self._structured_program = None
+            self._prefix_cache = None
+            self._draft_model = None
+            self._backend = None
+            self._adapters = {}
+            self._adapter_versions = {}
+            self._active_adapter = DEFAULT_ADAPTER
+            self._initialized = False
+            self._load_stats = {}
+            self._model_version = None
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        # 由生命週期管理之外直接呼叫時，同步更新模型狀態
+        self.lifecycle.mark_unloaded()
+        logger.info("🗑️ ML 模型已卸載")
+    
+    def encode_prompt(self, move_code: str, truncate: bool = True) -> List[int]:
+        """構建提示詞並分詞（truncate=False 時保留完整長度，用於判斷是否需要切分窗口）"""
+        prompt = f"{PROMPT_PREFIX}{move_code}\n```\n\n分析結果："
+        return self._tokenizer(
+            prompt,
+            max_length=self.max_prompt_tokens if truncate else None,
+            truncation=truncate
+        )["input_ids"]
+    
+    def split_windows(self, move_code: str) -> List[CodeWindow]:
+        """沿 module / 函數邊界切成重疊窗口，每個窗口的提示詞都不超過 max_prompt_tokens"""
+        overhead = len(self.encode_prompt(""))
+        return split_windows(
+            move_code,
+            lambda text: len(self._tokenizer(text, add_special_tokens=False)["input_ids"]),
+            self.max_prompt_tokens - overhead - WINDOW_TOKEN_MARGIN,
+            self.window_overlap_tokens
+        )
+    
+    async def _run_batch(self, kind: str, batch_input_ids: List[List[int]], adapter: str) -> List[Tuple[Any, Dict]]:
+        """執行一個批次：多進程模式下送入 worker 池，否則交給專用推論執行緒；返回 (結果, 批次量測) 並彙總量測
+        
+        kind 為 "stream" 時批次只有一個 (input_ids, emit, cancelled)，以串流方式執行 generate
+        """
+        if kind == "stream":
+            [(input_ids, emit, cancelled)] = batch_input_ids
+            if self._worker_pool is not None:
+                outputs = await self._worker_pool.run("generate", [input_ids], adapter, on_event=emit)
+            else:
+                try:
+                    outputs = await self.executor.run(
+                        partial(self._execute_batch, "generate", emit=emit, cancelled=cancelled), [input_ids], adapter)
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+        elif self._worker_pool is not None:
+            outputs = await self._worker_pool.run(kind, batch_input_ids, adapter)
+        else:
+            outputs = await self.executor.run(partial(self._execute_batch, kind), batch_input_ids, adapter)
+        self.metrics.record_batch(outputs[0][1])
+        return outputs
+    
+    def _execute_batch(self, kind: str, batch_input_ids: List[List[int]], adapter: str = DEFAULT_ADAPTER,
+                       **kwargs) -> List[Tuple[Any, Dict]]:
+        """在執行推論的進程（推論執行緒或 worker）中以指定的 adapter 版本執行一個批次，每個結果附上批次量測
+        
+        量測包含輸入與生成的 token 數、prefill / decode 時間，以及批次期間的記憶體峰值
+        （CPU 為進程 RSS 峰值，GPU 為已分配記憶體峰值；同一進程一次只執行一個批次）
+        """
+        handler = {"score": self._score_batch, "generate": self._generate_batch,
+                   "speculative": self._speculative_batch}[kind]
+        self._use_adapter(adapter)
+        timings = {}
+        track_peak = self._device == "cuda" or self.batch_peak_rss
+        if track_peak:
+            reset_peak_memory(self._device)
+        started = time.time()
+        results = handler(batch_input_ids, timings=timings, **kwargs)
+        wall = time.time() - started
+        tokens_out = [0 if kind == "score" else result["decoding"]["tokens"] for result in results]
+        batch = {
+            "kind": kind,
+            "adapter": adapter,
+            "size": len(batch_input_ids),
+            "tokens_in": sum(len(input_ids) for input_ids in batch_input_ids),
+            "tokens_out": sum(tokens_out),
+            "wall_s": wall,
+            "prefill_s": timings.get("prefill_s", 0.0),
+            "decode_s": timings.get("decode_s", 0.0),
+            "peak_memory_bytes": peak_memory_bytes(self._device) if track_peak else None,
+            "pid": os.getpid()
+        }
+        return [(result, {**batch, "request_tokens_in": len(input_ids), "request_tokens_out": generated})
+                for result, input_ids, generated in zip(results, batch_input_ids, tokens_out)]
+    
+    def _score_batch(self, batch_input_ids: List[List[int]],
+                     timings: Optional[Dict[str, float]] = None) -> List[torch.Tensor]:
+        """批次標籤評分 - 返回每個請求各標籤的對數似然"""
+        scores = self._label_scorer.score(self._model, batch_input_ids, self._tokenizer.pad_token_id, self._device,
+                                          prefix_cache=self._prefix_cache, timings=timings)
+        return list(scores)
+    
+    def _speculative_batch(self, batch_input_ids: List[List[int]],
+                           timings: Optional[Dict[str, float]] = None) -> List[Dict]:
+        """推測解碼的結構化生成（批次大小固定為 1）"""
+        return self._generate_batch(batch_input_ids, speculative=True, timings=timings)
+    
+    def _generate_batch(self, batch_input_ids: List[List[int]], emit=None, cancelled: Optional[Event] = None,
+                        speculative: bool = False, timings: Optional[Dict[str, float]] = None) -> List[Dict]:
+        """批次結構化生成 - 左側 padding 後執行一次受約束的 generate，結構完成即停止
+        
+        speculative 為 True 時以草稿模型推測解碼：結構約束同時套用在草稿模型的候選與主模型的驗證上，
+        並統計主模型與草稿模型的前向傳播次數以計算接受率。timings 提供時寫入 prefill_s（到第一個解碼步驟）與 decode_s
+        """
+        pad_id = self._tokenizer.pad_token_id
+        if self._prefix_cache is not None:
+            # [前綴 | padding | 後綴] 排列，generate 只會對 cache 之後的 token 做前向傳播
+            input_ids, attention_mask, cache = self._prefix_cache.prepare(batch_input_ids, pad_id)
+        else:
+            input_ids, attention_mask = left_pad(batch_input_ids, pad_id)
+            cache = None
+        if emit is not None:
+            processor = StreamingStructuredProcessor(self._structured_program, input_ids.shape[1], emit)
+        else:
+            processor = StructuredOutputProcessor(self._structured_program, input_ids.shape[1], len(batch_input_ids))
+        step_timer = StepTimer()
+        stopping_criteria = StoppingCriteriaList(
+            ([CancellationCriteria(cancelled)] if cancelled is not None else []) + [step_timer])
+        
+        assisted = {}
+        if speculative:
+            assisted = {"assistant_model": self._draft_model}
+        
+        # 使用確定性推理（greedy decoding），每一步只允許結構允許的 token
+        started = time.time()
+        with torch.no_grad(), ExitStack() as counters:
+            if speculative:
+                base_model = self._model.get_base_model() if isinstance(self._model, PeftModel) else self._model
+                main_counter = counters.enter_context(ForwardCounter(base_model))
+                draft_counter = counters.enter_context(ForwardCounter(self._draft_model))
+            sequences = self._model.generate(
+                input_ids=input_ids.to(self._device),
+                attention_mask=attention_mask.to(self._device),
+                past_key_values=cache,
+                max_new_tokens=self._structured_program.max_new_tokens,
+                do_sample=False,  # 關閉隨機採樣，使用貪婪解碼
+                num_beams=1,      # 不使用 beam search，保持一致性
+                logits_processor=LogitsProcessorList([processor]),
+                stopping_criteria=stopping_criteria,
+                pad_token_id=pad_id,
+                eos_token_id=self._tokenizer.eos_token_id,
+                **assisted
+            )
+        finished = time.time()
+        elapsed = finished - started
+        if timings is not None:
+            first_step = step_timer.first_step or finished
+            timings["prefill_s"] = first_step - started
+            timings["decode_s"] = finished - first_step
+        
+        if emit is not None:
+            processor.flush()
+        tokens = count_generated(sequences, input_ids.shape[1], self._tokenizer.eos_token_id)
+        results = []
+        for state, generated in zip(processor.states, tokens):
+            result = state.result()
+            if speculative:
+                result["decoding"] = decoding_info("speculative", generated, elapsed,
+                                                   main_counter.count, draft_counter.count)
+            else:
+                result["decoding"] = decoding_info("standard", generated, elapsed)
+            results.append(result)
+        return results
     
     def _calculate_risk_score(self, classification: str, confidence: float) -> int:
         """計算 0-100 風險分數"""
@@ -408,16 +1542,240 @@ class MLModelSingleton:
         """獲取模型統計信息"""
         stats = {
             "initialized": self._initialized,
-            "loading": self._loading,
+            "loading": self.is_loading,
+            "lifecycle": self.lifecycle.get_stats(),
             "model_path": self.model_path,
             "base_model": self.base_model_name
         }
         
+        stats["inference_mode"] = self.inference_mode
+        stats["score_calibration"] = self.score_calibration
+        stats["batching"] = {
+            "generate": self.batch_scheduler.get_stats(),
+            "score": self.score_scheduler.get_stats(),
+            "speculative": self.speculative_scheduler.get_stats(),
+            "stream": self.stream_scheduler.get_stats()
+        }
+        
+        stats["profile"] = self._get_profile_stats()
+        stats["adapters"] = self._get_adapter_stats()
+        stats["hot_swap"] = {
+            "admin_endpoint": bool(self.admin_token),
+            "watch_interval_s": self.adapter_watcher.interval if self.adapter_watcher is not None else None,
+            "in_progress": self._swap_lock.locked(),
+            # 已被取代、仍有進行中請求的舊版本
+            "retired_versions": {adapter.key: adapter.refs for adapter in self._adapter_versions.values()
+                                 if adapter.retired},
+            "history": list(self._swap_history)
+        }
+        stats["backend"] = self._get_backend_stats()
+        if self._worker_pool is not None:
+            stats["workers"] = self._worker_pool.get_stats()
+        stats["executor"] = self.executor.get_stats()
+        stats["prefix_cache"] = (self._prefix_cache.get_stats() if self._prefix_cache is not None
+                                 else {"enabled": self.prefix_cache_enabled})
+        stats["windowing"] = {
+            "enabled": self.sliding_window_enabled,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "overlap_tokens": self.window_overlap_tokens,
+            **self._window_stats
+        }
+        compaction = self._compaction_stats
+        saved = compaction["original_tokens"] - compaction["tokens"]
+        stats["compaction"] = {
+            "enabled": self.input_compaction,
+            **compaction,
+            "tokens_saved": saved,
+            "saved_ratio": round(saved / compaction["original_tokens"], 4) if compaction["original_tokens"] else 0.0,
+            "tokens_saved_per_request": round(saved / compaction["requests"], 1) if compaction["requests"] else 0.0
+        }
+        stats["cascade"] = {"enabled": self.fast_tier is not None}
+        if self.fast_tier is not None:
+            stats["cascade"].update({
+                "audit_rate": self.fast_tier_audit_rate,
+                "model": {
+                    "path": self.fast_tier_path,
+                    "fingerprint": self.fast_tier.fingerprint,
+                    "trained_at": self.fast_tier.metadata.get("trained_at"),
+                    "samples": self.fast_tier.metadata.get("samples"),
+                    "suggested_threshold": self.fast_tier.metadata.get("suggested_threshold"),
+                    "threshold_source": self.fast_tier.metadata.get("threshold_source")
+                },
+                **self.cascade.get_stats(self.fast_tier_threshold)
+            })
+        
+        stats["decoding"] = {
+            "draft_model": self.draft_model_name or None,
+            "draft_loaded": self._draft_model is not None,
+            "num_assistant_tokens": self.draft_num_tokens,
+            "confidence_threshold": self.draft_confidence_threshold,
+            "speculative_default": self.speculative_default,
+            **self.decoding.get_stats()
+        }
+        
+        ttft = list(self._ttft)
+        stats["streaming"] = {
+            **self._stream_stats,
+            "time_to_label_p50_ms": round(percentile(ttft, 0.5) * 1000, 1),
+            "time_to_label_p95_ms": round(percentile(ttft, 0.95) * 1000, 1)
+        }
+        stats["batch_api"] = {
+            "max_items": self.batch_max_items,
+            "concurrency": self.batch_concurrency,
+            **self._batch_api_stats
+        }
+        stats["result_cache"] = (self.result_cache.get_stats() if self.result_cache is not None
+                                 else {"enabled": False})
+        if self._model_version:
+            stats["result_cache"]["model_version"] = self._model_version
+        
+        stats["memory"] = self._get_memory_stats(stats.get("workers"))
+        stats["inference"] = self.metrics.get_stats()
+        
         if torch.cuda.is_available() and self._initialized:
             stats["gpu_memory_allocated_gb"] = torch.cuda.memory_allocated() / 1024**3
             stats["gpu_memory_reserved_gb"] = torch.cuda.memory_reserved() / 1024**3
         
         return stats
+    
+    def _get_adapter_stats(self) -> Dict:
+        """設定的 adapter、是否已附加、目前的版本、LoRA 參數記憶體與請求數"""
+        adapters = {}
+        for name, path in self.lora_adapters.items():
+            loaded = self._adapters.get(name)
+            adapters[name] = {
+                "path": path,
+                "loaded": loaded is not None,
+                "requests": self._adapter_requests[name]
+            }
+            if loaded is not None:
+                adapters[name].update({
+                    "version": loaded.key,
+                    "loaded_at": datetime.fromtimestamp(loaded.loaded_at).isoformat(),
+                    "in_flight": loaded.refs,
+                    "memory_mb": round(loaded.memory_bytes / 1024**2, 2),
+                    "fingerprint": loaded.fingerprint[:16] if loaded.fingerprint else None,
+                    "model_version": loaded.version,
+                    "calibration": loaded.calibration
+                })
+        return adapters
+    
+    def _get_memory_stats(self, workers: Optional[Dict] = None) -> Dict:
+        """進程與各 worker 的 RSS、模型參數依 dtype 的記憶體（CPU 與 GPU 模式都提供；workers 為已取得的 worker 池統計）"""
+        memory = {
+            "process_rss_mb": round(process_rss_bytes() / 1024**2, 1),
+            "parameters_mb": self._load_stats.get("model_memory_mb", 0.0),
+            "parameters_by_dtype_mb": self._load_stats.get("model_memory_by_dtype_mb", {}),
+            "batch_peak_max_mb": round(self.metrics.max_peak_bytes / 1024**2, 1)
+        }
+        if self._worker_pool is not None:
+            workers = workers or self._worker_pool.get_stats()
+            memory["workers_rss_mb"] = [worker.get("rss_mb") for worker in workers["workers"]]
+        if torch.cuda.is_available() and self._initialized:
+            memory["gpu_allocated_mb"] = round(torch.cuda.memory_allocated() / 1024**2, 1)
+            memory["gpu_reserved_mb"] = round(torch.cuda.memory_reserved() / 1024**2, 1)
+        return memory
+    
+    def render_metrics(self) -> str:
+        """Prometheus 文字格式的服務指標（/metrics）"""
+        writer = PrometheusWriter()
+        writer.gauge("model_loaded", "Whether the model is loaded", float(self._initialized))
+        
+        rss = [({"process": "main"}, process_rss_bytes())]
+        if self._worker_pool is not None:
+            for worker in self._worker_pool.get_stats()["workers"]:
+                if worker["alive"]:
+                    try:
+                        rss.append(({"process": f"worker-{worker['index']}"}, process_rss_bytes(worker["pid"])))
+                    except (psutil.Error, OSError):
+                        pass
+        writer.add("process_resident_memory_bytes", "gauge", "Resident set size of the service and its workers", rss)
+        writer.add("model_parameter_bytes", "gauge", "Model parameter memory by dtype",
+                   [({"dtype": dtype}, int(size * 1024**2))
+                    for dtype, size in self._load_stats.get("model_memory_by_dtype_mb", {}).items()])
+        if torch.cuda.is_available() and self._initialized:
+            writer.gauge("gpu_memory_allocated_bytes", "Allocated CUDA memory", torch.cuda.memory_allocated())
+        
+        totals = self.metrics.totals
+        for name, key, kind, help_text in (
+            ("inference_batches_total", "batches", "counter", "Inference batches executed"),
+            ("inference_requests_total", "requests", "counter", "Requests (or windows) in executed batches"),
+            ("tokens_in_total", "tokens_in", "counter", "Prompt tokens processed"),
+            ("tokens_out_total", "tokens_out", "counter", "Tokens generated"),
+            ("prefill_seconds_total", "prefill_s", "counter", "Time spent in prompt forward passes"),
+            ("decode_seconds_total", "decode_s", "counter", "Time spent after the prompt forward pass")
+        ):
+            writer.add(name, kind, help_text,
+                       [({"kind": batch_kind}, batch[key]) for batch_kind, batch in totals.items()])
+        inference = self.metrics.get_stats()["by_kind"]
+        writer.add("prefill_tokens_per_second", "gauge", "Prompt tokens per second of prefill time",
+                   [({"kind": kind}, stats["prefill_tokens_per_s"]) for kind, stats in inference.items()])
+        writer.add("decode_tokens_per_second", "gauge", "Generated tokens per second of decode time",
+                   [({"kind": kind}, stats["decode_tokens_per_s"]) for kind, stats in inference.items()])
+        writer.add("batch_peak_memory_bytes", "gauge", "Peak memory during recent batches",
+                   [({"quantile": f"{q:g}"}, value) for q, value in self.metrics.peak_quantiles()])
+        
+        schedulers = {"score": self.score_scheduler, "generate": self.batch_scheduler,
+                      "speculative": self.speculative_scheduler, "stream": self.stream_scheduler}
+        scheduler_stats = {name: scheduler.get_stats() for name, scheduler in schedulers.items()}
+        writer.add("scheduler_queue_depth", "gauge", "Requests waiting in the micro-batch scheduler",
+                   [({"scheduler": name}, stats["queue_depth"]) for name, stats in scheduler_stats.items()])
+        writer.add("scheduler_running_batches", "gauge", "Batches currently executing",
+                   [({"scheduler": name}, stats["running_batches"]) for name, stats in scheduler_stats.items()])
+        writer.gauge("executor_queue_depth", "Tasks waiting for the inference thread",
+                     self.executor.get_stats()["queue_depth"])
+        batch_sizes = [
+            ({"scheduler": name}, {int(size): count for size, count in stats["batch_size_distribution"].items()})
+            for name, stats in scheduler_stats.items()
+        ]
+        writer.histogram("batch_size", "Micro-batch sizes", batch_sizes, (1, 2, 4, 8, 16, 32))
+        
+        latency = []
+        for mode, samples in self._latencies.items():
+            samples = list(samples)
+            latency += [({"mode": mode, "quantile": f"{q:g}"}, percentile(samples, q)) for q in (0.5, 0.95, 0.99)]
+        writer.add("request_latency_seconds", "gauge", "Model request latency over the last 1000 requests", latency)
+        return writer.render()
+    
+    def _get_profile_stats(self) -> Dict:
+        """目前設定檔的記憶體、延遲與準確率檢查結果"""
+        latency = {}
+        for mode, samples in self._latencies.items():
+            samples = list(samples)
+            latency[mode] = {
+                "count": len(samples),
+                "p50_ms": round(percentile(samples, 0.5) * 1000, 1),
+                "p95_ms": round(percentile(samples, 0.95) * 1000, 1)
+            }
+        
+        accuracy_check = None
+        if os.path.exists(self.profile_report_path):
+            try:
+                with open(self.profile_report_path, "r", encoding="utf-8") as f:
+                    accuracy_check = json.load(f).get("profiles", {}).get(self.inference_profile)
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ 無法讀取設定檔評估報告: {e}")
+        
+        return {
+            "name": self.inference_profile,
+            **self._load_stats,
+            "process_rss_mb": round(psutil.Process().memory_info().rss / 1024**2, 1),
+            "latency": latency,
+            "accuracy_check": accuracy_check
+        }
+
+    def _get_backend_stats(self) -> Dict:
+        """目前推論後端的設定與一致性檢查結果"""
+        parity_check = None
+        if os.path.exists(self.backend_report_path):
+            try:
+                with open(self.backend_report_path, "r", encoding="utf-8") as f:
+                    parity_check = json.load(f).get("backends", {}).get(self.inference_backend)
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ 無法讀取後端評估報告: {e}")
+        
+        backend = self._backend.get_stats() if self._backend is not None else {"name": self.inference_backend}
+        return {**backend, "parity_check": parity_check}
 
 # 全局單例實例
 ml_model = MLModelSingleton()
@@ -433,27 +1791,54 @@ async def root():
         "model_initialized": ml_model._initialized,
         "endpoints": {
             "analyze": "/api/analyze-vulnerability",
+            "analyze_stream": "/api/analyze-vulnerability/stream",
             "health": "/health",
-            "stats": "/stats"
+            "stats": "/stats",
+            "metrics": "/metrics",
+            "adapter_swap": "/admin/adapters/{name}/swap"
         }
     }
 
+def _check_code(move_code: str) -> str:
+    """檢查代碼內容，返回去除首尾空白的代碼"""
+    move_code = move_code.strip()
+    
+    if not move_code:
+        raise HTTPException(status_code=400, detail="move_code is required")
+    
+    if len(move_code) > MAX_CODE_LENGTH:
+        raise HTTPException(status_code=400, detail="Code too large (max: 100KB)")
+    
+    return move_code
+
+def _check_mode(mode: Optional[str]):
+    if mode and mode.lower() not in INFERENCE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(INFERENCE_MODES)}")
+
+def _check_adapter(adapter: Optional[str]):
+    try:
+        ml_model._resolve_adapter(adapter)
+    except AdapterNotAvailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _validated_code(request: VulnerabilityAnalysisRequest) -> str:
+    """檢查請求內容，返回去除首尾空白的代碼"""
+    move_code = _check_code(request.move_code)
+    _check_mode(request.mode)
+    _check_adapter(request.adapter)
+    return move_code
+
 @app.post("/api/analyze-vulnerability")
 async def analyze_vulnerability(request: VulnerabilityAnalysisRequest):
     """分析智能合約漏洞"""
     try:
-        move_code = request.move_code.strip()
-        
-        if not move_code:
-            raise HTTPException(status_code=400, detail="move_code is required")
-        
-        if len(move_code) > 100000:
-            raise HTTPException(status_code=400, detail="Code too large (max: 100KB)")
+        move_code = _validated_code(request)
         
         logger.info("📝 收到漏洞分析請求")
         
         # 執行分析
-        result = await ml_model.classify_vulnerability(move_code)
+        result = await ml_model.classify_vulnerability(move_code, mode=request.mode, speculative=request.speculative,
+                                                       profile=bool(request.profile), adapter=request.adapter)
         
         logger.info(f"✅ 分析完成: {result['classification']} (風險分數: {result['risk_score']})")
         
@@ -461,24 +1846,202 @@ async def analyze_vulnerability(request: VulnerabilityAnalysisRequest):
         
     except HTTPException:
         raise
+    except AdapterNotAvailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InferenceQueueFull as e:
+        logger.warning(f"⚠️ 推論佇列已滿，拒絕請求: {e}")
+        raise HTTPException(status_code=503, detail=f"ML service overloaded: {str(e)}", headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"❌ 分析失敗: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@app.post("/api/analyze-vulnerability/stream")
+async def analyze_vulnerability_stream(request: VulnerabilityAnalysisRequest, http_request: Request):
+    """以 Server-Sent Events 串流漏洞分析（結構化生成）
+    
+    事件依序為 label（分類與機率）、severity、token（reason 文字片段，可多次）、done（與非串流端點相同的完整結果）；
+    失敗時送出 error。客戶端斷線時立即停止生成
+    """
+    move_code = _validated_code(request)
+    logger.info("📝 收到串流漏洞分析請求")
+    
+    async def event_stream():
+        try:
+            # aclosing：提前結束迭代時立即關閉產生器，停止生成
+            async with aclosing(ml_model.stream_vulnerability(move_code, request.adapter)) as events:
+                async for kind, data in events:
+                    if await http_request.is_disconnected():
+                        break
+                    yield f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    if kind == "done":
+                        logger.info(f"✅ 串流分析完成: {data['classification']} (風險分數: {data['risk_score']})")
+        except InferenceQueueFull as e:
+            logger.warning(f"⚠️ 推論佇列已滿，拒絕串流請求: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': f'ML service overloaded: {e}', 'retry_after': 1})}\n\n"
+        except Exception as e:
+            logger.error(f"❌ 串流分析失敗: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': f'Analysis failed: {e}'}, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/analyze-vulnerability/batch")
+async def analyze_vulnerability_batch(request: BatchAnalysisRequest, http_request: Request):
+    """批次漏洞分析，以 NDJSON 串流返回（每行一個項目，依完成順序）
+    
+    每行為 {"index", "id", "status": "ok", "result"} 或 {"index", "id", "status": "error", "status_code", "error"}；
+    相同代碼的項目只推論一次，重複項目帶 duplicate_of（第一次出現的索引）。最後一行為 {"summary": ...}。
+    單一項目的錯誤（代碼為空或過大、推論失敗）不影響其他項目；客戶端斷線時取消尚未完成的項目
+    """
+    _check_mode(request.mode)
+    _check_adapter(request.adapter)
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items is required")
+    if len(request.items) > ml_model.batch_max_items:
+        raise HTTPException(status_code=400, detail=f"Too many items (max: {ml_model.batch_max_items})")
+    
+    ids = [item.id if item.id is not None else str(index) for index, item in enumerate(request.items)]
+    codes: Dict[int, str] = {}
+    invalid: Dict[int, HTTPException] = {}
+    for index, item in enumerate(request.items):
+        try:
+            codes[index] = _check_code(item.move_code)
+        except HTTPException as e:
+            invalid[index] = e
+    logger.info(f"📝 收到批次漏洞分析請求: {len(request.items)} 個項目 ({len(set(codes.values()))} 個不重複)")
+    
+    def line(data: Dict) -> str:
+        return json.dumps(data, ensure_ascii=False) + "\n"
+    
+    async def item_stream():
+        start_time = time.time()
+        counts = {"succeeded": 0, "failed": len(invalid)}
+        for index, error in invalid.items():
+            yield line({"index": index, "id": ids[index], "status": "error", "status_code": error.status_code,
+                        "error": error.detail})
+        
+        positions = list(codes)
+        async with aclosing(ml_model.classify_batch(list(codes.values()), request.mode, request.speculative,
+                                                    bool(request.profile), request.adapter)) as results:
+            async for unique_indices, result in results:
+                if await http_request.is_disconnected():
+                    logger.info("🛑 批次請求已斷線，取消剩餘項目")
+                    return
+                first = positions[unique_indices[0]]
+                for unique_index in unique_indices:
+                    index = positions[unique_index]
+                    entry = {"index": index, "id": ids[index]}
+                    if "error" in result:
+                        counts["failed"] += 1
+                        entry.update({"status": "error", **result})
+                    else:
+                        counts["succeeded"] += 1
+                        entry.update({"status": "ok", "result": result})
+                    if index != first:
+                        entry["duplicate_of"] = first
+                    yield line(entry)
+        
+        summary = {
+            "items": len(request.items),
+            "unique": len(set(codes.values())),
+            **counts,
+            "elapsed_s": round(time.time() - start_time, 2)
+        }
+        logger.info(f"✅ 批次分析完成: {summary['succeeded']}/{summary['items']} 成功 (耗時 {summary['elapsed_s']}s)")
+        yield line({"summary": summary})
+    
+    return StreamingResponse(
+        item_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/health")
 async def health_check():
-    """健康檢查"""
+    """健康檢查（進程存活即返回 healthy，不代表模型已載入）"""
     return {
         "status": "healthy",
         "model_initialized": ml_model._initialized,
+        "model_state": ml_model.lifecycle.state,
+        "timestamp": datetime.now().isoformat() + "Z"
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """就緒檢查：模型可處理請求時返回 200，背景預載入完成前或載入失敗時返回 503
+    
+    閒置卸載後仍視為就緒（下一個請求會重新載入）；未啟用預載入時以懶加載處理請求，同樣視為就緒
+    """
+    lifecycle = ml_model.lifecycle
+    ready = lifecycle.state != "failed" and (lifecycle.has_loaded or not ml_model.preload_enabled)
+    content = {
+        "status": "ready" if ready else "not_ready",
+        "model_state": lifecycle.state,
         "timestamp": datetime.now().isoformat() + "Z"
     }
+    if ready:
+        return content
+    return JSONResponse(status_code=503, content=content, headers={"Retry-After": "5"})
 
 @app.get("/stats")
 async def get_stats():
     """獲取服務統計信息"""
     return ml_model.get_stats()
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus 格式的指標"""
+    return PlainTextResponse(ml_model.render_metrics(), media_type="text/plain; version=0.0.4")
+
+def _check_admin(authorization: Optional[str]):
+    """管理端點需要 Authorization: Bearer $ML_ADMIN_TOKEN，未設定 token 時停用"""
+    if not ml_model.admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ML_ADMIN_TOKEN)")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip(), ml_model.admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+@app.post("/admin/adapters/{name}/swap")
+async def swap_adapter(name: str, request: AdapterSwapRequest, authorization: Optional[str] = Header(None)):
+    """零停機熱更新 adapter：背景載入並以 canary 提示詞檢查新版本後切換新請求，進行中的請求以舊版本完成"""
+    _check_admin(authorization)
+    try:
+        logger.info(f"📝 收到 adapter 熱更新請求: {name} -> {request.path}")
+        return await ml_model.swap_adapter(name, request.path)
+    except AdapterNotAvailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SwapConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"ML service overloaded: {str(e)}", headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Swap failed: {str(e)}")
+
+@app.on_event("startup")
+async def startup_event():
+    """應用啟動時開始模型生命週期管理（背景預載入、閒置卸載）與 adapter 目錄監看"""
+    ml_model.lifecycle.start(preload=ml_model.preload_enabled)
+    if ml_model.adapter_watcher is not None:
+        ml_model.adapter_watcher.start()
+    if ml_model.preload_enabled:
+        logger.info("🔥 背景預載入 ML 模型，完成前 /ready 返回 503")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """應用關閉時停止閒置卸載檢查與推論 worker
+    
+    uvicorn 處理完關閉流程後會重新發出收到的 SIGTERM 結束進程，multiprocessing 的 atexit 清理不會執行，
+    worker 必須在此停止，否則會繼續佔用繼承的監聽 socket
+    """
+    await ml_model.lifecycle.stop()
+    if ml_model.adapter_watcher is not None:
+        await ml_model.adapter_watcher.stop()
+    if ml_model._worker_pool is not None:
+        ml_model._worker_pool.stop()
+
 @app.post("/api/warmup")
 async def warmup():
     """預熱模型（手動觸發載入）"""
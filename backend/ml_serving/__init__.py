@@ -0,0 +1,9 @@
+"""
+SuiGuard ML Service 推論元件
+"""
+
+from .batching import BatchScheduler
+
+__all__ = [
+    'BatchScheduler'
+]
@@ -0,0 +1,79 @@
+"""
+多 LoRA adapter 服務
+基礎模型只載入一次，額外的 adapter（協定專用、A/B 版本）以 PEFT 的具名 adapter 附加在同一個 PeftModel 上，
+每個 adapter 只多佔用自己的 LoRA 矩陣（MB 級）。請求依 adapter 分組成批次，執行批次前切換作用中的 adapter；
+adapter 會改變注意力的 K/V 與輸出分布，因此指令前綴的 KV cache 與標籤機率校準依 adapter 分開保存。
+熱更新的新版本以 <名稱>@<序號> 附加在模型上，與舊版本並存到舊版本的請求都完成為止（見 hot_swap.py）
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# LORA_MODEL_PATH 的 adapter 名稱（PEFT 的預設 adapter 名稱）
+DEFAULT_ADAPTER = "default"
+# 熱更新版本在模型上的名稱為 <adapter 名稱>@<序號>
+VERSION_SEPARATOR = "@"
+
+
+class AdapterNotAvailable(ValueError):
+    """請求的 adapter 未設定或未載入"""
+
+
+@dataclass
+class LoadedAdapter:
+    """已附加到模型上的 adapter"""
+    name: str
+    path: str
+    fingerprint: Optional[str]
+    calibration: Dict
+    version: str = ""  # 結果快取使用的模型版本
+    memory_bytes: int = 0
+    prefix_cache: Optional[object] = None
+    key: str = ""  # 模型上的 PEFT adapter 名稱：啟動時附加的版本與 name 相同，熱更新的版本為 name@序號
+    loaded_at: float = field(default_factory=time.time)
+    refs: int = 0  # 固定在此版本上進行中的請求數
+    retired: bool = False  # 已被新版本取代，refs 歸零後從模型上刪除
+
+    def __post_init__(self):
+        self.key = self.key or self.name
+
+
+def adapter_name(key: str) -> str:
+    """adapter 版本的名稱（去掉熱更新序號）"""
+    return key.partition(VERSION_SEPARATOR)[0]
+
+
+def parse_adapter_specs(spec: str) -> Dict[str, str]:
+    """解析 "lending=/models/lending,dex=/models/dex" 形式的 adapter 列表"""
+    adapters = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, path = part.partition("=")
+        name, path = name.strip(), path.strip()
+        if not sep or not name or not path:
+            logger.warning(f"⚠️ 無法解析 adapter 設定: {part}（格式為 名稱=路徑）")
+            continue
+        if VERSION_SEPARATOR in name:
+            logger.warning(f"⚠️ adapter 名稱不可包含 {VERSION_SEPARATOR}，略過 {name}")
+            continue
+        if name == DEFAULT_ADAPTER:
+            logger.warning(f"⚠️ adapter 名稱 {DEFAULT_ADAPTER} 保留給 LORA_MODEL_PATH，略過 {path}")
+            continue
+        adapters[name] = path
+    return adapters
+
+
+def adapter_memory_bytes(model, name: str) -> int:
+    """某個 adapter 的 LoRA 參數佔用的記憶體（參數名稱形如 ...q_proj.lora_A.<name>.weight）"""
+    total = 0
+    for param_name, param in model.named_parameters():
+        parts = param_name.split(".")
+        if name in parts and any(part.startswith("lora_") for part in parts):
+            total += param.numel() * param.element_size()
+    return total
@@ -0,0 +1,341 @@
+"""
+推論後端
+同一套分類 API（標籤評分、結構化生成、前綴 KV cache）可以在不同的執行引擎上運行（ML_INFERENCE_BACKEND）：
+  pytorch - transformers + peft 直接執行（預設，注意力實作沿用模型載入時 transformers 的選擇）
+  sdpa    - 強制使用 scaled_dot_product_attention 的融合注意力核心（模型或舊版 transformers 預設 eager 注意力時有效）
+  compile - 以 torch.compile 編譯模型的前向傳播（遇到新的形狀組合時才編譯，首批請求較慢）
+  onnx    - 合併 LoRA 後匯出含 KV cache 輸入輸出的 ONNX 圖，以 ONNX Runtime 執行（需要 onnxruntime 與 onnx）
+
+後端介面只有一個：prepare() 接收已載入（已合併 / 量化、評估模式）的模型，返回推論使用的模型。
+返回的模型須支援標籤評分與前綴 cache 使用的 model(input_ids, attention_mask, position_ids, past_key_values,
+use_cache, logits_to_keep)（返回 .logits 與就地更新的 DynamicCache），以及結構化生成使用的 model.generate(...)
+"""
+
+import logging
+import os
+import shutil
+import time
+from typing import Dict, Optional, Tuple
+
+import torch
+import torch.nn as nn
+from peft import PeftModel
+from transformers import DynamicCache
+from transformers.modeling_outputs import CausalLMOutputWithPast
+
+from .quantization import INFERENCE_PROFILES
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_BACKENDS = ("pytorch", "sdpa", "compile", "onnx")
+
+
+def _base_model(model) -> nn.Module:
+    return model.get_base_model() if isinstance(model, PeftModel) else model
+
+
+class InferenceBackend:
+    """推論後端介面（預設的 pytorch 後端直接使用載入的模型）"""
+
+    name = "pytorch"
+    # 可作為推測解碼（assisted decoding）的主模型
+    supports_speculative = True
+    supported_profiles: Tuple[str, ...] = INFERENCE_PROFILES
+    supports_cuda = True
+
+    def prepare(self, model: nn.Module, device: str) -> nn.Module:
+        return model
+
+    def get_stats(self) -> Dict:
+        return {"name": self.name}
+
+
+class SdpaBackend(InferenceBackend):
+    """強制使用 PyTorch 的 scaled_dot_product_attention（CPU 上為融合的 flash / memory-efficient 核心）"""
+
+    name = "sdpa"
+
+    def prepare(self, model: nn.Module, device: str) -> nn.Module:
+        base = _base_model(model)
+        if not getattr(base, "_supports_sdpa", False):
+            raise ValueError(f"{type(base).__name__} 不支援 SDPA 注意力")
+        # 注意力層在每次前向時依 config 選擇實作，各層共用同一個 config 物件
+        self._previous = base.config._attn_implementation
+        base.config._attn_implementation = "sdpa"
+        return model
+
+    def get_stats(self) -> Dict:
+        return {"name": self.name, "attention": "sdpa", "loaded_attention": getattr(self, "_previous", None)}
+
+
+class CompileBackend(InferenceBackend):
+    """torch.compile 編譯基礎模型的 forward（LoRA 層一併編譯），dynamic=True 避免每個序列長度都重新編譯"""
+
+    name = "compile"
+
+    def __init__(self, mode: Optional[str] = None):
+        self.mode = mode or "default"
+
+    def prepare(self, model: nn.Module, device: str) -> nn.Module:
+        base = _base_model(model)
+        base.forward = torch.compile(base.forward, dynamic=True, mode=self.mode)
+        return model
+
+    def get_stats(self) -> Dict:
+        return {"name": self.name, "mode": self.mode}
+
+
+# ----------------------------------------------------------------------
+# ONNX Runtime
+# ----------------------------------------------------------------------
+
+class _ExportWrapper(nn.Module):
+    """匯出用的前向介面：扁平化的 KV cache 輸入輸出，logits 只保留最後 logits_to_keep 個位置
+
+    logits_to_keep 以長度表示（形狀 [keep] 的張量），匯出後成為動態維度
+    """
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.lm_head = model.get_output_embeddings()
+        self.num_layers = model.config.num_hidden_layers
+
+    def forward(self, input_ids, attention_mask, position_ids, logits_to_keep, *past):
+        cache = DynamicCache.from_legacy_cache(
+            tuple((past[2 * layer], past[2 * layer + 1]) for layer in range(self.num_layers)))
+        outputs = self.decoder(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                               past_key_values=cache, use_cache=True)
+        hidden = outputs.last_hidden_state
+        logits = self.lm_head(hidden[:, hidden.shape[1] - logits_to_keep.shape[0]:])
+        present = outputs.past_key_values.to_legacy_cache()
+        return (logits, *[tensor for layer in present for tensor in layer])
+
+
+def _kv_shape(config) -> Tuple[int, int]:
+    """(KV heads, head_dim)"""
+    heads = getattr(config, "num_key_value_heads", None) or config.num_attention_heads
+    head_dim = getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+    return heads, head_dim
+
+
+def export_onnx(model: nn.Module, path: str, opset: int = 17):
+    """將因果語言模型匯出為含 KV cache 輸入輸出的 ONNX 圖（先寫入暫存目錄，完成後再替換）"""
+    config = model.config
+    layers = config.num_hidden_layers
+    heads, head_dim = _kv_shape(config)
+    past_names = [f"past.{layer}.{kind}" for layer in range(layers) for kind in ("key", "value")]
+    present_names = [f"present.{layer}.{kind}" for layer in range(layers) for kind in ("key", "value")]
+
+    # 以非空的 past 追蹤，匯出的圖同時適用於首次前向（past 長度 0）與逐步解碼
+    batch, past_length, length = 2, 3, 4
+    dtype = next(model.parameters()).dtype
+    example = (
+        torch.randint(0, config.vocab_size, (batch, length)),
+        torch.ones(batch, past_length + length, dtype=torch.long),
+        torch.arange(past_length, past_length + length).expand(batch, length),
+        torch.zeros(length),
+        *[torch.zeros(batch, heads, past_length, head_dim, dtype=dtype) for _ in past_names]
+    )
+    dynamic_axes = {
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "total_sequence"},
+        "position_ids": {0: "batch", 1: "sequence"},
+        "logits_to_keep": {0: "keep"},
+        "logits": {0: "batch", 1: "keep"},
+        **{name: {0: "batch", 2: "past_sequence"} for name in past_names},
+        **{name: {0: "batch", 2: "total_sequence"} for name in present_names}
+    }
+
+    tmp_dir = f"{os.path.dirname(path)}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    with torch.no_grad():
+        torch.onnx.export(
+            _ExportWrapper(model).eval(), example, os.path.join(tmp_dir, os.path.basename(path)),
+            input_names=["input_ids", "attention_mask", "position_ids", "logits_to_keep", *past_names],
+            output_names=["logits", *present_names],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            dynamo=False
+        )
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    os.replace(tmp_dir, os.path.dirname(path))
+
+
+class OnnxCausalLM(nn.Module):
+    """以 ONNX Runtime 執行匯出圖的因果語言模型
+
+    提供與 transformers 模型相同的前向介面（KV cache 為 DynamicCache，就地更新）與貪婪解碼的 generate，
+    標籤評分、前綴 cache 與結構化生成不需要區分後端
+    """
+
+    main_input_name = "input_ids"
+
+    def __init__(self, path: str, config, threads: Optional[int] = None):
+        super().__init__()
+        self.path = path
+        self.config = config
+        self.threads = threads
+        self.num_layers = config.num_hidden_layers
+        self.kv_heads, self.head_dim = _kv_shape(config)
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def device(self) -> torch.device:
+        return torch.device("cpu")
+
+    def _get_session(self):
+        # fork 出的 worker 重新建立 session（ONNX Runtime 的執行緒池無法跨 fork 使用），
+        # 執行緒數沿用該進程的 torch 設定
+        if self._session is None or self._session_pid != os.getpid():
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.threads or torch.get_num_threads()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+            self._session_pid = os.getpid()
+        return self._session
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None,
+                position_ids: Optional[torch.Tensor] = None, past_key_values: Optional[DynamicCache] = None,
+                use_cache: bool = True, logits_to_keep: int = 0, **kwargs) -> CausalLMOutputWithPast:
+        batch, length = input_ids.shape
+        cache = past_key_values if past_key_values is not None else DynamicCache()
+        past_length = cache.get_seq_length()
+        if attention_mask is None:
+            attention_mask = torch.ones((batch, past_length + length), dtype=torch.long)
+        if position_ids is None:
+            position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -length:]
+        keep = min(logits_to_keep, length) if logits_to_keep else length
+
+        feed = {
+            "input_ids": input_ids.cpu().numpy(),
+            "attention_mask": attention_mask.cpu().numpy(),
+            "position_ids": position_ids.cpu().numpy(),
+            "logits_to_keep": torch.zeros(keep).numpy()
+        }
+        empty = torch.zeros((batch, self.kv_heads, 0, self.head_dim))
+        for layer in range(self.num_layers):
+            key, value = (cache.key_cache[layer], cache.value_cache[layer]) if past_length else (empty, empty)
+            # 前綴 cache 以 expand 共享，ONNX Runtime 需要連續記憶體
+            feed[f"past.{layer}.key"] = key.expand(batch, -1, -1, -1).contiguous().numpy()
+            feed[f"past.{layer}.value"] = value.expand(batch, -1, -1, -1).contiguous().numpy()
+
+        outputs = self._get_session().run(None, feed)
+
+        for layer in range(self.num_layers):
+            key = torch.from_numpy(outputs[1 + 2 * layer])
+            value = torch.from_numpy(outputs[2 + 2 * layer])
+            if len(cache.key_cache) <= layer:
+                cache.update(key, value, layer)
+            else:
+                # 輸出已是含 past 的完整 cache，直接替換
+                cache.key_cache[layer] = key
+                cache.value_cache[layer] = value
+        return CausalLMOutputWithPast(logits=torch.from_numpy(outputs[0]), past_key_values=cache)
+
+    @torch.no_grad()
+    def generate(self, input_ids: torch.Tensor, attention_mask: torch.Tensor,
+                 past_key_values: Optional[DynamicCache] = None, max_new_tokens: int = 128,
+                 logits_processor=None, stopping_criteria=None, pad_token_id: Optional[int] = None,
+                 eos_token_id: Optional[int] = None, do_sample: bool = False, num_beams: int = 1,
+                 assistant_model=None, **kwargs) -> torch.Tensor:
+        """貪婪解碼（服務只使用貪婪解碼）；已結束的序列補 pad_token_id，全部結束或達到上限即停止"""
+        if do_sample or num_beams != 1 or assistant_model is not None:
+            raise ValueError("ONNX 後端只支援貪婪解碼")
+        cache = past_key_values if past_key_values is not None else DynamicCache()
+        sequences = input_ids
+        unfinished = torch.ones(input_ids.shape[0], dtype=torch.bool)
+        next_input = input_ids[:, cache.get_seq_length():]
+
+        for _ in range(max_new_tokens):
+            outputs = self(input_ids=next_input, attention_mask=attention_mask, past_key_values=cache,
+                           logits_to_keep=1)
+            scores = outputs.logits[:, -1].float()
+            if logits_processor is not None:
+                scores = logits_processor(sequences, scores)
+            next_tokens = scores.argmax(dim=-1)
+            if pad_token_id is not None:
+                next_tokens = torch.where(unfinished, next_tokens, torch.full_like(next_tokens, pad_token_id))
+
+            sequences = torch.cat([sequences, next_tokens[:, None]], dim=-1)
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((attention_mask.shape[0], 1))], dim=-1)
+            if eos_token_id is not None:
+                unfinished &= next_tokens != eos_token_id
+            if stopping_criteria is not None:
+                unfinished &= ~stopping_criteria(sequences, scores)
+            if not unfinished.any():
+                break
+            next_input = next_tokens[:, None]
+        return sequences
+
+
+class OnnxBackend(InferenceBackend):
+    """ONNX Runtime 後端：匯出的圖依權重指紋快取在 export_dir 之下，權重不變時重新啟動直接載入
+
+    Args:
+        export_dir: 匯出圖的根目錄
+        fingerprint: 權重指紋（基礎模型、adapter、精度），決定匯出的子目錄
+        threads: ONNX Runtime 的執行緒數（None 時沿用 torch 設定）
+    """
+
+    name = "onnx"
+    supports_speculative = False
+    # 匯出 float32 圖；量化由 PyTorch 設定檔實作，無法直接匯出
+    supported_profiles = ("fp32",)
+    supports_cuda = False
+
+    def __init__(self, export_dir: str, fingerprint: str, threads: Optional[int] = None):
+        self.export_dir = export_dir
+        self.fingerprint = fingerprint
+        self.threads = threads
+        self.path = os.path.join(export_dir, fingerprint, "model.onnx")
+        self._stats = {"exported": False, "export_time_s": None}
+
+    def prepare(self, model: nn.Module, device: str) -> nn.Module:
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError("ONNX 後端需要 onnxruntime 與 onnx: pip install onnxruntime onnx") from e
+
+        if isinstance(model, PeftModel):
+            model = model.merge_and_unload()
+        config = model.config
+
+        if not os.path.exists(self.path):
+            logger.info(f"📦 匯出 ONNX 圖: {self.path}")
+            started = time.time()
+            export_onnx(model, self.path)
+            self._stats = {"exported": True, "export_time_s": round(time.time() - started, 2)}
+            logger.info(f"✅ ONNX 匯出完成 (耗時 {self._stats['export_time_s']:.1f}s)")
+        else:
+            logger.info(f"📦 使用已匯出的 ONNX 圖: {self.path}")
+
+        onnx_model = OnnxCausalLM(self.path, config, self.threads)
+        onnx_model._get_session()
+        return onnx_model
+
+    def get_stats(self) -> Dict:
+        directory = os.path.dirname(self.path)
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) \
+            if os.path.isdir(directory) else 0
+        return {
+            "name": self.name,
+            "path": self.path,
+            "graph_size_mb": round(size / 1024**2, 1),
+            **self._stats
+        }
+
+
+def create_backend(name: str, onnx_dir: str = "./onnx", fingerprint: str = "", threads: Optional[int] = None,
+                   compile_mode: Optional[str] = None) -> InferenceBackend:
+    if name == "sdpa":
+        return SdpaBackend()
+    if name == "compile":
+        return CompileBackend(compile_mode)
+    if name == "onnx":
+        return OnnxBackend(onnx_dir, fingerprint, threads)
+    return InferenceBackend()
@@ -0,0 +1,256 @@
+"""
+動態微批次排程器
+收集短時間窗口內到達的推論請求，以最早的請求為錨點挑選長度相近的請求合併為一個批次，
+減少 padding 並讓一次 generate 服務多個請求。帶分組鍵（例如 LoRA adapter）的請求只與同組的請求合併。
+批次中的請求全部取消時，執行中的批次也一併取消
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Set
+
+from .executor import InferenceQueueFull
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchItem:
+    """排隊中的推論請求"""
+    payload: Any
+    cost: int
+    future: asyncio.Future
+    group: Hashable = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """最近鄰分位數（samples 為空時返回 0）"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class BatchScheduler:
+    """微批次排程器
+
+    Args:
+        run_batch: 批次推論函數，輸入 payload 列表與批次的分組鍵，返回等長的結果列表（或返回該列表的 awaitable）
+        max_batch_size: 單批最大請求數
+        max_wait_ms: 最早的請求最多等待多久以湊成批次
+        max_batch_tokens: 單批 padding 後的 token 上限（批次大小 × 最長序列）
+        max_concurrent_batches: 同時執行中的批次上限（多個推論進程時可大於 1）
+        max_queue_depth: 排隊中的請求上限，超出時拋出 InferenceQueueFull（None 表示不限）
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any], Hashable], Any], max_batch_size: int = 8,
+                 max_wait_ms: float = 10.0, max_batch_tokens: int = 8192, name: str = "generate",
+                 max_concurrent_batches: int = 1, max_queue_depth: Optional[int] = None):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_tokens = max_batch_tokens
+        self.name = name
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.max_queue_depth = max_queue_depth
+
+        self._pending: List[BatchItem] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._running: Set[asyncio.Task] = set()
+
+        self._batch_sizes: Counter = Counter()
+        self._group_batches: Counter = Counter()
+        self._queue_times: Deque[float] = deque(maxlen=1000)
+        self._batch_times: Deque[float] = deque(maxlen=1000)
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "rejected": 0,
+            "batches": 0,
+            "real_tokens": 0,
+            "padded_tokens": 0
+        }
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = asyncio.get_running_loop().create_task(self._run_forever())
+
+    async def submit(self, payload: Any, cost: int = 1, group: Hashable = None) -> Any:
+        """提交一個請求並等待其結果（只與相同 group 的請求合併批次）"""
+        self._ensure_worker()
+        if self.max_queue_depth is not None and len(self._pending) >= self.max_queue_depth:
+            self._stats["rejected"] += 1
+            raise InferenceQueueFull(f"{self.name} 排隊請求已達上限 ({self.max_queue_depth})")
+        item = BatchItem(payload=payload, cost=max(1, cost), future=asyncio.get_running_loop().create_future(),
+                         group=group)
+        self._pending.append(item)
+        self._stats["submitted"] += 1
+        self._wakeup.set()
+        return await item.future
+
+    def _budget_full(self) -> bool:
+        """最早請求所在的組是否已湊滿一批"""
+        group = [item for item in self._pending if item.group == self._pending[0].group]
+        if len(group) >= self.max_batch_size:
+            return True
+        longest = max(item.cost for item in group)
+        return longest * len(group) >= self.max_batch_tokens
+
+    async def _run_forever(self):
+        while True:
+            self._drop_cancelled()
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # 等待空閒的執行槽位；等待期間新到的請求會併入下一批
+            await self._slots.acquire()
+
+            # 從最早請求到達時起算等待窗口
+            deadline = self._pending[0].enqueued_at + self.max_wait
+            while not self._budget_full():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._take_batch()
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.get_running_loop().create_task(self._execute(batch))
+            self._running.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task):
+        self._running.discard(task)
+        self._slots.release()
+
+    def _drop_cancelled(self):
+        before = len(self._pending)
+        self._pending = [item for item in self._pending if not item.future.done()]
+        self._stats["cancelled"] += before - len(self._pending)
+
+    def _take_batch(self) -> List[BatchItem]:
+        """以最早的請求為錨點，從同組的請求中挑選長度最接近的填滿批次"""
+        self._drop_cancelled()
+        if not self._pending:
+            return []
+
+        anchor = self._pending[0]
+        candidates = sorted((item for item in self._pending[1:] if item.group == anchor.group),
+                            key=lambda item: abs(item.cost - anchor.cost))
+        batch = [anchor]
+        longest = anchor.cost
+        for item in candidates:
+            if len(batch) >= self.max_batch_size:
+                break
+            if max(longest, item.cost) * (len(batch) + 1) > self.max_batch_tokens:
+                continue
+            batch.append(item)
+            longest = max(longest, item.cost)
+
+        chosen = {id(item) for item in batch}
+        self._pending = [item for item in self._pending if id(item) not in chosen]
+        batch.sort(key=lambda item: item.cost)
+        return batch
+
+    async def _dispatch(self, payloads: List[Any], group: Hashable) -> List[Any]:
+        results = self.run_batch(payloads, group)
+        if inspect.isawaitable(results):
+            results = await results
+        return results
+
+    async def _execute(self, batch: List[BatchItem]):
+        started = time.monotonic()
+        for item in batch:
+            self._queue_times.append(started - item.enqueued_at)
+
+        self._stats["batches"] += 1
+        self._batch_sizes[len(batch)] += 1
+        self._group_batches[batch[0].group] += 1
+        self._stats["real_tokens"] += sum(item.cost for item in batch)
+        self._stats["padded_tokens"] += max(item.cost for item in batch) * len(batch)
+
+        dispatch = asyncio.ensure_future(self._dispatch([item.payload for item in batch], batch[0].group))
+
+        def abandon(_):
+            if all(item.future.cancelled() for item in batch):
+                dispatch.cancel()
+        for item in batch:
+            item.future.add_done_callback(abandon)
+
+        try:
+            results = await dispatch
+            if len(results) != len(batch):
+                raise RuntimeError(f"批次結果數量不符: {len(results)} != {len(batch)}")
+        except asyncio.CancelledError:
+            if not dispatch.cancelled() or asyncio.current_task().cancelling():
+                raise
+            # 所有請求都已取消（例如客戶端斷線）
+            self._stats["cancelled"] += len(batch)
+            return
+        except Exception as e:
+            logger.error(f"❌ 批次推論失敗 ({self.name}, {len(batch)} 個請求): {e}")
+            self._stats["failed"] += len(batch)
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        finally:
+            self._batch_times.append(time.monotonic() - started)
+
+        for item, result in zip(batch, results):
+            if item.future.done():
+                continue
+            if isinstance(result, Exception):
+                self._stats["failed"] += 1
+                item.future.set_exception(result)
+            else:
+                self._stats["completed"] += 1
+                item.future.set_result(result)
+
+    def get_stats(self) -> Dict:
+        """批次大小分布與排隊時間統計"""
+        queue_times = list(self._queue_times)
+        batch_times = list(self._batch_times)
+        padded = self._stats["padded_tokens"]
+        return {
+            **self._stats,
+            "queue_depth": len(self._pending),
+            "running_batches": len(self._running),
+            "max_concurrent_batches": self.max_concurrent_batches,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch_tokens": self.max_batch_tokens,
+            "batch_size_distribution": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+            "batches_by_group": {str(group): count for group, count in self._group_batches.items()},
+            "mean_batch_size": round(sum(size * count for size, count in self._batch_sizes.items()) /
+                                     max(self._stats["batches"], 1), 2),
+            "padding_efficiency": round(self._stats["real_tokens"] / padded, 3) if padded else 1.0,
+            "queue_time_ms": {
+                "p50": round(percentile(queue_times, 0.5) * 1000, 2),
+                "p95": round(percentile(queue_times, 0.95) * 1000, 2),
+                "max": round(max(queue_times, default=0.0) * 1000, 2)
+            },
+            "batch_time_ms": {
+                "p50": round(percentile(batch_times, 0.5) * 1000, 2),
+                "p95": round(percentile(batch_times, 0.95) * 1000, 2)
+            }
+        }
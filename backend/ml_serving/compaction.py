@@ -0,0 +1,163 @@
+"""
+輸入壓縮（分詞前）
+原始代碼中的註解、空行、module 內重複的 use 引入、重複的樣板項目，以及 normalized package 渲染出的
+`// Function body` 佔位函數體都會佔用 2048 個 token 的提示詞上限與推論計算。壓縮後：
+- 移除註解（保留 normalized 渲染的 `// Module:` 標記）、空行與行尾空白，空函數體收為 `{}`
+- 移除同一個 module 內重複的 use 引入與內容完全相同的項目（各 module 有自己的命名空間，跨 module 不去重），
+  以及 #[test] / #[test_only] 項目
+- 每個 module 內依安全相關性排序：entry 函數、init、權限（Cap）與 key 物件結構優先，
+  其次是 public 函數與涉及轉移、資產或可變引用的函數，其餘在後（超過上限被截斷或切分窗口時，重要的部分在前）
+每一行保留原始行號，窗口位置仍可對應回原始代碼
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+from .windowing import _ITEM_PATTERN, _brace_delta, split_segments
+
+# 字串原樣保留（其中的 // 不是註解）
+_COMMENT_PATTERN = re.compile(r'(b?"(?:[^"\\]|\\.)*")|//[^\n]*|/\*.*?\*/', re.DOTALL)
+_MODULE_MARKER = "// Module:"
+_MODULE_PATTERN = re.compile(r"^\s*(?:module|script)\b")
+_USE_PATTERN = re.compile(r"^\s*(?:public\s+)?use\b")
+_TEST_PATTERN = re.compile(r"^\s*#\[\s*(?:test|test_only|expected_failure)\b")
+_SPACE_PATTERN = re.compile(r"\s+")
+
+_CAPABILITY_PATTERN = re.compile(r"\bstruct\s+\w*(?:Cap|Capability|Admin|Owner|Treasury)\b|\bhas\b[^{]*\bkey\b")
+_PRIVILEGED_PATTERN = re.compile(r"\bentry\b[^{]*\bfun\b|\bfun\s+init\b")
+_PUBLIC_PATTERN = re.compile(r"\bpublic\b[^{]*\bfun\b")
+_SENSITIVE_PATTERN = re.compile(r"\b(?:transfer|coin|balance|dynamic_field|dynamic_object_field)::|&mut\b")
+
+
+@dataclass
+class CompactedCode:
+    """壓縮結果：text 的第 i 行對應原始代碼的第 line_map[i] 行"""
+    text: str
+    line_map: List[int]
+    stats: Dict[str, int] = field(default_factory=dict)
+
+    def original_range(self, start_line: int, end_line: int) -> Tuple[int, int]:
+        """壓縮後的行範圍（從 1 起算，含頭尾）-> 涵蓋的原始行範圍（排序後原始行號不一定連續）"""
+        numbers = self.line_map[max(start_line, 1) - 1:end_line]
+        return (min(numbers), max(numbers)) if numbers else (start_line, end_line)
+
+
+def _item_rank(lines: List[Tuple[int, str]]) -> int:
+    """安全相關性：0 最優先"""
+    text = "\n".join(line for _, line in lines)
+    signature = next((line for _, line in lines if not line.lstrip().startswith("#[")), "")
+    if _PRIVILEGED_PATTERN.search(signature) or _CAPABILITY_PATTERN.search(signature):
+        return 0
+    if _PUBLIC_PATTERN.search(signature) or _SENSITIVE_PATTERN.search(text):
+        return 1
+    return 2
+
+
+def _strip_closers(lines: List[Tuple[int, str]]) -> Tuple[List[Tuple[int, str]], List[Tuple[int, str]]]:
+    """分出項目末尾屬於外層 module 的右大括號行（排序時留在 module 結尾）"""
+    excess = -_brace_delta("\n".join(text for _, text in lines))
+    closers = []
+    while excess > 0 and lines and set(lines[-1][1].strip()) <= {"}", ";"}:
+        excess -= lines[-1][1].count("}")
+        closers.insert(0, lines[-1])
+        lines = lines[:-1]
+    return lines, closers
+
+
+def _clean_lines(code: str, stats: Dict[str, int]) -> List[Tuple[int, str]]:
+    """移除註解、空行與行尾空白，空函數體收為 {}；返回 (原始行號, 文字)"""
+    def strip_comment(match):
+        if match.group(1) is not None or match.group().startswith(_MODULE_MARKER):
+            return match.group()
+        stats["comments"] += 1
+        return "\n" * match.group().count("\n")
+
+    lines = []
+    for number, line in enumerate(_COMMENT_PATTERN.sub(strip_comment, code).split("\n"), start=1):
+        line = line.rstrip()
+        if not line.strip():
+            stats["blank_lines"] += 1
+            continue
+        if lines and lines[-1][1].endswith("{") and line.strip() == "}":
+            # 註解移除後只剩空白的函數體（normalized 渲染的佔位）
+            lines[-1] = (lines[-1][0], lines[-1][1] + "}")
+            stats["empty_bodies"] += 1
+            continue
+        lines.append((number, line))
+    return lines
+
+
+def _module_chunks(lines: List[Tuple[int, str]]) -> List[List[Tuple[int, str]]]:
+    """依 normalized 渲染的 `// Module:` 標記分段（原始碼的 module 由 split_segments 處理）"""
+    chunks = [[]]
+    for line in lines:
+        if line[1].lstrip().startswith(_MODULE_MARKER) and chunks[-1]:
+            chunks.append([])
+        chunks[-1].append(line)
+    return chunks
+
+
+@dataclass
+class _ModuleGroup:
+    """一個 module 的開頭（宣告與 use）、項目與結尾的右大括號，以及 module 內已出現過的 use 與項目"""
+    head: List[Tuple[int, str]] = field(default_factory=list)
+    items: List[List[Tuple[int, str]]] = field(default_factory=list)
+    closers: List[Tuple[int, str]] = field(default_factory=list)
+    seen_uses: Set[str] = field(default_factory=set)
+    seen_items: Set[str] = field(default_factory=set)
+
+
+def compact_code(code: str) -> CompactedCode:
+    """壓縮 Move 代碼，返回壓縮後的文字、行號對應與各項移除的數量"""
+    stats = {"comments": 0, "blank_lines": 0, "empty_bodies": 0, "duplicate_uses": 0, "duplicate_items": 0,
+             "test_items": 0, "reordered_items": 0}
+    output: List[Tuple[int, str]] = []
+
+    for chunk in _module_chunks(_clean_lines(code, stats)):
+        groups: List[_ModuleGroup] = []
+        for segment in split_segments("\n".join(text for _, text in chunk)):
+            lines = chunk[segment.start_line - 1:segment.end_line]
+            first = lines[0][1].lstrip()
+            opens_module = bool(_MODULE_PATTERN.match(first)) or first.startswith(_MODULE_MARKER)
+            if opens_module or not groups:
+                groups.append(_ModuleGroup())
+            group = groups[-1]
+
+            lines, closers = _strip_closers(lines)
+            group.closers = closers + group.closers
+            if not lines:
+                continue
+
+            if opens_module or not (group.items or _ITEM_PATTERN.match(first)):
+                # module 開頭：保留宣告，移除同一個 module 內重複的 use
+                for line in lines:
+                    if _USE_PATTERN.match(line[1]):
+                        key = _SPACE_PATTERN.sub(" ", line[1].strip())
+                        if key in group.seen_uses:
+                            stats["duplicate_uses"] += 1
+                            continue
+                        group.seen_uses.add(key)
+                    group.head.append(line)
+                continue
+
+            if any(_TEST_PATTERN.match(text) for _, text in lines):
+                stats["test_items"] += 1
+                continue
+            key = _SPACE_PATTERN.sub(" ", " ".join(text for _, text in lines)).strip()
+            if key in group.seen_items:
+                stats["duplicate_items"] += 1
+                continue
+            group.seen_items.add(key)
+            group.items.append(lines)
+
+        for group in groups:
+            # 穩定排序：同一等級維持原始順序
+            ranked = sorted(group.items, key=_item_rank)
+            stats["reordered_items"] += sum(a is not b for a, b in zip(ranked, group.items))
+            output.extend(group.head)
+            for item in ranked:
+                output.extend(item)
+            output.extend(group.closers)
+
+    return CompactedCode("\n".join(text for _, text in output), [number for number, _ in output], stats)
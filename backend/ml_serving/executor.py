@@ -0,0 +1,106 @@
+"""
+專用推論執行緒
+模型推論（前向傳播、generate）與模型載入都是長時間的同步運算，直接在 async 函數中執行會阻塞事件迴圈，
+讓 /health、/stats 在推論期間無法回應。所有推論工作改由單一專用執行緒依序執行，
+事件迴圈只負責排隊與等待結果；佇列有上限，超出時立即拒絕而不是無限堆積
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFull(RuntimeError):
+    """推論佇列已滿（服務過載），呼叫端應稍後重試"""
+
+
+def _set_result(future: asyncio.Future, result: Any):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, error: BaseException):
+    if not future.done():
+        future.set_exception(error)
+
+
+def _deliver(loop: asyncio.AbstractEventLoop, callback: Callable, future: asyncio.Future, value: Any):
+    try:
+        loop.call_soon_threadsafe(callback, future, value)
+    except RuntimeError:
+        # 事件迴圈已關閉，沒有人在等待結果
+        pass
+
+
+class InferenceExecutor:
+    """單一專用執行緒 + 有界佇列
+
+    與 ThreadPoolExecutor 不同：佇列長度有上限，且保證同一時間只有一個推論在執行
+    （模型與 KV cache 不需要額外加鎖）
+
+    Args:
+        max_queue: 等待執行的工作上限
+        name: 執行緒名稱
+    """
+
+    def __init__(self, max_queue: int = 8, name: str = "ml-inference"):
+        self.max_queue = max(1, max_queue)
+        self.name = name
+        self._queue: queue.Queue = queue.Queue(maxsize=self.max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._busy_since: Optional[float] = None
+        self._stats = {"completed": 0, "failed": 0, "rejected": 0, "cancelled": 0}
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run_forever, name=self.name, daemon=True)
+                self._thread.start()
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """在推論執行緒上執行 fn(*args) 並等待結果；佇列已滿時拋出 InferenceQueueFull"""
+        self._ensure_thread()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            self._queue.put_nowait((loop, future, fn, args))
+        except queue.Full:
+            self._stats["rejected"] += 1
+            raise InferenceQueueFull(f"推論佇列已滿 ({self.max_queue})")
+        return await future
+
+    def _run_forever(self):
+        while True:
+            loop, future, fn, args = self._queue.get()
+            if future.done():
+                # 等待期間已被取消（例如請求逾時），不必執行
+                self._stats["cancelled"] += 1
+                continue
+
+            self._busy_since = time.monotonic()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                self._stats["failed"] += 1
+                _deliver(loop, _set_exception, future, e)
+            else:
+                self._stats["completed"] += 1
+                _deliver(loop, _set_result, future, result)
+            finally:
+                self._busy_since = None
+
+    def get_stats(self) -> Dict:
+        busy_since = self._busy_since
+        return {
+            **self._stats,
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "busy": busy_since is not None,
+            "current_task_s": round(time.monotonic() - busy_since, 2) if busy_since is not None else 0.0
+        }
@@ -0,0 +1,235 @@
+"""
+快速分類層（級聯推論的第一層）
+token 1-3 gram 特徵雜湊 + 多類別邏輯迴歸，CPU 上數毫秒內完成：信心度達到門檻時直接回答，
+否則升級到 LoRA 模型。模型由 ml/train_fast_tier.py 以訓練數據集與 LoRA 模型的偽標籤訓練，
+服務端只需要 NumPy
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FEATURE_DIM = 1 << 14
+
+_COMMENT_PATTERN = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+_NUMBER_PATTERN = re.compile(r"\b0x[0-9a-fA-F]+\b|\b\d+(?:u8|u16|u32|u64|u128|u256)?\b")
+_STRING_PATTERN = re.compile(r'b?"(?:[^"\\]|\\.)*"')
+_TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|::|[-+*/%<>=!&|^]=?|[{}()\[\];,.:]")
+
+# 信心度分桶（用於依信心度統計與 LoRA 模型的一致率，調整門檻）
+CONFIDENCE_BUCKETS = (0.0, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+
+# 保留集太小、無法可靠估計門檻時使用的保守門檻（只有幾乎確定的請求由快速層直接回答）
+CONSERVATIVE_THRESHOLD = 0.99
+
+
+def extract_features(code: str, dim: int = DEFAULT_FEATURE_DIM) -> Tuple[np.ndarray, np.ndarray]:
+    """Move 代碼 -> 稀疏特徵 (索引, 數值)：token 1-3 gram 雜湊到 dim 維，對數詞頻後 L2 正規化"""
+    text = _COMMENT_PATTERN.sub(" ", code)
+    text = _STRING_PATTERN.sub(" STR ", text)
+    text = _NUMBER_PATTERN.sub(" NUM ", text)
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+
+    counts: Dict[str, int] = {}
+    for n in (1, 2, 3):
+        for i in range(len(tokens) - n + 1):
+            gram = " ".join(tokens[i:i + n])
+            counts[gram] = counts.get(gram, 0) + 1
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    features: Dict[int, float] = {}
+    for gram, count in counts.items():
+        digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest, "little") % dim
+        features[index] = features.get(index, 0.0) + 1.0 + float(np.log(count))
+
+    indices = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+    values = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+    values /= np.linalg.norm(values)
+    return indices, values
+
+
+class FastTierClassifier:
+    """n-gram 邏輯迴歸分類器
+
+    Args:
+        weights: [dim, 類別數] 權重
+        bias: [類別數] 偏差
+        labels: 類別標籤（與 ML 服務的分類標籤一致）
+        metadata: 訓練資訊（樣本數、建議門檻、評估結果）
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: Sequence[str], metadata: Optional[Dict] = None):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.labels = list(labels)
+        self.metadata = metadata or {}
+        self.dim = self.weights.shape[0]
+        self.fingerprint = hashlib.sha256(self.weights.tobytes() + self.bias.tobytes()).hexdigest()[:16]
+
+    @classmethod
+    def load(cls, path: str) -> "FastTierClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["weights"], data["bias"], [str(label) for label in data["labels"]],
+                       json.loads(str(data["metadata"])))
+
+    def save(self, path: str):
+        # np.savez 會自動補上 .npz，先寫入暫存檔再替換，避免服務讀到寫到一半的檔案
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, weights=self.weights, bias=self.bias, labels=np.array(self.labels),
+                 metadata=np.array(json.dumps(self.metadata, ensure_ascii=False)))
+        os.replace(tmp_path, path)
+
+    def predict_proba(self, code: str) -> Dict[str, float]:
+        indices, values = extract_features(code, self.dim)
+        logits = values @ self.weights[indices] + self.bias
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        return {label: float(p) for label, p in zip(self.labels, probs)}
+
+    def predict(self, code: str) -> Tuple[str, float, Dict[str, float]]:
+        """返回 (標籤, 信心度, 各標籤機率)"""
+        probabilities = self.predict_proba(code)
+        label = max(probabilities, key=probabilities.get)
+        return label, probabilities[label], probabilities
+
+
+def train_classifier(samples: List[Tuple[str, str, float]], labels: Sequence[str], dim: int = DEFAULT_FEATURE_DIM,
+                     epochs: int = 200, learning_rate: float = 0.5, l2: float = 1e-4,
+                     seed: int = 42) -> FastTierClassifier:
+    """以 (代碼, 標籤, 樣本權重) 訓練多類別邏輯迴歸
+
+    稀疏特徵以 EmbeddingBag（加權求和）表示，全批次 Adam 訓練，不需要建立 N x dim 的稠密矩陣
+    """
+    import torch
+
+    torch.manual_seed(seed)
+    label_index = {label: i for i, label in enumerate(labels)}
+    flat_indices, flat_values, offsets = [], [], []
+    position = 0
+    for code, _, _ in samples:
+        indices, values = extract_features(code, dim)
+        offsets.append(position)
+        flat_indices.append(indices)
+        flat_values.append(values)
+        position += len(indices)
+
+    indices = torch.from_numpy(np.concatenate(flat_indices)) if flat_indices else torch.zeros(0, dtype=torch.long)
+    values = torch.from_numpy(np.concatenate(flat_values)) if flat_values else torch.zeros(0)
+    offsets = torch.tensor(offsets, dtype=torch.long)
+    targets = torch.tensor([label_index[label] for _, label, _ in samples], dtype=torch.long)
+    sample_weights = torch.tensor([weight for _, _, weight in samples], dtype=torch.float32)
+
+    bag = torch.nn.EmbeddingBag(dim, len(labels), mode="sum")
+    torch.nn.init.zeros_(bag.weight)
+    bias = torch.nn.Parameter(torch.zeros(len(labels)))
+    optimizer = torch.optim.Adam([bag.weight, bias], lr=learning_rate)
+
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        logits = bag(indices, offsets, per_sample_weights=values) + bias
+        loss = (torch.nn.functional.cross_entropy(logits, targets, reduction="none") * sample_weights).sum()
+        loss = loss / sample_weights.sum() + l2 * bag.weight.pow(2).sum()
+        loss.backward()
+        optimizer.step()
+
+    return FastTierClassifier(bag.weight.detach().numpy(), bias.detach().numpy(), labels)
+
+
+def threshold_sweep(confidences: Sequence[float], correct: Sequence[bool],
+                    thresholds: Sequence[float] = tuple(np.round(np.arange(0.5, 1.0, 0.05), 2))) -> List[Dict]:
+    """各門檻下快速層可直接回答的比例（coverage）與這些回答的正確率"""
+    confidences = np.asarray(confidences, dtype=np.float64)
+    correct = np.asarray(correct, dtype=bool)
+    rows = []
+    for threshold in thresholds:
+        covered = confidences >= threshold
+        rows.append({
+            "threshold": float(threshold),
+            "coverage": round(float(covered.mean()), 4) if len(covered) else 0.0,
+            "answered": int(covered.sum()),
+            "accuracy": round(float(correct[covered].mean()), 4) if covered.any() else None
+        })
+    return rows
+
+
+def suggest_threshold(sweep: List[Dict], target_accuracy: float, min_answered: int = 1) -> Optional[float]:
+    """正確率達標的最低門檻（最大化快速層覆蓋率），找不到時返回 None"""
+    for row in sweep:
+        if row["answered"] >= min_answered and row["accuracy"] is not None and row["accuracy"] >= target_accuracy:
+            return row["threshold"]
+    return None
+
+
+class CascadeMonitor:
+    """級聯推論的統計：各層回答比例，以及快速層與 LoRA 模型依信心度分桶的一致率
+
+    升級到 LoRA 的請求天然提供門檻以下的比較；門檻以上的比較來自抽樣稽核
+    """
+
+    def __init__(self):
+        self._stats = {"requests": 0, "fast": 0, "escalated": 0, "audited": 0}
+        self._buckets = [{"compared": 0, "agreed": 0} for _ in CONFIDENCE_BUCKETS[:-1]]
+        # 門檻以上（稽核）與門檻以下（升級）的比較
+        self._above = {"compared": 0, "agreed": 0}
+        self._below = {"compared": 0, "agreed": 0}
+        self._fast_ms: List[float] = []
+
+    @staticmethod
+    def _bucket(confidence: float) -> int:
+        for index, upper in enumerate(CONFIDENCE_BUCKETS[1:]):
+            if confidence < upper:
+                return index
+        return len(CONFIDENCE_BUCKETS) - 2
+
+    def record_fast(self, elapsed_s: float):
+        self._stats["requests"] += 1
+        self._stats["fast"] += 1
+        self._fast_ms.append(elapsed_s * 1000)
+        del self._fast_ms[:-1000]
+
+    def record_escalation(self):
+        self._stats["requests"] += 1
+        self._stats["escalated"] += 1
+
+    def record_comparison(self, fast_label: str, fast_confidence: float, lora_label: str, audit: bool = False):
+        """記錄快速層與 LoRA 模型的比較；audit 為 True 表示快速層已直接回答（門檻以上）"""
+        if audit:
+            self._stats["audited"] += 1
+        agreed = int(fast_label == lora_label)
+        for counter in (self._buckets[self._bucket(fast_confidence)], self._above if audit else self._below):
+            counter["compared"] += 1
+            counter["agreed"] += agreed
+
+    def get_stats(self, threshold: float) -> Dict:
+        requests = self._stats["requests"]
+
+        def agreement(counter):
+            return round(counter["agreed"] / counter["compared"], 4) if counter["compared"] else None
+
+        fast_ms = sorted(self._fast_ms)
+        return {
+            **self._stats,
+            "fast_rate": round(self._stats["fast"] / requests, 4) if requests else 0.0,
+            "escalation_rate": round(self._stats["escalated"] / requests, 4) if requests else 0.0,
+            "fast_p50_ms": round(fast_ms[len(fast_ms) // 2], 2) if fast_ms else 0.0,
+            "threshold": threshold,
+            "agreement_above_threshold": agreement(self._above),
+            "agreement_below_threshold": agreement(self._below),
+            "agreement_by_confidence": [
+                {
+                    "confidence": f"{low:.2f}-{high:.2f}",
+                    **bucket,
+                    "agreement": agreement(bucket)
+                }
+                for low, high, bucket in zip(CONFIDENCE_BUCKETS[:-1], CONFIDENCE_BUCKETS[1:], self._buckets)
+            ]
+        }
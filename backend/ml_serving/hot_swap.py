@@ -0,0 +1,88 @@
+"""
+adapter 熱更新
+新版本在背景附加為新的具名 adapter（<名稱>@<序號>），以 canary 提示詞預熱並檢查輸出後，原子地切換新請求；
+進行中的請求固定在開始時的版本上完成，舊版本沒有請求使用後才刪除。
+AdapterWatcher 輪詢 adapter 目錄的權重指紋，訓練服務覆寫目錄（內容穩定一個週期）後自動觸發熱更新
+"""
+
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional
+
+from .merged_checkpoint import adapter_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class SwapConflict(RuntimeError):
+    """目前無法熱更新（已有熱更新進行中，或模型已合併 LoRA）"""
+
+# 預熱與檢查新版本的提示詞：涵蓋權限、算術與安全的代碼
+CANARY_SNIPPETS = (
+    "module canary::cap {\n    struct AdminCap has key, store { id: UID }\n"
+    "    public fun leak(cap: AdminCap, to: address) { transfer::public_transfer(cap, to) }\n}",
+    "module canary::math {\n    public fun add(a: u64, b: u64): u64 { a + b }\n"
+    "    public fun scale(a: u64): u64 { a * 1000000000 }\n}",
+    "module canary::safe {\n    public fun max(a: u64, b: u64): u64 { if (a > b) { a } else { b } }\n}",
+)
+
+
+def directory_fingerprint(path: str) -> Optional[str]:
+    """adapter 目錄的權重指紋，目錄不存在或沒有 adapter 檔案時返回 None"""
+    if not os.path.isdir(path) or not os.path.exists(os.path.join(path, "adapter_config.json")):
+        return None
+    try:
+        return adapter_fingerprint(path)
+    except OSError:
+        return None
+
+
+class AdapterWatcher:
+    """輪詢 adapter 目錄，指紋與目前載入的版本不同且連續兩次輪詢相同時觸發熱更新
+
+    Args:
+        current: 返回 {名稱: (目錄, 目前載入版本的指紋)}，模型未載入時返回空字典
+        on_change: 熱更新函數 (名稱, 目錄)
+        interval: 輪詢間隔（秒）
+    """
+
+    def __init__(self, current: Callable[[], Dict[str, tuple]],
+                 on_change: Callable[[str, str], Awaitable[Dict]], interval: float):
+        self.current = current
+        self.on_change = on_change
+        self.interval = interval
+        self._seen: Dict[str, Optional[str]] = {}
+        self._failed: Dict[str, str] = {}  # 名稱 -> 熱更新失敗的指紋
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info(f"👀 監看 adapter 目錄 (每 {self.interval:g}s)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for name, (path, loaded) in self.current().items():
+                # 指紋計算讀取整個權重檔，不在事件迴圈上執行
+                fingerprint = await asyncio.to_thread(directory_fingerprint, path)
+                previous, self._seen[name] = self._seen.get(name), fingerprint
+                if fingerprint in (None, loaded, self._failed.get(name)) or fingerprint != previous:
+                    continue
+                logger.info(f"🔄 偵測到 adapter {name} 已更新: {path}")
+                try:
+                    await self.on_change(name, path)
+                except Exception as e:
+                    # 失敗的版本不重試，直到目錄內容再次改變
+                    logger.error(f"❌ adapter {name} 自動熱更新失敗: {e}")
+                    self._failed[name] = fingerprint
@@ -0,0 +1,202 @@
+"""
+單次前向傳播的標籤評分
+6 種分類標籤事先已知，不需要生成 256 個 token 再從自由文本猜測標籤：
+提示詞前向一次後，沿著候選標籤的 token 前綴樹計算每個標籤完整續寫的對數似然，
+共享前綴（「漏洞類型：」）只計算一次，再經溫度與偏置校準後以 softmax 得到機率分布
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+logger = logging.getLogger(__name__)
+
+# 標籤的文字表述，與訓練數據集 output 欄位的寫法一致
+LABEL_VERBALIZATIONS = {
+    "capability_leak": "漏洞類型：Capability Leak",
+    "arithmetic_overflow": "漏洞類型：Arithmetic Overflow",
+    "cross_module_pollution": "漏洞類型：Cross-Module Pollution",
+    "unchecked_return": "漏洞類型：Unchecked Return",
+    "resource_leak": "漏洞類型：Resource Leak",
+    "safe": "未發現明顯漏洞"
+}
+
+# 續寫緊接在提示詞的這段結尾之後，用來取得與實際拼接一致的分詞結果
+PROMPT_ANCHOR = "分析結果："
+
+
+def load_calibration(path: Optional[str], default_temperature: float = 1.0) -> Dict:
+    """讀取標籤機率校準參數 {temperature, bias}，檔案不存在時使用預設溫度、不加偏置"""
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            calibration = json.load(f)
+        logger.info(f"✅ 已載入標籤機率校準: {path} (T={calibration.get('temperature', 1.0):.3f})")
+        return {
+            "temperature": float(calibration.get("temperature", default_temperature)),
+            "bias": {label: float(value) for label, value in calibration.get("bias", {}).items()}
+        }
+    return {"temperature": default_temperature, "bias": {}}
+
+
+class _TrieNode:
+    __slots__ = ("children", "label")
+
+    def __init__(self):
+        self.children: Dict[int, "_TrieNode"] = {}
+        self.label: Optional[str] = None
+
+
+def continuation_ids(tokenizer, text: str, anchor: str = PROMPT_ANCHOR) -> List[int]:
+    """取得 text 接在 anchor 之後時的 token ids（避免 sentencepiece 對開頭空白的處理差異）"""
+    anchor_ids = tokenizer(anchor, add_special_tokens=False)["input_ids"]
+    full_ids = tokenizer(anchor + text, add_special_tokens=False)["input_ids"]
+    if full_ids[:len(anchor_ids)] == anchor_ids and len(full_ids) > len(anchor_ids):
+        return full_ids[len(anchor_ids):]
+    return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+
+def left_pad(batch_input_ids: List[List[int]], pad_id: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """左側 padding，返回 input_ids 與 attention_mask"""
+    max_len = max(len(ids) for ids in batch_input_ids)
+    input_ids = torch.full((len(batch_input_ids), max_len), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch_input_ids), max_len), dtype=torch.long)
+    for row, ids in enumerate(batch_input_ids):
+        input_ids[row, max_len - len(ids):] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, max_len - len(ids):] = 1
+    return input_ids, attention_mask
+
+
+class LabelScorer:
+    """候選標籤評分器
+
+    Args:
+        tokenizer: 模型的 tokenizer
+        verbalizations: 標籤 -> 續寫文字
+    """
+
+    def __init__(self, tokenizer, verbalizations: Optional[Dict[str, str]] = None):
+        self.verbalizations = dict(verbalizations or LABEL_VERBALIZATIONS)
+        self.labels = list(self.verbalizations)
+        self.label_ids = {label: continuation_ids(tokenizer, text) for label, text in self.verbalizations.items()}
+
+        self._root = _TrieNode()
+        for label, ids in self.label_ids.items():
+            node = self._root
+            for token in ids:
+                node = node.children.setdefault(token, _TrieNode())
+            if node.label is not None:
+                raise ValueError(f"標籤 {label} 與 {node.label} 的分詞結果相同")
+            node.label = label
+
+        logger.info(f"✅ 標籤評分器就緒: {len(self.labels)} 個標籤，"
+                    f"前綴樹 {self._count_nodes(self._root)} 個節點")
+
+    def _count_nodes(self, node: _TrieNode) -> int:
+        return 1 + sum(self._count_nodes(child) for child in node.children.values())
+
+    @torch.no_grad()
+    def score(self, model, batch_input_ids: List[List[int]], pad_id: int, device, prefix_cache=None,
+              timings: Optional[Dict[str, float]] = None) -> torch.Tensor:
+        """計算每個提示詞下每個標籤續寫的對數似然
+
+        Args:
+            prefix_cache: 共享指令前綴的 PrefixCache，提供時只對前綴之後的部分做前向傳播
+            timings: 提供時寫入 prefill_s（提示詞的前向傳播）與 decode_s（走訪標籤前綴樹）
+
+        Returns:
+            [batch, num_labels] 的 float32 張量，順序與 self.labels 一致
+        """
+        if prefix_cache is not None:
+            input_ids, attention_mask, cache = prefix_cache.prepare(batch_input_ids, pad_id)
+        else:
+            input_ids, attention_mask = left_pad(batch_input_ids, pad_id)
+            input_ids = input_ids.to(device)
+            attention_mask = attention_mask.to(device)
+            cache = DynamicCache()
+        # 只送入 cache 之後的 token，位置編碼由完整的 attention_mask 推得
+        input_ids = input_ids[:, cache.get_seq_length():]
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -input_ids.shape[1]:]
+
+        started = time.time()
+        outputs = model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True,
+            logits_to_keep=1
+        )
+        prefilled = time.time()
+        prompt_lengths = attention_mask.sum(-1, keepdim=True)
+        scores = torch.full((len(batch_input_ids), len(self.labels)), float("-inf"))
+        self._walk(model, self._root, outputs.logits[:, -1], outputs.past_key_values,
+                   attention_mask, prompt_lengths, 0, torch.zeros(len(batch_input_ids)), scores)
+        if timings is not None:
+            timings["prefill_s"] = prefilled - started
+            timings["decode_s"] = time.time() - prefilled
+        return scores
+
+    def _walk(self, model, node: _TrieNode, logits: torch.Tensor, cache, prompt_mask: torch.Tensor,
+              prompt_lengths: torch.Tensor, depth: int, base: torch.Tensor, scores: torch.Tensor):
+        """深度優先走訪前綴樹；單一子節點的鏈一次餵入，走訪完子樹後裁剪 KV cache"""
+        log_probs = torch.log_softmax(logits.float(), dim=-1).cpu()
+        cache_length = prompt_mask.shape[1] + depth
+
+        for token, child in node.children.items():
+            path = [token]
+            end = child
+            while end.label is None and len(end.children) == 1:
+                next_token, end = next(iter(end.children.items()))
+                path.append(next_token)
+
+            total = base + log_probs[:, token]
+            # 鏈末端有子節點時需要它之後的 logits，否則最後一個 token 不必餵入
+            feed = path if end.children else path[:-1]
+            if feed:
+                feed_ids = torch.tensor([feed] * prompt_mask.shape[0], device=prompt_mask.device)
+                attention_mask = torch.cat([
+                    prompt_mask,
+                    torch.ones((prompt_mask.shape[0], depth + len(feed)), dtype=prompt_mask.dtype,
+                               device=prompt_mask.device)
+                ], dim=-1)
+                position_ids = prompt_lengths + depth + torch.arange(len(feed), device=prompt_mask.device)
+                outputs = model(
+                    input_ids=feed_ids,
+                    attention_mask=attention_mask,
+                    position_ids=position_ids,
+                    past_key_values=cache,
+                    use_cache=True
+                )
+                chain_log_probs = torch.log_softmax(outputs.logits.float(), dim=-1).cpu()
+                for offset, next_token in enumerate(path[1:]):
+                    total = total + chain_log_probs[:, offset, next_token]
+
+            if end.label is not None:
+                scores[:, self.labels.index(end.label)] = total
+            if end.children:
+                self._walk(model, end, outputs.logits[:, -1], cache, prompt_mask, prompt_lengths,
+                           depth + len(path), total, scores)
+            if feed:
+                cache.crop(cache_length)
+
+    def calibrated_logits(self, scores: torch.Tensor, temperature: float = 1.0,
+                          bias: Optional[Dict[str, float]] = None) -> torch.Tensor:
+        """溫度縮放並加上各標籤的偏置（修正標籤長度不同造成的似然偏差）"""
+        logits = scores / max(temperature, 1e-6)
+        if bias:
+            logits = logits + torch.tensor([bias.get(label, 0.0) for label in self.labels])
+        return logits
+
+    def probabilities(self, scores: torch.Tensor, temperature: float = 1.0,
+                      bias: Optional[Dict[str, float]] = None) -> List[Dict[str, float]]:
+        """校準後 softmax，返回每個提示詞的標籤機率"""
+        probs = torch.softmax(self.calibrated_logits(scores, temperature, bias), dim=-1)
+        return [
+            {label: float(p) for label, p in zip(self.labels, row)}
+            for row in probs
+        ]
@@ -0,0 +1,205 @@
+"""
+模型生命週期管理
+狀態：unloaded -> loading -> ready -> unloading -> unloaded；載入失敗為 failed（下一個請求重新嘗試）
+- 啟動時可在背景預先載入，載入完成前 /ready 返回 503（/health 只表示進程存活）
+- 載入期間到達的請求等待同一個載入工作（排隊），而不是失敗
+- 閒置超過設定時間且沒有進行中的請求時卸載模型釋放記憶體，下一個請求再重新載入
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MODEL_STATES = ("unloaded", "loading", "ready", "unloading", "failed")
+
+
+class ModelLifecycle:
+    """模型載入、卸載與閒置回收
+
+    Args:
+        load: 載入模型的協程函數（在推論執行緒上執行實際載入）
+        unload: 卸載模型的協程函數
+        idle_unload_seconds: 閒置多久後卸載（0 表示不卸載）
+        history_size: 保留的狀態轉換紀錄筆數
+    """
+
+    def __init__(self, load: Callable[[], Awaitable[None]], unload: Callable[[], Awaitable[None]],
+                 idle_unload_seconds: float = 0, history_size: int = 50):
+        self._load_fn = load
+        self._unload_fn = unload
+        self.idle_unload_seconds = idle_unload_seconds
+
+        self._state = "unloaded"
+        self._state_since = time.time()
+        self._task: Optional[asyncio.Task] = None  # 進行中的載入或卸載工作
+        self._watcher: Optional[asyncio.Task] = None
+        self._active = 0  # 正在使用模型的請求（含等待載入）
+        self._waiting = 0  # 等待載入或卸載完成的請求
+        self._last_used = time.time()
+        self._last_load_s: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._counts = {"loads": 0, "load_failures": 0, "unloads": 0, "idle_unloads": 0}
+        self._transitions = deque(maxlen=history_size)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @property
+    def has_loaded(self) -> bool:
+        """模型曾經成功載入（之後的閒置卸載可隨時重新載入）"""
+        return self._counts["loads"] > 0
+
+    def _transition(self, state: str, reason: str):
+        now = time.time()
+        self._transitions.append({
+            "from": self._state,
+            "to": state,
+            "reason": reason,
+            "at": datetime.fromtimestamp(now).isoformat() + "Z",
+            "after_s": round(now - self._state_since, 2)
+        })
+        logger.info(f"🔁 模型狀態: {self._state} -> {state} ({reason})")
+        self._state = state
+        self._state_since = now
+
+    def mark_unloaded(self, reason: str = "manual"):
+        """模型在生命週期管理之外被卸載（例如評估工具切換設定檔）"""
+        if self._state == "ready":
+            self._counts["unloads"] += 1
+            self._transition("unloaded", reason)
+
+    # ------------------------------------------------------------------
+    # 載入
+    # ------------------------------------------------------------------
+
+    def _start_load(self, reason: str) -> asyncio.Task:
+        # 狀態在建立工作時同步切換，之後到達的請求都會等待這個工作
+        self._transition("loading", reason)
+        task = self._task = asyncio.get_running_loop().create_task(self._load())
+        # 沒有等待者時（背景預載入失敗）避免 "exception was never retrieved" 警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def _load(self):
+        started = time.time()
+        try:
+            await self._load_fn()
+        except Exception as e:
+            self._counts["load_failures"] += 1
+            self._last_error = str(e)
+            self._task = None
+            self._transition("failed", f"error: {e}")
+            raise
+        self._task = None
+        self._counts["loads"] += 1
+        self._last_load_s = round(time.time() - started, 2)
+        self._last_used = time.time()
+        self._last_error = None
+        self._transition("ready", f"loaded in {self._last_load_s}s")
+
+    async def ensure_ready(self, reason: str = "request"):
+        """等待模型可用：進行中的卸載先完成，沒有進行中的載入時開始載入
+
+        shield：單一等待者被取消（例如請求逾時）不會中斷載入；載入失敗時所有等待者收到同一個例外
+        """
+        while self._state != "ready":
+            task = self._task
+            if task is None or task.get_loop() is not asyncio.get_running_loop():
+                task = self._start_load(reason)
+            self._waiting += 1
+            try:
+                await asyncio.shield(task)
+            finally:
+                self._waiting -= 1
+
+    def preload(self):
+        """啟動時在背景開始載入（不等待完成）"""
+        if self._state in ("unloaded", "failed") and self._task is None:
+            self._start_load("preload")
+
+    @asynccontextmanager
+    async def use(self) -> AsyncIterator[None]:
+        """請求使用模型期間不會被閒置卸載"""
+        self._active += 1
+        try:
+            await self.ensure_ready()
+            yield
+        finally:
+            self._active -= 1
+            self._last_used = time.time()
+
+    # ------------------------------------------------------------------
+    # 卸載
+    # ------------------------------------------------------------------
+
+    async def unload(self, reason: str = "manual") -> bool:
+        """沒有進行中的請求時卸載模型，返回是否已卸載"""
+        if self._state != "ready" or self._active > 0:
+            return False
+        self._transition("unloading", reason)
+        task = self._task = asyncio.get_running_loop().create_task(self._unload(reason))
+        await asyncio.shield(task)
+        return True
+
+    async def _unload(self, reason: str):
+        try:
+            await self._unload_fn()
+        except Exception as e:
+            self._task = None
+            self._last_error = str(e)
+            self._transition("failed", f"unload error: {e}")
+            raise
+        self._task = None
+        self._counts["unloads"] += 1
+        self._transition("unloaded", reason)
+
+    async def _watch_idle(self):
+        interval = min(60.0, max(1.0, self.idle_unload_seconds / 4))
+        while True:
+            await asyncio.sleep(interval)
+            if self._state == "ready" and self._active == 0 and self.idle_seconds >= self.idle_unload_seconds:
+                try:
+                    if await self.unload(f"idle for {self.idle_seconds:.0f}s"):
+                        self._counts["idle_unloads"] += 1
+                except Exception as e:
+                    logger.warning(f"⚠️ 閒置卸載失敗: {e}")
+
+    @property
+    def idle_seconds(self) -> float:
+        return time.time() - self._last_used
+
+    # ------------------------------------------------------------------
+    # 服務啟動與關閉
+    # ------------------------------------------------------------------
+
+    def start(self, preload: bool = False):
+        if preload:
+            self.preload()
+        if self.idle_unload_seconds > 0 and self._watcher is None:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch_idle())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    def get_stats(self) -> Dict:
+        return {
+            "state": self._state,
+            "state_for_s": round(time.time() - self._state_since, 1),
+            "active_requests": self._active,
+            "waiting_requests": self._waiting,
+            "idle_s": round(self.idle_seconds, 1) if self._state == "ready" else None,
+            "idle_unload_s": self.idle_unload_seconds or None,
+            "last_load_s": self._last_load_s,
+            "last_error": self._last_error,
+            **self._counts,
+            "transitions": list(self._transitions)
+        }
@@ -0,0 +1,138 @@
+"""
+預先合併 LoRA 的模型檢查點
+ml/export_merged_model.py 將 LoRA 合併進基礎權重（可選 4-bit 預量化）後寫成分片 safetensors，
+服務啟動時以記憶體映射直接讀取分片：不需要重新載入基礎模型、包裝 PeftModel 再合併，
+權重頁面按需載入且可在同一主機的多個副本間共享
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from accelerate import init_empty_weights
+from transformers import AutoConfig, AutoModelForCausalLM
+
+from .quantization import quantize_int4_layers
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "merged_manifest.json"
+INDEX_NAME = "model.safetensors.index.json"
+SINGLE_SHARD_NAME = "model.safetensors"
+
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool
+}
+
+EXPORT_DTYPES = {
+    "fp32": torch.float32,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16
+}
+
+
+def read_manifest(path: str) -> Optional[Dict]:
+    """讀取合併檢查點的說明檔，不存在時返回 None"""
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def adapter_fingerprint(lora_path: str) -> str:
+    """adapter 權重與設定的 SHA-256，用於確認匯出的檢查點對應哪一版 LoRA"""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(lora_path)):
+        if name.startswith("adapter_") and os.path.isfile(os.path.join(lora_path, name)):
+            with open(os.path.join(lora_path, name), "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def shard_files(path: str) -> List[str]:
+    """檢查點目錄下的所有 safetensors 分片"""
+    index_path = os.path.join(path, INDEX_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            weight_map = json.load(f)["weight_map"]
+        return [os.path.join(path, name) for name in sorted(set(weight_map.values()))]
+    single = os.path.join(path, SINGLE_SHARD_NAME)
+    if os.path.exists(single):
+        return [single]
+    raise FileNotFoundError(f"找不到 safetensors 分片: {path}")
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """以記憶體映射讀取 safetensors 檔案，張量直接指向映射的頁面（不複製）
+
+    使用 copy-on-write 映射：未修改的頁面與頁面快取共享，多個進程載入同一分片只佔一份記憶體
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        if end == begin:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(mapped, dtype=dtype, count=(end - begin) // dtype.itemsize,
+                                  offset=data_start + begin)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors
+
+
+def load_merged_model(path: str, device: str = "cpu") -> Tuple[torch.nn.Module, Dict]:
+    """從合併檢查點建立模型
+
+    先以空權重（meta device）建立模型結構，4-bit 預量化的檢查點再替換為量化線性層，
+    最後將映射的張量直接指定給參數（assign=True），不做額外的初始化與複製
+    """
+    manifest = read_manifest(path) or {}
+    dtype = EXPORT_DTYPES.get(manifest.get("dtype", "fp32"), torch.float32)
+    config = AutoConfig.from_pretrained(path)
+
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+    if manifest.get("quantization") == "int4":
+        quantize_int4_layers(model.get_decoder(), manifest.get("int4_group_size", 128))
+
+    state_dict = {}
+    for shard in shard_files(path):
+        state_dict.update(mmap_safetensors(shard))
+
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    missing += [name for name, buffer in model.named_buffers() if buffer.is_meta]
+    if missing:
+        raise ValueError(f"合併檢查點缺少權重: {missing[:5]}{'...' if len(missing) > 5 else ''}")
+    if result.unexpected_keys:
+        logger.warning(f"⚠️ 合併檢查點含有未使用的權重: {result.unexpected_keys[:5]}")
+
+    if device != "cpu":
+        model = model.to(device)
+    model.eval()
+    return model, manifest
@@ -0,0 +1,259 @@
+"""
+推論的記憶體與計算量測
+- 批次層級：在執行推論的進程（主進程或 worker）量測 prefill / decode 時間、輸入與生成的 token 數、
+  批次期間的記憶體峰值（CPU 為進程 RSS 峰值，GPU 為已分配記憶體峰值），結果隨批次返回主進程彙總
+- 請求層級：請求帶 profile 旗標時以 ContextVar 收集各階段耗時（包含 asyncio.gather 出的窗口子工作）
+- Prometheus 文字格式輸出（不依賴 prometheus_client）
+"""
+
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import psutil
+import torch
+from transformers import StoppingCriteria
+
+from .batching import percentile
+
+_CLEAR_REFS = "/proc/self/clear_refs"
+# 請求 profile 中列出的批次資訊
+_PROFILE_BATCH_FIELDS = ("kind", "adapter", "size", "tokens_in", "tokens_out", "pid")
+
+
+def reset_peak_memory(device: str):
+    """重設記憶體峰值（Linux 上寫入 /proc/self/clear_refs 重設 VmHWM）
+
+    VmHWM 屬於整個進程：重設後，外部監控從 /proc/<pid>/status 讀到的進程峰值也會被清除（ru_maxrss 不受影響）。
+    需要保留進程峰值時以 ML_BATCH_PEAK_RSS=false 關閉 CPU 上的批次記憶體峰值量測
+    """
+    if device == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+        return
+    try:
+        with open(_CLEAR_REFS, "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_memory_bytes(device: str) -> Optional[int]:
+    """上次重設之後的記憶體峰值（無法取得時返回 None）"""
+    if device == "cuda":
+        return torch.cuda.max_memory_allocated()
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class StepTimer(StoppingCriteria):
+    """記錄第一個解碼步驟的時間：generate 在 prefill 的前向傳播之後才第一次呼叫停止條件"""
+
+    def __init__(self):
+        self.first_step: Optional[float] = None
+
+    def __call__(self, input_ids: torch.Tensor, scores: torch.Tensor, **kwargs) -> torch.Tensor:
+        if self.first_step is None:
+            self.first_step = time.time()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
+# ----------------------------------------------------------------------
+# 請求層級的階段耗時
+# ----------------------------------------------------------------------
+
+class RequestProfile:
+    """單一請求的階段耗時（同名階段累加，例如多個窗口）與批次資訊"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages: Dict[str, float] = defaultdict(float)
+        self.batches: List[Dict] = []
+        self.notes: Dict = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.time() - started
+
+    def add_batch(self, batch: Dict, waited_s: float):
+        """批次推論：等待時間扣除批次執行時間即為排隊（含 worker 間傳輸）"""
+        self.stages["queue"] += max(0.0, waited_s - batch["wall_s"])
+        self.stages["prefill"] += batch.get("prefill_s", 0.0)
+        self.stages["decode"] += batch.get("decode_s", 0.0)
+        self.batches.append(batch)
+
+    def summary(self) -> Dict:
+        total = time.time() - self.started
+        stages = {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+        peaks = [batch["peak_memory_bytes"] for batch in self.batches if batch.get("peak_memory_bytes")]
+        return {
+            "total_ms": round(total * 1000, 2),
+            "stages_ms": stages,
+            # 窗口並行時各階段累加可能超過總耗時
+            "other_ms": round(max(0.0, total * 1000 - sum(stages.values())), 2),
+            "batches": [
+                {key: batch[key] for key in _PROFILE_BATCH_FIELDS if key in batch} for batch in self.batches
+            ],
+            "tokens_in": sum(batch.get("request_tokens_in", 0) for batch in self.batches),
+            "tokens_out": sum(batch.get("request_tokens_out", 0) for batch in self.batches),
+            "peak_memory_mb": round(max(peaks) / 1024**2, 1) if peaks else None,
+            **self.notes
+        }
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("ml_request_profile", default=None)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current_profile.get()
+
+
+@contextmanager
+def profiling(enabled: bool) -> Iterator[Optional[RequestProfile]]:
+    """在此區塊（及其中建立的 asyncio 工作）內收集階段耗時"""
+    if not enabled:
+        yield None
+        return
+    profile = RequestProfile()
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+@contextmanager
+def profile_stage(name: str) -> Iterator[None]:
+    """目前請求有啟用 profile 時記錄階段耗時，否則不做任何事"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.stage(name):
+        yield
+
+
+# ----------------------------------------------------------------------
+# 服務層級的彙總
+# ----------------------------------------------------------------------
+
+class InferenceMetrics:
+    """各批次類型的 token 數、prefill / decode 時間與記憶體峰值"""
+
+    def __init__(self, window: int = 1000):
+        self._totals = defaultdict(lambda: {"batches": 0, "requests": 0, "tokens_in": 0, "tokens_out": 0,
+                                            "prefill_s": 0.0, "decode_s": 0.0, "wall_s": 0.0})
+        self._peaks = deque(maxlen=window)
+        self.max_peak_bytes = 0
+
+    def record_batch(self, batch: Dict):
+        totals = self._totals[batch["kind"]]
+        totals["batches"] += 1
+        totals["requests"] += batch["size"]
+        for key in ("tokens_in", "tokens_out", "prefill_s", "decode_s", "wall_s"):
+            totals[key] += batch.get(key, 0)
+        if batch.get("peak_memory_bytes"):
+            self._peaks.append(batch["peak_memory_bytes"])
+            self.max_peak_bytes = max(self.max_peak_bytes, batch["peak_memory_bytes"])
+
+    @property
+    def totals(self) -> Dict[str, Dict]:
+        return dict(self._totals)
+
+    def get_stats(self) -> Dict:
+        kinds = {}
+        for kind, totals in self._totals.items():
+            kinds[kind] = {
+                **{key: round(value, 3) if isinstance(value, float) else value for key, value in totals.items()},
+                "prefill_tokens_per_s": round(totals["tokens_in"] / totals["prefill_s"], 1)
+                if totals["prefill_s"] else 0.0,
+                "decode_tokens_per_s": round(totals["tokens_out"] / totals["decode_s"], 1)
+                if totals["decode_s"] else 0.0
+            }
+        peaks = list(self._peaks)
+        return {
+            "by_kind": kinds,
+            "batch_peak_memory_mb": {
+                "p50": round(percentile(peaks, 0.5) / 1024**2, 1),
+                "p95": round(percentile(peaks, 0.95) / 1024**2, 1),
+                "max": round(self.max_peak_bytes / 1024**2, 1)
+            }
+        }
+
+    def peak_quantiles(self) -> List[Tuple[float, float]]:
+        peaks = list(self._peaks)
+        return [(q, float(percentile(peaks, q))) for q in (0.5, 0.95, 0.99)]
+
+
+def process_rss_bytes(pid: Optional[int] = None) -> int:
+    return psutil.Process(pid or os.getpid()).memory_info().rss
+
+
+# ----------------------------------------------------------------------
+# Prometheus 文字格式
+# ----------------------------------------------------------------------
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+class PrometheusWriter:
+    """逐一加入指標，render() 輸出 text/plain; version=0.0.4 格式"""
+
+    def __init__(self, prefix: str = "suiguard_ml_"):
+        self.prefix = prefix
+        self._lines: List[str] = []
+
+    def _header(self, name: str, kind: str, help_text: str) -> str:
+        name = self.prefix + name
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} {kind}")
+        return name
+
+    def add(self, name: str, kind: str, help_text: str, samples: Iterable[Tuple[Dict[str, str], float]]):
+        name = self._header(name, kind, help_text)
+        for labels, value in samples:
+            self._lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def gauge(self, name: str, help_text: str, value: float, **labels: str):
+        self.add(name, "gauge", help_text, [(labels, value)])
+
+    def histogram(self, name: str, help_text: str, series: Iterable[Tuple[Dict[str, str], Dict[int, int]]],
+                  buckets: Iterable[float]):
+        """每個序列以 {值: 次數} 的分布輸出累積 bucket、_sum 與 _count"""
+        name = self._header(name, "histogram", help_text)
+        bounds = list(buckets) + [float("inf")]
+        for labels, counts in series:
+            for bound in bounds:
+                cumulative = sum(count for value, count in counts.items() if value <= bound)
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                self._lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+            total = sum(value * count for value, count in counts.items())
+            self._lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            self._lines.append(f"{name}_count{_format_labels(labels)} {sum(counts.values())}")
+
+    def render(self) -> str:
+        return "\n".join(self._lines) + "\n"
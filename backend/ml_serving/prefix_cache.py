@@ -0,0 +1,94 @@
+"""
+指令前綴的 KV cache 重用
+每個提示詞都以相同的指令與 ```move 開頭，模型載入時只對這段前綴做一次前向傳播並保存 past_key_values，
+之後每個請求（單一或批次）都從這份 cache 開始，只處理合約相關的後綴。
+
+批次中的每一列排成 [前綴 | padding | 後綴]：前綴在所有列的位置相同，可以共享同一份 cache；
+padding 放在前綴與後綴之間並由 attention_mask 遮蔽，位置編碼由 attention_mask 累加得出，
+因此每一列看到的位置與注意力範圍都和未使用 cache 的左側 padding 完全一致
+"""
+
+import logging
+from typing import List, Tuple
+
+import torch
+from transformers import DynamicCache
+
+logger = logging.getLogger(__name__)
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class PrefixCache:
+    """共享前綴的 KV cache
+
+    Args:
+        model: 已載入的模型（評估模式）
+        prefix_ids: 前綴的 token ids（與完整提示詞分詞結果的開頭一致）
+        device: 計算設備
+    """
+
+    def __init__(self, model, prefix_ids: List[int], device):
+        self.prefix_ids = list(prefix_ids)
+        self.device = device
+        self._stats = {"hits": 0, "partial_hits": 0, "misses": 0, "tokens_reused": 0}
+
+        with torch.no_grad():
+            input_ids = torch.tensor([self.prefix_ids], device=device)
+            outputs = model(input_ids=input_ids, past_key_values=DynamicCache(), use_cache=True, logits_to_keep=1)
+        # [(key, value)]，每層形狀 [1, heads, prefix_len, head_dim]
+        self._layers = outputs.past_key_values.to_legacy_cache()
+        logger.info(f"✅ 指令前綴 KV cache 就緒: {len(self.prefix_ids)} 個 token，{len(self._layers)} 層")
+
+    def __len__(self) -> int:
+        return len(self.prefix_ids)
+
+    def reusable_length(self, batch_input_ids: List[List[int]]) -> int:
+        """批次中所有請求共同的可重用前綴長度（至少保留一個後綴 token 以取得下一步的 logits）"""
+        length = len(self.prefix_ids)
+        for ids in batch_input_ids:
+            length = min(length, common_prefix_length(ids, self.prefix_ids), len(ids) - 1)
+        return max(length, 0)
+
+    def prepare(self, batch_input_ids: List[List[int]], pad_id: int) -> Tuple[torch.Tensor, torch.Tensor, DynamicCache]:
+        """排列批次輸入並建立該批次的 cache
+
+        Returns:
+            (input_ids, attention_mask, cache)：input_ids 為 [前綴 | padding | 後綴] 的完整序列，
+            cache 已包含前 reused 個 token，呼叫端只需把其後的部分送入模型
+        """
+        reused = self.reusable_length(batch_input_ids)
+        if reused == len(self.prefix_ids):
+            self._stats["hits"] += len(batch_input_ids)
+        elif reused > 0:
+            self._stats["partial_hits"] += len(batch_input_ids)
+        else:
+            self._stats["misses"] += len(batch_input_ids)
+        self._stats["tokens_reused"] += reused * len(batch_input_ids)
+
+        suffixes = [ids[reused:] for ids in batch_input_ids]
+        max_suffix = max(len(ids) for ids in suffixes)
+        input_ids = torch.full((len(batch_input_ids), reused + max_suffix), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+        input_ids[:, :reused] = torch.tensor(self.prefix_ids[:reused], dtype=torch.long)
+        attention_mask[:, :reused] = 1
+        for row, suffix in enumerate(suffixes):
+            input_ids[row, input_ids.shape[1] - len(suffix):] = torch.tensor(suffix, dtype=torch.long)
+            attention_mask[row, input_ids.shape[1] - len(suffix):] = 1
+
+        batch_size = len(batch_input_ids)
+        cache = DynamicCache.from_legacy_cache(tuple(
+            (key[:, :, :reused].expand(batch_size, -1, -1, -1), value[:, :, :reused].expand(batch_size, -1, -1, -1))
+            for key, value in self._layers
+        )) if reused else DynamicCache()
+        return input_ids.to(self.device), attention_mask.to(self.device), cache
+
+    def get_stats(self) -> dict:
+        return {"prefix_tokens": len(self.prefix_ids), **self._stats}
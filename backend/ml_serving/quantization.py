@@ -0,0 +1,142 @@
+"""
+推論精度設定檔
+CPU 節點上以 float32 載入 7B 模型約需 28 GB，無法在同一台主機放置多個副本。
+提供以下設定檔（ML_INFERENCE_PROFILE）：
+  fp32 - 原始精度（GPU 上為 float16）
+  bf16 - bfloat16 權重與計算
+  int8 - 合併 LoRA 後，對解碼器的線性層做動態 int8 量化（權重 int8，激活值於執行期量化）
+  int4 - 合併 LoRA 後，解碼器線性層的權重以 4-bit 分組量化儲存，前向時反量化計算
+lm_head 與嵌入層保持原精度，避免標籤似然的偏差
+"""
+
+import logging
+import warnings
+from typing import Dict
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_PROFILES = ("fp32", "bf16", "int8", "int4")
+
+
+def load_dtype(profile: str, device: str) -> torch.dtype:
+    """設定檔載入權重時使用的 dtype"""
+    if profile == "bf16":
+        return torch.bfloat16
+    if device == "cuda" and profile == "fp32":
+        return torch.float16
+    return torch.float32
+
+
+def requires_merge(profile: str) -> bool:
+    """量化設定檔需要先將 LoRA 合併進基礎權重（量化後的線性層無法再掛載 adapter）"""
+    return profile in ("int8", "int4")
+
+
+class Int4WeightOnlyLinear(nn.Module):
+    """4-bit 分組量化的線性層
+
+    權重按輸入維度每 group_size 個為一組做非對稱量化，兩個 4-bit 值打包為一個 uint8；
+    每組保存 scale 與 zero point，前向時反量化為 compute_dtype 再做矩陣乘法
+    """
+
+    def __init__(self, linear: nn.Linear, group_size: int = 128, compute_dtype: torch.dtype = torch.float32):
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        self.compute_dtype = compute_dtype
+
+        weight = linear.weight.detach().float()
+        if self.in_features % group_size or group_size % 2:
+            group_size = self.in_features
+        self.group_size = group_size
+
+        grouped = weight.reshape(self.out_features, -1, group_size)
+        w_min = grouped.amin(dim=-1, keepdim=True)
+        w_max = grouped.amax(dim=-1, keepdim=True)
+        scale = ((w_max - w_min) / 15).clamp(min=1e-8)
+        quantized = ((grouped - w_min) / scale).round().clamp(0, 15).to(torch.uint8)
+        quantized = quantized.reshape(self.out_features, self.in_features)
+
+        self.register_buffer("packed_weight", quantized[:, 0::2] | (quantized[:, 1::2] << 4))
+        self.register_buffer("scale", scale.squeeze(-1).to(torch.bfloat16))
+        self.register_buffer("offset", w_min.squeeze(-1).to(torch.bfloat16))
+        if linear.bias is not None:
+            self.register_buffer("bias", linear.bias.detach().to(compute_dtype))
+        else:
+            self.bias = None
+
+    def dequantize(self) -> torch.Tensor:
+        low = self.packed_weight & 0x0F
+        high = self.packed_weight >> 4
+        quantized = torch.stack([low, high], dim=-1).reshape(self.out_features, -1, self.group_size)
+        weight = quantized.to(self.compute_dtype) * self.scale.to(self.compute_dtype).unsqueeze(-1) \
+            + self.offset.to(self.compute_dtype).unsqueeze(-1)
+        return weight.reshape(self.out_features, self.in_features)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        output = F.linear(x.to(self.compute_dtype), self.dequantize(), self.bias)
+        return output.to(x.dtype)
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, group_size={self.group_size}"
+
+
+def quantize_int4_layers(module: nn.Module, group_size: int) -> int:
+    """將 module 內所有 nn.Linear 替換為 Int4WeightOnlyLinear，返回替換數量"""
+    replaced = 0
+    for name, child in module.named_children():
+        if isinstance(child, nn.Linear):
+            setattr(module, name, Int4WeightOnlyLinear(child, group_size))
+            replaced += 1
+        else:
+            replaced += quantize_int4_layers(child, group_size)
+    return replaced
+
+
+def apply_profile(model: nn.Module, profile: str, int4_group_size: int = 128) -> nn.Module:
+    """對已載入（且已合併 LoRA）的模型套用量化設定檔，只量化解碼器層"""
+    if not requires_merge(profile):
+        return model
+
+    decoder = model.get_decoder()
+    if profile == "int8":
+        with warnings.catch_warnings():
+            # torch.ao 的動態量化在新版 PyTorch 標記為 deprecated，但 CPU 推論仍可用
+            warnings.simplefilter("ignore")
+            torch.ao.quantization.quantize_dynamic(decoder, {nn.Linear}, dtype=torch.qint8, inplace=True)
+        logger.info("✅ 已套用 int8 動態量化（解碼器線性層）")
+    else:
+        replaced = quantize_int4_layers(decoder, int4_group_size)
+        logger.info(f"✅ 已套用 4-bit 權重量化: {replaced} 個線性層 (group_size={int4_group_size})")
+    return model
+
+
+def model_memory_bytes(model: nn.Module) -> Dict:
+    """模型權重佔用的記憶體，依 dtype 分組（含量化層打包後的權重）"""
+    by_dtype: Dict[str, int] = {}
+    seen = {}
+
+    def add(tensor: torch.Tensor):
+        if id(tensor) in seen:
+            return
+        # 保留引用，避免解包出的暫存張量被回收後 id 重複
+        seen[id(tensor)] = tensor
+        key = str(tensor.dtype).replace("torch.", "")
+        by_dtype[key] = by_dtype.get(key, 0) + tensor.numel() * tensor.element_size()
+
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        add(tensor)
+    for module in model.modules():
+        # 動態量化層的權重保存在 packed params 中，不在 parameters() 裡
+        packed = getattr(module, "_packed_params", None)
+        if packed is not None and hasattr(packed, "_weight_bias"):
+            weight, bias = packed._weight_bias()
+            add(weight)
+            if bias is not None:
+                add(bias)
+
+    return {"total": sum(by_dtype.values()), "by_dtype": by_dtype}
@@ -0,0 +1,296 @@
+"""
+推論結果快取
+相同的合約（以及只差在註解、空白、排版的副本）會被反覆分類：即時分析每次按鍵、錢包每次重新連線。
+以「正規化後的代碼 + 模型版本」的雜湊作為索引，兩層儲存：
+  記憶體 LRU -> SQLite 磁碟層（跨重啟保留，有存活時間）
+並以 single-flight 合併同時到達的相同請求，只執行一次推論
+
+推論在快取擁有的任務中執行，任一等待者取消不影響其他等待者，所有等待者都取消時才停止推論。
+SQLite 在第一次使用時才開啟，讀寫都在背景執行緒執行，不阻塞事件迴圈
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 註解、字串、識別字、數字、運算子（字串在註解之前匹配，避免字串中的 // 被當成註解）
+_MOVE_TOKEN_PATTERN = re.compile(
+    r'(?P<string>b?"(?:[^"\\]|\\.)*"|x"[0-9a-fA-F]*")'
+    r"|(?P<comment>//[^\n]*|/\*.*?\*/)"
+    r"|(?P<ident>[A-Za-z_][A-Za-z0-9_]*)"
+    r"|(?P<number>0x[0-9a-fA-F]+|\d[\d_]*(?:u8|u16|u32|u64|u128|u256)?)"
+    r"|(?P<op>::|->|=>|[-+*/%<>=!&|^]=?|&&|\|\||[{}()\[\];,.:@#'])",
+    re.DOTALL
+)
+
+# 不參與重新命名的關鍵字與內建型別
+MOVE_KEYWORDS = frozenset({
+    "abort", "acquires", "address", "as", "bool", "break", "const", "continue", "copy", "drop", "else",
+    "entry", "enum", "false", "friend", "fun", "has", "if", "key", "let", "loop", "macro", "match",
+    "module", "move", "mut", "native", "package", "phantom", "public", "return", "script", "Self",
+    "signer", "spec", "store", "struct", "true", "type", "u8", "u16", "u32", "u64", "u128", "u256",
+    "use", "vector", "while"
+})
+
+
+def canonicalize_move(code: str, rename_identifiers: bool = False) -> str:
+    """正規化 Move 代碼：移除註解、統一空白
+
+    rename_identifiers 為 True 時，另將非路徑限定的識別字依出現順序改名為 v0, v1, ...
+    （`coin::transfer` 這類跨模組引用與 use 引入的名稱保持原名）。模型會看到原始名稱，改名後語意相同但名稱不同的
+    合約將共用同一個結果，因此預設關閉
+    """
+    tokens = []
+    for match in _MOVE_TOKEN_PATTERN.finditer(code):
+        if match.lastgroup == "comment":
+            continue
+        tokens.append((match.lastgroup, match.group()))
+
+    if rename_identifiers:
+        # use 宣告引入的名稱（Coin、TxContext 等）指向外部定義，保持原名
+        imported = set()
+        in_use = False
+        for kind, text in tokens:
+            if kind == "ident" and text == "use":
+                in_use = True
+            elif text == ";":
+                in_use = False
+            elif in_use and kind == "ident":
+                imported.add(text)
+
+        names: Dict[str, str] = {}
+        for index, (kind, text) in enumerate(tokens):
+            if kind != "ident" or text in MOVE_KEYWORDS or text in imported:
+                continue
+            qualified = (index > 0 and tokens[index - 1][1] == "::") or \
+                        (index + 1 < len(tokens) and tokens[index + 1][1] == "::")
+            if qualified:
+                continue
+            tokens[index] = (kind, names.setdefault(text, f"v{len(names)}"))
+
+    return " ".join(text for _, text in tokens)
+
+
+@dataclass
+class _Flight:
+    """進行中的推論與等待者數量"""
+    task: asyncio.Task
+    waiters: int = 0
+
+
+class ResultCache:
+    """兩層推論結果快取 + single-flight
+
+    Args:
+        memory_size: 記憶體 LRU 的最大筆數
+        db_path: SQLite 檔案路徑（None 時只使用記憶體）
+        ttl_seconds: 磁碟層的存活時間
+        rename_identifiers: 正規化時是否重新命名識別字
+    """
+
+    def __init__(self, memory_size: int = 1024, db_path: Optional[str] = None,
+                 ttl_seconds: float = 7 * 24 * 3600, rename_identifiers: bool = False):
+        self.memory_size = max(1, memory_size)
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.rename_identifiers = rename_identifiers
+
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_failed = False
+        self._db_lock = threading.Lock()
+        self._disk_entries = 0
+        self._stats = {"requests": 0, "memory_hits": 0, "disk_hits": 0, "shared": 0, "misses": 0, "errors": 0}
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """第一次使用時開啟資料庫，開啟失敗後只使用記憶體層（呼叫端持有 _db_lock）"""
+        if self._db is None and self.db_path and not self._db_failed:
+            try:
+                self._open_db()
+            except (sqlite3.Error, OSError) as e:
+                logger.error(f"❌ 推論結果快取磁碟層開啟失敗，只使用記憶體層: {e}")
+                self._db = None
+                self._db_failed = True
+        return self._db
+
+    def _open_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "digest TEXT PRIMARY KEY, version TEXT NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._db.commit()
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        logger.info(f"✅ 推論結果快取磁碟層: {self.db_path} ({self._disk_entries} 筆)")
+
+    def digest(self, code: str, version: str) -> str:
+        """正規化代碼與模型版本的 SHA-256"""
+        canonical = canonicalize_move(code, self.rename_identifiers)
+        return hashlib.sha256(f"{version}\n{canonical}".encode("utf-8")).hexdigest()
+
+    # ------------------------------------------------------------------
+    # 儲存層
+    # ------------------------------------------------------------------
+
+    def _memory_get(self, digest: str) -> Optional[Dict]:
+        result = self._memory.get(digest)
+        if result is not None:
+            self._memory.move_to_end(digest)
+        return result
+
+    def _memory_put(self, digest: str, result: Dict):
+        self._memory[digest] = result
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, digest: str) -> Optional[Dict]:
+        """在背景執行緒執行"""
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is None:
+                    return None
+                row = db.execute(
+                    "SELECT result, created_at FROM results WHERE digest = ?", (digest,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ 讀取磁碟快取失敗: {e}")
+            return None
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        return json.loads(row[0])
+
+    def _disk_put(self, digest: str, version: str, result: Dict):
+        """在背景執行緒執行"""
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is None:
+                    return
+                values = (version, json.dumps(result, ensure_ascii=False), time.time(), digest)
+                updated = db.execute(
+                    "UPDATE results SET version = ?, result = ?, created_at = ? WHERE digest = ?", values).rowcount
+                if not updated:
+                    db.execute("INSERT INTO results (version, result, created_at, digest) VALUES (?, ?, ?, ?)", values)
+                    self._disk_entries += 1
+                db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ 推論結果寫入磁碟快取失敗: {e}")
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+
+    async def lookup(self, digest: str, count_miss: bool = False) -> Optional[Dict]:
+        """只查詢記憶體與磁碟層，未命中返回 None（不等待進行中的相同請求）"""
+        self._stats["requests"] += 1
+
+        result = self._memory_get(digest)
+        if result is not None:
+            self._stats["memory_hits"] += 1
+            return self._tagged(result, "memory", digest)
+
+        result = await asyncio.to_thread(self._disk_get, digest) if self.db_path else None
+        if result is not None:
+            self._stats["disk_hits"] += 1
+            self._memory_put(digest, result)
+            return self._tagged(result, "disk", digest)
+
+        if count_miss:
+            self._stats["misses"] += 1
+        return None
+
+    def store(self, digest: str, version: str, result: Dict):
+        """寫入記憶體層，磁碟層在背景執行緒寫入（須在事件迴圈上呼叫）"""
+        self._memory_put(digest, result)
+        if self.db_path:
+            asyncio.get_running_loop().run_in_executor(None, self._disk_put, digest, version, result)
+
+    async def get_or_compute(self, digest: str, version: str,
+                             compute: Callable[[], Awaitable[Dict]]) -> Dict:
+        """依序查詢記憶體、磁碟、進行中的相同請求，都沒有時才執行 compute
+
+        返回結果的副本，並在 "cache" 欄位標示命中的層級（memory / disk / shared / miss）
+        """
+        cached = await self.lookup(digest)
+        if cached is not None:
+            return cached
+
+        flight = self._inflight.get(digest)
+        if flight is not None:
+            self._stats["shared"] += 1
+            tier = "shared"
+        else:
+            self._stats["misses"] += 1
+            tier = "miss"
+            flight = _Flight(asyncio.get_running_loop().create_task(self._compute(digest, version, compute)))
+            self._inflight[digest] = flight
+
+        flight.waiters += 1
+        try:
+            # shield：單一等待者取消不影響共用的推論
+            result = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # 所有等待者都已取消（例如客戶端斷線），停止推論；立即移出 _inflight，
+                # 否則任務結束前到達的相同請求會加入這個正在取消的推論而收到 CancelledError
+                if self._inflight.get(digest) is flight:
+                    del self._inflight[digest]
+                flight.task.cancel()
+        return self._tagged(result, tier, digest)
+
+    async def _compute(self, digest: str, version: str, compute: Callable[[], Awaitable[Dict]]) -> Dict:
+        try:
+            result = await compute()
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        else:
+            self.store(digest, version, result)
+            return result
+        finally:
+            # 取消時可能已被移出，且同一 digest 已有新的推論，只移除自己
+            flight = self._inflight.get(digest)
+            if flight is not None and flight.task is asyncio.current_task():
+                del self._inflight[digest]
+
+    @staticmethod
+    def _tagged(result: Dict, tier: str, digest: str) -> Dict:
+        tagged = dict(result)
+        tagged["cache"] = {"hit": tier != "miss", "tier": tier, "digest": digest[:16]}
+        return tagged
+
+    def clear_memory(self):
+        self._memory.clear()
+
+    def get_stats(self) -> Dict:
+        requests = self._stats["requests"]
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["shared"]
+        return {
+            **self._stats,
+            "hit_rate": round(hits / requests, 4) if requests else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_size": self.memory_size,
+            "disk_entries": self._disk_entries,
+            "disk_path": self.db_path,
+            "ttl_hours": round(self.ttl_seconds / 3600, 1),
+            "rename_identifiers": self.rename_identifiers
+        }
@@ -0,0 +1,135 @@
+"""
+推測解碼（assisted decoding）
+與主模型共用 tokenizer 的小型草稿模型每輪先貪婪地提出數個候選 token，主模型以一次前向傳播驗證，
+接受與主模型貪婪結果一致的最長前綴，並補上主模型自己的下一個 token。貪婪解碼下輸出與標準解碼相同，
+差別只在主模型的前向傳播次數：CPU 上每次前向傳播的成本主要是讀取權重，一次驗證多個 token
+與生成一個 token 的耗時相近，接受率越高，主模型需要的輪數越少
+"""
+
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+import torch
+from transformers import AutoModelForCausalLM
+
+logger = logging.getLogger(__name__)
+
+
+def load_draft_model(name: str, dtype: torch.dtype, device: str, main_model, num_assistant_tokens: int,
+                     confidence_threshold: float = 0.4):
+    """載入草稿模型並檢查詞彙表與主模型一致（不同 tokenizer 的模型無法直接比對候選 token）"""
+    draft = AutoModelForCausalLM.from_pretrained(name, torch_dtype=dtype, low_cpu_mem_usage=True).to(device)
+    draft.eval()
+
+    main_vocab = main_model.config.get_text_config().vocab_size
+    draft_vocab = draft.config.get_text_config().vocab_size
+    if main_vocab != draft_vocab:
+        raise ValueError(f"草稿模型詞彙表大小 {draft_vocab} 與主模型 {main_vocab} 不一致")
+
+    # 每輪固定提出 num_assistant_tokens 個候選（不使用 transformers 的動態調整，統計才可比較）
+    draft.generation_config.num_assistant_tokens = num_assistant_tokens
+    draft.generation_config.num_assistant_tokens_schedule = "constant"
+    # 草稿模型對下一個 token 的機率低於門檻時提前結束本輪（0 表示每輪都提出完整的候選數）
+    draft.generation_config.assistant_confidence_threshold = confidence_threshold
+    return draft
+
+
+class ForwardCounter:
+    """在 with 區塊內計算模型的前向傳播次數（forward hook）"""
+
+    def __init__(self, model):
+        self.model = model
+        self.count = 0
+        self._handle = None
+
+    def _hook(self, module, inputs, output):
+        self.count += 1
+
+    def __enter__(self) -> "ForwardCounter":
+        self._handle = self.model.register_forward_hook(self._hook)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._handle.remove()
+
+
+def count_generated(sequences: torch.Tensor, prompt_length: int, eos_token_id: int) -> List[int]:
+    """每一列實際生成的 token 數（到第一個 EOS 為止，含 EOS）"""
+    counts = []
+    for row in sequences[:, prompt_length:].tolist():
+        counts.append(row.index(eos_token_id) + 1 if eos_token_id in row else len(row))
+    return counts
+
+
+def decoding_info(method: str, tokens: int, elapsed_s: float, main_forwards: Optional[int] = None,
+                  draft_forwards: Optional[int] = None) -> Dict:
+    """單一請求的解碼統計（附在結果中，由主進程彙總）
+
+    推測解碼時主模型每次前向傳播是一輪，每輪產生「接受的候選 + 主模型自己的 1 個 token」，
+    因此接受的候選數 = 生成 token 數 - 輪數；草稿模型每次前向傳播提出一個候選
+    """
+    info = {
+        "method": method,
+        "tokens": tokens,
+        "elapsed_ms": round(elapsed_s * 1000, 1),
+        "tokens_per_s": round(tokens / elapsed_s, 2) if elapsed_s > 0 else 0.0
+    }
+    if main_forwards is not None:
+        accepted = max(0, tokens - main_forwards)
+        info.update({
+            "rounds": main_forwards,
+            "drafted": draft_forwards,
+            "accepted": accepted,
+            "acceptance_rate": round(accepted / draft_forwards, 4) if draft_forwards else 0.0
+        })
+    return info
+
+
+class DecodingMonitor:
+    """標準解碼與推測解碼的生成速度比較，以及推測解碼的接受率"""
+
+    def __init__(self, window: int = 1000):
+        self._totals = {
+            method: {"requests": 0, "tokens": 0, "elapsed_s": 0.0} for method in ("standard", "speculative")
+        }
+        self._speculative = {"rounds": 0, "drafted": 0, "accepted": 0, "fallbacks": 0}
+        self._tokens_per_s = {method: deque(maxlen=window) for method in self._totals}
+
+    def record(self, info: Dict):
+        totals = self._totals[info["method"]]
+        totals["requests"] += 1
+        totals["tokens"] += info["tokens"]
+        totals["elapsed_s"] += info["elapsed_ms"] / 1000
+        self._tokens_per_s[info["method"]].append(info["tokens_per_s"])
+        if info["method"] == "speculative":
+            for key in ("rounds", "drafted", "accepted"):
+                self._speculative[key] += info[key]
+
+    def record_fallback(self):
+        """請求要求推測解碼但沒有可用的草稿模型"""
+        self._speculative["fallbacks"] += 1
+
+    def get_stats(self) -> Dict:
+        stats = {}
+        for method, totals in self._totals.items():
+            samples = sorted(self._tokens_per_s[method])
+            stats[method] = {
+                "requests": totals["requests"],
+                "tokens": totals["tokens"],
+                "tokens_per_s": round(totals["tokens"] / totals["elapsed_s"], 2) if totals["elapsed_s"] else 0.0,
+                "tokens_per_s_p50": samples[len(samples) // 2] if samples else 0.0
+            }
+
+        speculative = self._speculative
+        stats["speculative"].update({
+            **speculative,
+            "acceptance_rate": round(speculative["accepted"] / speculative["drafted"], 4)
+            if speculative["drafted"] else 0.0,
+            "tokens_per_round": round(self._totals["speculative"]["tokens"] / speculative["rounds"], 2)
+            if speculative["rounds"] else 0.0
+        })
+        standard_rate = stats["standard"]["tokens_per_s"]
+        stats["speedup"] = round(stats["speculative"]["tokens_per_s"] / standard_rate, 2) \
+            if standard_rate and stats["speculative"]["tokens_per_s"] else None
+        return stats
@@ -0,0 +1,334 @@
+"""
+結構化約束解碼
+將生成結果限制為 {"label": ..., "severity": ..., "reason": ...} 的 JSON：
+固定的模板片段直接強制輸出，label / severity 只能從候選值中選擇，
+reason 限制長度且不得包含破壞 JSON 的字元，結構完成後立即強制輸出 EOS 結束生成。
+串流模式下標籤與危險等級一決定就回呼，reason 則逐步送出增加的文字
+"""
+
+import json
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+from .label_scoring import PROMPT_ANCHOR, continuation_ids
+
+logger = logging.getLogger(__name__)
+
+# JSON 中的標籤值（與訓練數據集的寫法一致）-> 分類標籤
+LABEL_VALUES = {
+    "Capability Leak": "capability_leak",
+    "Arithmetic Overflow": "arithmetic_overflow",
+    "Cross-Module Pollution": "cross_module_pollution",
+    "Unchecked Return": "unchecked_return",
+    "Resource Leak": "resource_leak",
+    "未發現明顯漏洞": "safe"
+}
+
+# 危險等級 -> 風險等級
+SEVERITY_VALUES = {
+    "高": "HIGH",
+    "中": "MEDIUM",
+    "低": "LOW"
+}
+
+# reason 中不允許的字元（避免破壞 JSON 結構）
+_FORBIDDEN_TEXT_CHARS = set('"\\{}\n\r\t')
+
+
+class _ChoiceNode:
+    __slots__ = ("children", "value")
+
+    def __init__(self):
+        self.children: Dict[int, "_ChoiceNode"] = {}
+        self.value: Optional[str] = None
+
+    def values(self) -> List[str]:
+        found = [self.value] if self.value is not None else []
+        for child in self.children.values():
+            found.extend(child.values())
+        return found
+
+
+def _build_choice_trie(tokenizer, values: List[str], anchor: str) -> _ChoiceNode:
+    root = _ChoiceNode()
+    for value in values:
+        node = root
+        for token in continuation_ids(tokenizer, value, anchor=anchor):
+            node = node.children.setdefault(token, _ChoiceNode())
+        node.value = value
+    return root
+
+
+class StructuredOutputProgram:
+    """JSON 輸出的解碼程式（對所有請求共用，每個請求各自維護 _DecodeState）"""
+
+    def __init__(self, tokenizer, reason_max_tokens: int = 96):
+        self.tokenizer = tokenizer
+        self.reason_max_tokens = reason_max_tokens
+        self.eos_token_id = tokenizer.eos_token_id
+
+        close_ids = continuation_ids(tokenizer, '"}', anchor="原因")
+        self.steps = [
+            ("force", continuation_ids(tokenizer, '{"label": "', anchor=PROMPT_ANCHOR)),
+            ("choice", _build_choice_trie(tokenizer, list(LABEL_VALUES), anchor='{"label": "')),
+            ("force", continuation_ids(tokenizer, '", "severity": "', anchor="Leak")),
+            ("choice", _build_choice_trie(tokenizer, list(SEVERITY_VALUES), anchor='"severity": "')),
+            ("force", continuation_ids(tokenizer, '", "reason": "', anchor="高")),
+            ("text", close_ids[0]),
+            ("force", close_ids[1:]),
+            ("eos", None),
+        ]
+        forced = sum(len(arg) for kind, arg in self.steps if kind == "force")
+        choices = sum(self._depth(arg) for kind, arg in self.steps if kind == "choice")
+        self.max_new_tokens = forced + choices + reason_max_tokens + 2
+
+        self.text_mask = self._build_text_mask(close_ids[0])
+
+    def _depth(self, node: _ChoiceNode) -> int:
+        return 1 + max((self._depth(child) for child in node.children.values()), default=0) if node.children else 0
+
+    def _build_text_mask(self, close_token: int) -> torch.Tensor:
+        """reason 允許的 token：解碼後不含特殊字元、非特殊 token"""
+        vocab_size = len(self.tokenizer)
+        mask = torch.zeros(vocab_size, dtype=torch.bool)
+        special_ids = set(self.tokenizer.all_special_ids)
+        for token_id in range(vocab_size):
+            if token_id in special_ids or token_id == close_token:
+                continue
+            text = self.tokenizer.decode([token_id])
+            if text and not (_FORBIDDEN_TEXT_CHARS & set(text)):
+                mask[token_id] = True
+        logger.info(f"✅ 結構化解碼就緒: reason 可用 {int(mask.sum())}/{vocab_size} 個 token，"
+                    f"最多生成 {self.max_new_tokens} 個 token")
+        return mask
+
+    def new_state(self) -> "_DecodeState":
+        return _DecodeState(self)
+
+
+class _DecodeState:
+    """單一請求的解碼狀態"""
+
+    def __init__(self, program: StructuredOutputProgram):
+        self.program = program
+        self.step = 0
+        self.position = 0
+        self.node: Optional[_ChoiceNode] = None
+        self.choices: List[str] = []
+        self.text_ids: List[int] = []
+        # 標籤選擇時每個分岔點的條件機率: {生成位置: (節點, {token: 機率})}
+        self.branch_probabilities: Dict[int, tuple] = {}
+        self._enter_step()
+
+    @property
+    def finished(self) -> bool:
+        return self.step >= len(self.program.steps)
+
+    @property
+    def kind(self) -> str:
+        return self.program.steps[self.step][0]
+
+    def _enter_step(self):
+        # 跳過空的強制片段
+        while not self.finished:
+            kind, arg = self.program.steps[self.step]
+            self.position = 0
+            if kind == "force" and not arg:
+                self.step += 1
+                continue
+            if kind == "choice":
+                self.node = arg
+            break
+
+    def _next_step(self):
+        self.step += 1
+        self._enter_step()
+
+    def allowed(self, vocab_size: int):
+        """返回允許的 token id 列表，或 reason 階段的布林遮罩"""
+        kind, arg = self.program.steps[self.step]
+        if kind == "force":
+            return [arg[self.position]]
+        if kind == "choice":
+            return list(self.node.children)
+        if kind == "text":
+            if self.position >= self.program.reason_max_tokens:
+                return [arg]
+            mask = torch.zeros(vocab_size, dtype=torch.bool)
+            text_mask = self.program.text_mask[:vocab_size]
+            mask[:len(text_mask)] = text_mask
+            if self.position > 0:
+                mask[arg] = True
+            return mask
+        return [self.program.eos_token_id]
+
+    def observe(self, scores: torch.Tensor, position: int):
+        """記錄標籤選擇分岔點上候選 token 的條件機率（同一位置以最後一次的分數為準）"""
+        if self.kind == "choice" and not self.choices and len(self.node.children) > 1:
+            candidates = list(self.node.children)
+            probs = torch.softmax(scores[candidates].float(), dim=-1)
+            self.branch_probabilities[position] = (self.node, {token: float(p) for token, p in zip(candidates, probs)})
+
+    def advance(self, token: int):
+        kind, arg = self.program.steps[self.step]
+        if kind == "force":
+            self.position += 1
+            if self.position >= len(arg):
+                self._next_step()
+        elif kind == "choice":
+            self.node = self.node.children[token]
+            if not self.node.children:
+                self.choices.append(self.node.value)
+                self._next_step()
+        elif kind == "text":
+            if token == arg:
+                self._next_step()
+            else:
+                self.text_ids.append(token)
+                self.position += 1
+        else:
+            self.step += 1
+
+    def label_probabilities(self) -> Dict[str, float]:
+        """由分岔點的條件機率推出各標籤的機率；未展開的子樹內平均分配"""
+        root = self.program.steps[1][1]
+        probabilities = {LABEL_VALUES[value]: 0.0 for value in LABEL_VALUES}
+        observed = {id(node): branch for node, branch in self.branch_probabilities.values()}
+
+        def assign(node: _ChoiceNode, mass: float):
+            if node.value is not None and not node.children:
+                probabilities[LABEL_VALUES[node.value]] += mass
+                return
+            branch = observed.get(id(node))
+            if branch is None:
+                if len(node.children) == 1:
+                    assign(next(iter(node.children.values())), mass)
+                    return
+                values = node.values()
+                for value in values:
+                    probabilities[LABEL_VALUES[value]] += mass / len(values)
+                return
+            for token, child in node.children.items():
+                assign(child, mass * branch.get(token, 0.0))
+
+        assign(root, 1.0)
+        return probabilities
+
+    def result(self) -> Dict:
+        label_value = self.choices[0] if self.choices else None
+        severity = self.choices[1] if len(self.choices) > 1 else None
+        reason = self.program.tokenizer.decode(self.text_ids, skip_special_tokens=True).strip()
+        return {
+            "label": LABEL_VALUES.get(label_value, "safe"),
+            "severity": severity,
+            "risk_level": SEVERITY_VALUES.get(severity, "MEDIUM"),
+            "reason": reason,
+            "probabilities": self.label_probabilities(),
+            "complete": self.finished or self.kind == "eos",
+            "json": json.dumps({"label": label_value, "severity": severity, "reason": reason}, ensure_ascii=False)
+        }
+
+
+class StructuredOutputProcessor(LogitsProcessor):
+    """將每一步的 logits 限制為結構允許的 token
+
+    解碼狀態由已生成的 token 推得：輸入延續上一次看到的序列時只處理新增的 token，
+    不一致時（推測解碼拒絕了草稿模型的候選 token，或草稿模型與主模型交替呼叫）從頭重播
+    """
+
+    def __init__(self, program: StructuredOutputProgram, prompt_length: int, batch_size: int):
+        self.program = program
+        self.prompt_length = prompt_length
+        self.states = [program.new_state() for _ in range(batch_size)]
+        self._consumed: List[List[int]] = [[] for _ in range(batch_size)]
+
+    def _sync(self, row: int, generated: List[int]):
+        consumed = self._consumed[row]
+        if generated[:len(consumed)] != consumed:
+            # 回退：重建狀態，保留仍然有效的分岔點機率
+            common = 0
+            while common < min(len(consumed), len(generated)) and consumed[common] == generated[common]:
+                common += 1
+            previous = self.states[row]
+            state = self.states[row] = self.program.new_state()
+            state.branch_probabilities = {
+                position: branch for position, branch in previous.branch_probabilities.items() if position <= common
+            }
+            consumed = self._consumed[row] = []
+
+        state = self.states[row]
+        for token in generated[len(consumed):]:
+            if not state.finished:
+                state.advance(token)
+            consumed.append(token)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        generated = input_ids[:, self.prompt_length:].tolist()
+        for row in range(len(self.states)):
+            self._sync(row, generated[row])
+
+        vocab_size = scores.shape[-1]
+        mask = torch.zeros_like(scores, dtype=torch.bool)
+        for row, state in enumerate(self.states):
+            if state.finished:
+                mask[row, self.program.eos_token_id] = True
+                continue
+            state.observe(scores[row], len(generated[row]))
+            allowed = state.allowed(vocab_size)
+            if isinstance(allowed, torch.Tensor):
+                mask[row] = allowed.to(scores.device)
+            else:
+                mask[row, allowed] = True
+        return scores.masked_fill(~mask, float("-inf"))
+
+
+class StreamingStructuredProcessor(StructuredOutputProcessor):
+    """單一請求的結構化解碼，並在解碼過程中回呼 on_event(kind, data)
+
+    kind: "label"（標籤決定，附各標籤機率）、"severity"（危險等級決定）、"token"（reason 新增的文字）
+    """
+
+    def __init__(self, program: StructuredOutputProgram, prompt_length: int,
+                 on_event: Callable[[str, Dict], None]):
+        super().__init__(program, prompt_length, 1)
+        self.on_event = on_event
+        self._emitted_choices = 0
+        self._emitted_text = ""
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        scores = super().__call__(input_ids, scores)
+        self.flush()
+        return scores
+
+    def flush(self):
+        """送出尚未回呼的解碼進度"""
+        state = self.states[0]
+        while self._emitted_choices < len(state.choices):
+            value = state.choices[self._emitted_choices]
+            if self._emitted_choices == 0:
+                self.on_event("label", {"label": LABEL_VALUES[value], "probabilities": state.label_probabilities()})
+            else:
+                self.on_event("severity", {"severity": value, "risk_level": SEVERITY_VALUES[value]})
+            self._emitted_choices += 1
+
+        if len(state.text_ids) > 0:
+            text = self.program.tokenizer.decode(state.text_ids, skip_special_tokens=True)
+            # 多位元組字元尚未解碼完整時（結尾為替換字元）等待下一個 token
+            if len(text) > len(self._emitted_text) and text.startswith(self._emitted_text) \
+                    and not text.endswith("\ufffd"):
+                self.on_event("token", {"text": text[len(self._emitted_text):]})
+                self._emitted_text = text
+
+
+class CancellationCriteria(StoppingCriteria):
+    """cancelled 被設定後在下一步停止生成（客戶端斷線時釋放推論執行緒）"""
+
+    def __init__(self, cancelled: threading.Event):
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,153 @@
+"""
+長合約的滑動窗口切分
+提示詞上限為 2048 個 token，超出的部分原本會被截斷而完全不被分析。長合約改為沿著 module / 函數邊界
+切成多個互相重疊的窗口：每個窗口都帶上所屬 module 的宣告與 use 引入作為上下文，
+單一函數超過上限時再退回以行為單位切分
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+# 移除註解與字串後再計算大括號深度，避免其中的 { } 影響判斷
+_NOISE_PATTERN = re.compile(r'//[^\n]*|/\*.*?\*/|b?"(?:[^"\\]|\\.)*"', re.DOTALL)
+
+_MODULE_PATTERN = re.compile(r"^\s*(?:module|script)\b")
+_USE_PATTERN = re.compile(r"^\s*(?:public\s+)?use\b")
+# 函數、結構、常數等頂層項目的開頭（含屬性與文件註解，讓它們與後面的項目在同一段）
+_ITEM_PATTERN = re.compile(
+    r"^\s*(?:#\[|///|(?:public(?:\s*\([^)]*\))?\s+|entry\s+|native\s+|inline\s+|macro\s+)*"
+    r"(?:fun|struct|enum|const|spec)\b)"
+)
+_ATTACHED_PATTERN = re.compile(r"^\s*(?:#\[|///)")
+
+
+@dataclass
+class CodeSegment:
+    """切分的最小單位：一個頂層項目或 module 的開頭部分（行號從 1 起算，含頭尾）"""
+    start_line: int
+    end_line: int
+    text: str
+    header: str  # 所屬 module 的宣告與 use 引入
+
+
+@dataclass
+class CodeWindow:
+    """送入模型的一個窗口"""
+    index: int
+    start_line: int
+    end_line: int
+    text: str
+
+
+def _brace_delta(line: str) -> int:
+    line = _NOISE_PATTERN.sub("", line)
+    return line.count("{") - line.count("}")
+
+
+def split_segments(code: str) -> List[CodeSegment]:
+    """沿 module 與頂層項目的邊界將代碼切成段落"""
+    lines = code.split("\n")
+    # 先移除跨行的區塊註解與字串，再逐行計算深度（保持行數不變）
+    cleaned = _NOISE_PATTERN.sub(lambda m: "\n" * m.group().count("\n"), code).split("\n")
+
+    segments: List[CodeSegment] = []
+    header_lines: List[str] = []
+    start = 0
+    depth = 0
+    pending_attached = False
+
+    def close(end: int):
+        if end > start:
+            segments.append(CodeSegment(start + 1, end, "\n".join(lines[start:end]), "\n".join(header_lines)))
+
+    for number, (line, bare) in enumerate(zip(lines, cleaned)):
+        if depth == 0 and _MODULE_PATTERN.match(bare):
+            close(number)
+            start = number
+            header_lines = [line]
+        elif depth <= 1 and _USE_PATTERN.match(bare) and header_lines:
+            header_lines.append(line)
+        elif depth <= 1 and _ITEM_PATTERN.match(line) and not pending_attached:
+            close(number)
+            start = number
+
+        pending_attached = depth <= 1 and bool(_ATTACHED_PATTERN.match(line))
+        depth = max(0, depth + bare.count("{") - bare.count("}"))
+
+    close(len(lines))
+    return segments
+
+
+def _pack(units: List[Tuple[int, int, str, int]], budget: int, overlap_tokens: int) -> List[Tuple[int, int]]:
+    """將 (start_line, end_line, text, tokens) 單位貪婪裝入窗口，返回每個窗口的 [起, 迄) 單位範圍
+
+    下一個窗口從上一個窗口末尾往回 overlap_tokens 個 token 的單位開始（至少前進一個單位）
+    """
+    ranges = []
+    first = 0
+    while first < len(units):
+        used = 0
+        last = first
+        while last < len(units) and (last == first or used + units[last][3] <= budget):
+            used += units[last][3]
+            last += 1
+        ranges.append((first, last))
+        if last >= len(units):
+            break
+
+        next_first = last
+        overlap = 0
+        while next_first - 1 > first and overlap + units[next_first - 1][3] <= overlap_tokens:
+            next_first -= 1
+            overlap += units[next_first][3]
+        first = next_first
+    return ranges
+
+
+def split_windows(code: str, count_tokens: Callable[[str], int], max_tokens: int,
+                  overlap_tokens: int = 256) -> List[CodeWindow]:
+    """將代碼切成每個不超過 max_tokens 個 token 的重疊窗口
+
+    Args:
+        code: Move 原始碼
+        count_tokens: 計算文字 token 數的函數（使用模型的分詞器）
+        max_tokens: 每個窗口（含 module 上下文）的 token 上限
+        overlap_tokens: 相鄰窗口重疊的 token 數
+    """
+    segments = split_segments(code)
+    header_tokens = {segment.header: count_tokens(segment.header) + 1 for segment in segments}
+
+    # 超過上限的段落（巨大的函數）改以行為單位
+    units: List[Tuple[int, int, str, int, str]] = []
+    for segment in segments:
+        budget = max_tokens - header_tokens[segment.header]
+        tokens = count_tokens(segment.text)
+        if tokens <= budget:
+            units.append((segment.start_line, segment.end_line, segment.text, tokens, segment.header))
+            continue
+        for offset, line in enumerate(segment.text.split("\n")):
+            number = segment.start_line + offset
+            units.append((number, number, line, count_tokens(line) + 1, segment.header))
+
+    windows: List[CodeWindow] = []
+    budget = max_tokens - max(header_tokens.values(), default=0)
+    for first, last in _pack([unit[:4] for unit in units], budget, overlap_tokens):
+        chunk = units[first:last]
+        body = "\n".join(unit[2] for unit in chunk)
+        header = chunk[0][4]
+        text = body
+        if header and not body.lstrip().startswith(header.split("\n")[0].strip()):
+            # 補上 module 宣告與 use，並補齊未閉合的大括號
+            text = f"{header}\n{body}"
+            text += "\n" + "}" * max(0, _brace_delta(text))
+        windows.append(CodeWindow(len(windows), chunk[0][0], chunk[-1][1], text))
+    return windows
+
+
+def pick_max_risk(results: List[dict], risk_key: str = "risk_score",
+                  confidence_key: str = "max_probability") -> Optional[int]:
+    """最大風險聚合：返回風險分數最高的窗口索引（同分時取信心度較高者）"""
+    if not results:
+        return None
+    return max(range(len(results)), key=lambda i: (results[i][risk_key], results[i][confidence_key]))
@@ -0,0 +1,348 @@
+"""
+多進程推論 worker 池（fork-after-load）
+主進程載入模型後 fork 出 N 個 worker：模型權重在 fork 時以 copy-on-write 共享（推論只讀取權重，
+頁面不會被複製；記憶體映射載入的合併檢查點則直接共享頁面快取），每個 worker 綁定一組 CPU 並使用自己的
+intra-op 執行緒數，從共用的請求佇列取出批次執行，結果經結果佇列送回主進程的事件迴圈。
+
+注意：PyTorch 的 OpenMP 執行緒池在 fork 之後無法在子進程中使用，主進程在 fork 前（含模型載入）
+必須維持 torch.set_num_threads(1)，不得執行多執行緒運算。
+子進程只保留呼叫 fork 的執行緒，所有 worker（啟動、重啟、熱更新的新池）都由同一個專用執行緒 fork：
+它不持有其他鎖，也沒有推論執行緒的 thread-local 狀態（例如 grad mode）。
+權重靠 copy-on-write 共享，因此不使用 spawn
+"""
+
+import asyncio
+import gc
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import psutil
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 已取消的批次：以 task_id % _CANCEL_SLOTS 為索引寫入 task_id，worker 取出批次時比對後略過
+_CANCEL_SLOTS = 4096
+# 結果持續到達時也定期檢查 worker 是否存活
+_CHECK_INTERVAL_S = 1.0
+# worker 記憶體（讀取 smaps，成本隨映射的頁面數增加）的快取時間，/stats 與 /metrics 共用
+_MEMORY_TTL_S = 5.0
+
+_fork_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ml-worker-fork")
+
+
+def parse_cpu_list(spec: str) -> Set[int]:
+    """解析 "0-3,8" 形式的 CPU 列表"""
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def plan_affinity(num_workers: int, spec: str = "auto") -> List[Optional[Set[int]]]:
+    """每個 worker 的 CPU 集合
+
+    spec: "auto" 將目前可用的 CPU 平均切分給各 worker；"none" 不綁定；
+          或以分號分隔明確指定，例如 "0-3;4-7"
+    """
+    spec = (spec or "auto").strip().lower()
+    if spec == "none" or not hasattr(os, "sched_getaffinity"):
+        return [None] * num_workers
+    if spec != "auto":
+        groups = [parse_cpu_list(group) for group in spec.split(";") if group.strip()]
+        if len(groups) != num_workers:
+            raise ValueError(f"ML_WORKER_AFFINITY 指定了 {len(groups)} 組 CPU，但有 {num_workers} 個 worker")
+        return groups
+
+    available = sorted(os.sched_getaffinity(0))
+    if len(available) < num_workers:
+        # CPU 不足以各自獨佔時不綁定，交由作業系統排程
+        return [None] * num_workers
+    chunk = len(available) // num_workers
+    return [set(available[index * chunk:(index + 1) * chunk]) for index in range(num_workers)]
+
+
+class _CancelFlag:
+    """worker 中以 Event 介面讀取批次的取消狀態（供 CancellationCriteria 在生成的每一步檢查）"""
+
+    def __init__(self, cancelled, task_id: int):
+        self.cancelled = cancelled
+        self.task_id = task_id
+
+    def is_set(self) -> bool:
+        return self.cancelled[self.task_id % _CANCEL_SLOTS] == self.task_id
+
+
+def _worker_main(index: int, cpus: Optional[Set[int]], threads: int, handlers: Dict[str, Callable],
+                 requests: multiprocessing.Queue, results: multiprocessing.Queue, cancelled):
+    """worker 進程主迴圈（fork 後執行，handlers 直接使用繼承自主進程的模型）"""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(threads)
+
+    while True:
+        task = requests.get()
+        if task is None:
+            break
+        task_id, kind, payloads, args, streaming = task
+        flag = _CancelFlag(cancelled, task_id)
+        if flag.is_set():
+            # 呼叫端已取消（例如客戶端斷線），不執行
+            results.put(("skipped", task_id, index))
+            continue
+        results.put(("started", task_id, index))
+        # 串流批次：解碼事件經結果佇列送回主進程，取消後在下一個解碼步驟停止
+        extra = {"emit": lambda *event: results.put(("event", task_id, event)), "cancelled": flag} \
+            if streaming else {}
+        try:
+            results.put(("done", task_id, handlers[kind](payloads, *args, **extra)))
+        except Exception as e:
+            results.put(("error", task_id, f"{type(e).__name__}: {e}"))
+
+
+class WorkerPool:
+    """fork-after-load 的推論進程池
+
+    Args:
+        handlers: 批次類型 -> 同步批次推論函數（在 worker 進程中執行）
+        num_workers: worker 進程數
+        threads_per_worker: 每個 worker 的 intra-op 執行緒數，None 時使用其 CPU 集合的大小
+        affinity: CPU 綁定設定，見 plan_affinity
+    """
+
+    def __init__(self, handlers: Dict[str, Callable[[List[Any]], List[Any]]], num_workers: int,
+                 threads_per_worker: Optional[int] = None, affinity: str = "auto"):
+        self.handlers = handlers
+        self.num_workers = num_workers
+        self.cpu_sets = plan_affinity(num_workers, affinity)
+        cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+        self.threads = [
+            threads_per_worker or (len(cpus) if cpus else max(1, cpu_count // num_workers))
+            for cpus in self.cpu_sets
+        ]
+
+        self._context = multiprocessing.get_context("fork")
+        self._requests = self._context.Queue()
+        self._results = self._context.Queue()
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * num_workers
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._listeners: Dict[int, Callable[..., None]] = {}  # task_id -> 串流事件回呼
+        self._assigned: Dict[int, tuple] = {}  # task_id -> (worker, 開始時間)
+        self._task_ids = itertools.count()
+        self._futures_lock = threading.Lock()
+        self._idle = threading.Condition(self._futures_lock)  # 沒有未完成的批次時通知
+        self._cancelled = self._context.RawArray("q", [-1] * _CANCEL_SLOTS)
+        self._last_check = time.monotonic()
+        self._memory: Dict[int, Dict[str, float]] = {}  # pid -> rss_mb / pss_mb
+        self._memory_sampled = 0.0
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+
+        self._worker_stats = [{"tasks": 0, "failed": 0, "skipped": 0, "busy_s": 0.0, "restarts": 0}
+                              for _ in range(num_workers)]
+
+    def start(self):
+        """fork 出所有 worker（模型必須已載入）並啟動結果讀取執行緒"""
+        # 將目前所有 Python 物件移到永久世代，避免 GC 走訪時寫入物件標頭造成 copy-on-write 複製
+        gc.collect()
+        gc.freeze()
+        # 分詞只在主進程執行，關閉 tokenizers 的 fork 警告
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        for index in range(self.num_workers):
+            _fork_thread.submit(self._spawn, index).result()
+        self._reader = threading.Thread(target=self._read_results, name="ml-worker-results", daemon=True)
+        self._reader.start()
+        logger.info(f"✅ 推論 worker 池已啟動: {self.num_workers} 個進程，"
+                    f"執行緒 {self.threads}，CPU 綁定 {[sorted(cpus) if cpus else 'none' for cpus in self.cpu_sets]}")
+
+    def _spawn(self, index: int):
+        """在專用的 fork 執行緒上呼叫"""
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.cpu_sets[index], self.threads[index], self.handlers, self._requests, self._results,
+                  self._cancelled),
+            name=f"ml-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        self._memory_sampled = 0.0
+
+    async def run(self, kind: str, payloads: List[Any], *args: Any,
+                  on_event: Optional[Callable[..., None]] = None) -> List[Any]:
+        """將批次送入共用佇列，等待任一 worker 完成（args 原樣傳給 handler）
+
+        提供 on_event 時為串流批次：handler 另外收到 emit 與 cancelled 參數，emit(*event) 在事件迴圈上呼叫 on_event(*event)
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        future = self._loop.create_future()
+        task_id = next(self._task_ids)
+        with self._futures_lock:
+            self._futures[task_id] = future
+            if on_event is not None:
+                self._listeners[task_id] = on_event
+        self._requests.put((task_id, kind, payloads, args, on_event is not None))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # 尚未開始的批次由 worker 略過；執行中的串流批次在下一個解碼步驟停止，其他批次執行完後結果直接丟棄
+            self._cancelled[task_id % _CANCEL_SLOTS] = task_id
+            self._pop_future(task_id)
+            raise
+
+    def _pop_future(self, task_id: int) -> Optional[asyncio.Future]:
+        with self._futures_lock:
+            future = self._futures.pop(task_id, None)
+            self._listeners.pop(task_id, None)
+            if not self._futures:
+                self._idle.notify_all()
+        return future
+
+    def _resolve(self, task_id: int, error: Optional[str], value: Any = None):
+        future = self._pop_future(task_id)
+        if future is None:
+            return
+
+        def apply():
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(value)
+
+        self._loop.call_soon_threadsafe(apply)
+
+    def _read_results(self):
+        while not self._stopping:
+            if time.monotonic() - self._last_check >= _CHECK_INTERVAL_S:
+                self._check_workers()
+            try:
+                status, task_id, value = self._results.get(timeout=_CHECK_INTERVAL_S)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            if status == "started":
+                self._assigned[task_id] = (value, time.monotonic())
+                continue
+            if status == "skipped":
+                self._worker_stats[value]["skipped"] += 1
+                continue
+            if status == "event":
+                listener = self._listeners.get(task_id)
+                if listener is not None:
+                    self._loop.call_soon_threadsafe(listener, *value)
+                continue
+
+            worker, started = self._assigned.pop(task_id, (None, None))
+            if worker is not None:
+                stats = self._worker_stats[worker]
+                stats["tasks"] += 1
+                stats["busy_s"] += time.monotonic() - started
+                if status == "error":
+                    stats["failed"] += 1
+            if status == "error":
+                self._resolve(task_id, value)
+            else:
+                self._resolve(task_id, None, value)
+
+    def _check_workers(self):
+        """重啟意外結束的 worker，並讓它正在處理的批次失敗（未開始的批次留在佇列由其他 worker 處理）"""
+        self._last_check = time.monotonic()
+        for index, process in enumerate(self._processes):
+            if self._stopping or process is None or process.is_alive():
+                continue
+            logger.error(f"❌ 推論 worker {index} (pid {process.pid}) 意外結束 (exit code {process.exitcode})，重新啟動")
+            for task_id, (worker, _) in list(self._assigned.items()):
+                if worker == index:
+                    self._assigned.pop(task_id, None)
+                    self._resolve(task_id, f"推論 worker {index} 意外結束")
+            self._worker_stats[index]["restarts"] += 1
+            _fork_thread.submit(self._spawn, index).result()
+
+    def drain_and_stop(self, timeout: float = 60.0):
+        """等待已送入的批次完成後停止（熱更新切換到新的 worker 池後，舊池不再收到新批次）"""
+        with self._idle:
+            self._idle.wait_for(lambda: not self._futures, timeout)
+        # 新的 worker 池仍與主進程共享 fork 時的頁面，不解除 gc.freeze
+        self.stop(unfreeze=False)
+
+    def stop(self, timeout: float = 10.0, unfreeze: bool = True):
+        """通知所有 worker 結束並等待"""
+        self._stopping = True
+        for _ in self._processes:
+            self._requests.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+        with self._futures_lock:
+            pending = list(self._futures)
+        for task_id in pending:
+            self._resolve(task_id, "推論 worker 池已停止")
+        if unfreeze:
+            gc.unfreeze()
+        logger.info("🛑 推論 worker 池已停止")
+
+    def _memory_stats(self) -> Dict[int, Dict[str, float]]:
+        """各 worker 的 RSS 與 PSS，最多每 _MEMORY_TTL_S 秒取樣一次"""
+        if time.monotonic() - self._memory_sampled < _MEMORY_TTL_S:
+            return self._memory
+        memory_by_pid = {}
+        for process in self._processes:
+            if process is None or not process.is_alive():
+                continue
+            try:
+                memory = psutil.Process(process.pid).memory_full_info()
+            except (psutil.Error, OSError):
+                continue
+            memory_by_pid[process.pid] = {
+                "rss_mb": round(memory.rss / 1024**2, 1),
+                "pss_mb": round(getattr(memory, "pss", memory.rss) / 1024**2, 1)
+            }
+        self._memory, self._memory_sampled = memory_by_pid, time.monotonic()
+        return memory_by_pid
+
+    def get_stats(self) -> Dict:
+        """各 worker 的負載與記憶體（PSS 按共享頁面比例分攤，可看出權重是否被複製；記憶體為最近一次取樣）"""
+        memory_by_pid = self._memory_stats()
+        workers = []
+        for index, process in enumerate(self._processes):
+            entry = {
+                "index": index,
+                "pid": process.pid if process else None,
+                "alive": bool(process and process.is_alive()),
+                "cpus": sorted(self.cpu_sets[index]) if self.cpu_sets[index] else None,
+                "threads": self.threads[index],
+                **self._worker_stats[index],
+                "busy_s": round(self._worker_stats[index]["busy_s"], 2)
+            }
+            if entry["alive"]:
+                entry.update(memory_by_pid.get(process.pid, {}))
+            workers.append(entry)
+
+        return {
+            "num_workers": self.num_workers,
+            "in_flight": len(self._futures),
+            "running": len(self._assigned),
+            "workers": workers
+        }
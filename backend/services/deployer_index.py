@@ -0,0 +1,230 @@
+"""
+部署者信譽索引
+記錄每個部署者地址發佈過的包及其風險等級，供 RiskEngine 在請求路徑上 O(1) 查詢（不需 RPC）
+
+磁碟格式為固定長度的追加寫入紀錄（每筆 73 bytes）:
+  deployer (32 bytes) | package (32 bytes) | risk level (1 byte) | unix timestamp (int64)
+同一個包重複分析時以最後一筆為準
+
+使用範例:
+  # 查看部署者紀錄
+  python services/deployer_index.py show 0x1234...
+
+  # 壓縮紀錄檔（每個包只保留最後一筆）
+  python services/deployer_index.py compact
+"""
+
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from .sui_address import format_address, normalize_address
+except ImportError:  # 以 python services/deployer_index.py 直接執行
+    from sui_address import format_address, normalize_address
+
+logger = logging.getLogger(__name__)
+
+RISK_LEVELS = ("SAFE", "LOW", "MEDIUM", "HIGH", "CRITICAL")
+_RISK_LEVEL_CODES = {level: code for code, level in enumerate(RISK_LEVELS)}
+
+_RECORD = struct.Struct("<32s32sBq")
+
+
+@dataclass
+class DeployerRecord:
+    """部署者紀錄"""
+    address: str
+    first_seen: float
+    last_seen: float
+    level_counts: List[int] = field(default_factory=lambda: [0] * len(RISK_LEVELS))
+    packages: List[str] = field(default_factory=list)
+
+    @property
+    def package_count(self) -> int:
+        return len(self.packages)
+
+    @property
+    def high_risk_count(self) -> int:
+        return self.level_counts[_RISK_LEVEL_CODES["HIGH"]] + self.level_counts[_RISK_LEVEL_CODES["CRITICAL"]]
+
+    def to_dict(self) -> Dict:
+        return {
+            "address": self.address,
+            "first_seen": datetime.fromtimestamp(self.first_seen).isoformat(),
+            "last_seen": datetime.fromtimestamp(self.last_seen).isoformat(),
+            "counts": dict(zip(RISK_LEVELS, self.level_counts)),
+            "packages": list(self.packages)
+        }
+
+
+class DeployerIndex:
+    """部署者信譽索引 - 啟動時重放紀錄檔，之後全部在記憶體中查詢"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._deployers: Dict[bytes, DeployerRecord] = {}
+        self._package_deployer: Dict[bytes, bytes] = {}
+        self._package_level: Dict[bytes, int] = {}
+        self._package_seen: Dict[bytes, Tuple[int, int]] = {}
+        self.load()
+
+    def load(self):
+        """從紀錄檔重建記憶體索引"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        usable = len(data) - len(data) % _RECORD.size
+        for deployer, package, level_code, timestamp in _RECORD.iter_unpack(data[:usable]):
+            self._apply(deployer, package, level_code, timestamp)
+
+        logger.info(f"✅ 部署者索引已載入: {len(self._deployers)} 個部署者, {len(self._package_deployer)} 個包")
+
+    def _apply(self, deployer: bytes, package: bytes, level_code: int, timestamp: float):
+        record = self._deployers.get(deployer)
+        if record is None:
+            record = DeployerRecord(address=format_address(deployer), first_seen=timestamp, last_seen=timestamp)
+            self._deployers[deployer] = record
+
+        previous_level = self._package_level.get(package)
+        previous_deployer = self._package_deployer.get(package)
+        if previous_level is None:
+            record.packages.append(format_address(package))
+        elif previous_deployer != deployer:
+            # 同一個包換了部署者（通常是呼叫方提供了錯誤地址），從原部署者移除
+            previous_record = self._deployers[previous_deployer]
+            previous_record.level_counts[previous_level] -= 1
+            previous_record.packages.remove(format_address(package))
+            record.packages.append(format_address(package))
+        else:
+            record.level_counts[previous_level] -= 1
+
+        record.level_counts[level_code] += 1
+        record.first_seen = min(record.first_seen, timestamp)
+        record.last_seen = max(record.last_seen, timestamp)
+        self._package_deployer[package] = deployer
+        self._package_level[package] = level_code
+        first, last = self._package_seen.get(package, (timestamp, timestamp))
+        self._package_seen[package] = (min(first, timestamp), max(last, timestamp))
+
+    def record(self, deployer: str, package_id: str, risk_level: str, timestamp: Optional[float] = None) -> bool:
+        """記錄一次分析結果
+
+        Returns:
+            是否成功寫入（地址格式不正確或風險等級未知時返回 False）
+        """
+        deployer_raw = normalize_address(deployer)
+        package_raw = normalize_address(package_id)
+        level_code = _RISK_LEVEL_CODES.get(risk_level)
+        if deployer_raw is None or package_raw is None or level_code is None:
+            return False
+
+        timestamp = timestamp or time.time()
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(_RECORD.pack(deployer_raw, package_raw, level_code, int(timestamp)))
+            self._apply(deployer_raw, package_raw, level_code, int(timestamp))
+        return True
+
+    def get(self, deployer: str) -> Optional[DeployerRecord]:
+        """查詢部署者紀錄"""
+        deployer_raw = normalize_address(deployer)
+        if deployer_raw is None:
+            return None
+        return self._deployers.get(deployer_raw)
+
+    def deployer_of(self, package_id: str) -> Optional[str]:
+        """查詢包的部署者（僅限索引中見過的包）"""
+        package_raw = normalize_address(package_id)
+        if package_raw is None:
+            return None
+        deployer = self._package_deployer.get(package_raw)
+        return format_address(deployer) if deployer else None
+
+    def prior_high_risk_count(self, deployer: str, exclude_package: Optional[str] = None) -> int:
+        """部署者過去 HIGH/CRITICAL 包的數量（可排除當前分析的包本身）"""
+        record = self.get(deployer)
+        if record is None:
+            return 0
+
+        count = record.high_risk_count
+        package_raw = normalize_address(exclude_package) if exclude_package else None
+        if package_raw is not None and self._package_deployer.get(package_raw) == normalize_address(deployer):
+            if RISK_LEVELS[self._package_level[package_raw]] in ("HIGH", "CRITICAL"):
+                count -= 1
+        return count
+
+    def compact(self):
+        """重寫紀錄檔，每個包只保留最後的風險等級（保留首次與最後出現時間）"""
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                for package, deployer in self._package_deployer.items():
+                    level_code = self._package_level[package]
+                    first, last = self._package_seen[package]
+                    f.write(_RECORD.pack(deployer, package, level_code, int(first)))
+                    if last != first:
+                        f.write(_RECORD.pack(deployer, package, level_code, int(last)))
+            os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return len(self._deployers)
+
+
+_shared_index: Optional[DeployerIndex] = None
+_shared_index_lock = threading.Lock()
+
+
+def get_deployer_index() -> DeployerIndex:
+    """取得進程內共享的部署者索引"""
+    global _shared_index
+    if _shared_index is None:
+        with _shared_index_lock:
+            if _shared_index is None:
+                _shared_index = DeployerIndex(os.getenv("DEPLOYER_INDEX_PATH", "./deployer_index.bin"))
+    return _shared_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SuiGuard 部署者信譽索引")
+    parser.add_argument("--path", type=str,
+                        default=os.getenv("DEPLOYER_INDEX_PATH", "./deployer_index.bin"),
+                        help="紀錄檔路徑 (default: ./deployer_index.bin)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    show_parser = subparsers.add_parser("show", help="查看部署者紀錄")
+    show_parser.add_argument("address", type=str, help="部署者地址")
+
+    subparsers.add_parser("compact", help="壓縮紀錄檔")
+
+    args = parser.parse_args()
+    index = DeployerIndex(args.path)
+
+    if args.command == "show":
+        record = index.get(args.address)
+        if record is None:
+            print("⚠️ 未找到此部署者")
+        else:
+            print(json.dumps(record.to_dict(), ensure_ascii=False, indent=2))
+    elif args.command == "compact":
+        before = os.path.getsize(args.path) if os.path.exists(args.path) else 0
+        index.compact()
+        print(f"✅ 壓縮完成: {before} -> {os.path.getsize(args.path)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+風險分析特徵庫與批次重新評分
+每次 RiskEngine 分析都會把規則引擎的各項分數與 ML 原始輸出寫入僅追加的列式存儲，
+調整權重或閾值時可用向量化運算在整個歷史上重新評分（不需 RPC 或 ML），比較判定變化
+
+磁碟格式（store_dir 下）:
+  schema.json      欄位名稱與 dtype
+  <column>.bin     每個欄位一個檔案，固定長度、僅追加
+  rows.jsonl       每列的包地址與域名（僅用於報告）
+
+使用範例:
+  # 以候選評分配置重新評分全部歷史
+  python services/feature_store.py rescore --config candidate_scoring.json
+
+  # 查看特徵庫統計
+  python services/feature_store.py stats
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 風險評分配置 - RiskEngine 與重新評分共用
+DEFAULT_SCORING_CONFIG = {
+    # 規則引擎加權（域名風險權重最高）
+    "domain_weight": 0.5,
+    "permission_weight": 0.3,
+    "package_weight": 0.2,
+    # 任一項目風險極高時，總風險至少為最高個別風險 × 此係數
+    "max_individual_factor": 0.8,
+    # 規則引擎風險等級閾值 (0-1)
+    "rule_high_threshold": 0.7,
+    "rule_medium_threshold": 0.4,
+    # ML 可信度高於此值時給予 ML 更高權重
+    "ml_confidence_threshold": 0.3,
+    "ml_weight": 0.6,
+    "rule_weight": 0.4,
+    # ML 可信度低時的權重
+    "ml_weight_low_confidence": 0.2,
+    "rule_weight_low_confidence": 0.8,
+    # ML 100 分制風險等級閾值
+    "ml_high_threshold": 70,
+    "ml_medium_threshold": 40,
+}
+
+RISK_LEVELS = ("SAFE", "LOW", "MEDIUM", "HIGH", "CRITICAL")
+_RISK_LEVEL_CODES = {level: code for code, level in enumerate(RISK_LEVELS)}
+
+ANALYSIS_METHODS = ("hybrid_ml_rules", "rules_only_fallback", "package_blocklist")
+_ANALYSIS_METHOD_CODES = {method: code for code, method in enumerate(ANALYSIS_METHODS)}
+
+# ML 服務的分類標籤
+ML_LABELS = (
+    "capability_leak",
+    "arithmetic_overflow",
+    "cross_module_pollution",
+    "unchecked_return",
+    "resource_leak",
+    "safe"
+)
+
+COLUMNS = (
+    ("timestamp", "<f8"),
+    ("domain_risk", "<f8"),
+    ("permission_risk", "<f8"),
+    ("package_risk", "<f8"),
+    ("ml_available", "u1"),
+    ("ml_risk_score", "<f4"),
+    ("ml_confidence", "<f8"),
+    ("ml_max_probability", "<f4"),
+    *((f"prob_{label}", "<f4") for label in ML_LABELS),
+    ("analysis_method", "u1"),
+    ("risk_level", "u1"),
+    ("final_score", "<f8"),
+)
+
+
+def load_scoring_config(path: Optional[str] = None) -> Dict:
+    """讀取評分配置，未指定的項目使用預設值"""
+    config = dict(DEFAULT_SCORING_CONFIG)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(DEFAULT_SCORING_CONFIG)
+        if unknown:
+            raise ValueError(f"未知的評分配置項目: {', '.join(sorted(unknown))}")
+        config.update(overrides)
+    return config
+
+
+class FeatureStore:
+    """僅追加的列式特徵庫"""
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+        self._handles: Dict[str, object] = {}
+        self._dtypes = {name: np.dtype(dtype) for name, dtype in COLUMNS}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name)
+
+    def _ensure_schema(self):
+        schema_path = self._path("schema.json")
+        schema = {"columns": [[name, dtype] for name, dtype in COLUMNS]}
+        if os.path.exists(schema_path):
+            with open(schema_path, "r", encoding="utf-8") as f:
+                existing = json.load(f)
+            if existing != schema:
+                raise ValueError(f"特徵庫 schema 不一致: {schema_path}")
+            return
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = schema_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(schema, f, indent=2)
+        os.replace(tmp_path, schema_path)
+
+    def append(self, features: Dict, meta: Optional[Dict] = None):
+        """追加一列特徵，未提供的欄位寫入 0"""
+        with self._lock:
+            if not self._handles:
+                self._ensure_schema()
+                for name, _ in COLUMNS:
+                    self._handles[name] = open(self._path(f"{name}.bin"), "ab")
+                self._handles["rows.jsonl"] = open(self._path("rows.jsonl"), "a", encoding="utf-8")
+
+            for name, dtype in self._dtypes.items():
+                handle = self._handles[name]
+                handle.write(np.array([features.get(name, 0)], dtype=dtype).tobytes())
+                handle.flush()
+            rows = self._handles["rows.jsonl"]
+            rows.write(json.dumps(meta or {}, ensure_ascii=False) + "\n")
+            rows.flush()
+
+    def load_columns(self) -> Dict[str, np.ndarray]:
+        """以 memory-map 讀取全部欄位；各欄位長度不一致時（寫入中斷）截斷到最短的欄位"""
+        columns = {}
+        for name, dtype in self._dtypes.items():
+            path = self._path(f"{name}.bin")
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            count = size // dtype.itemsize
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(count,)) if count else np.zeros(0, dtype=dtype)
+
+        rows = min(len(column) for column in columns.values())
+        return {name: column[:rows] for name, column in columns.items()}
+
+    def load_rows(self, indices: List[int]) -> Dict[int, Dict]:
+        """讀取指定列的包地址與域名"""
+        wanted = set(indices)
+        result = {}
+        path = self._path("rows.jsonl")
+        if not wanted or not os.path.exists(path):
+            return result
+        with open(path, "r", encoding="utf-8") as f:
+            for index, line in enumerate(f):
+                if index in wanted:
+                    result[index] = json.loads(line)
+                    if len(result) == len(wanted):
+                        break
+        return result
+
+    def close(self):
+        with self._lock:
+            for handle in self._handles.values():
+                handle.close()
+            self._handles = {}
+
+
+def rescore(columns: Dict[str, np.ndarray], config: Dict) -> Dict[str, np.ndarray]:
+    """以向量化運算重現 RiskEngine.analyze_with_ml_integration 的判定邏輯
+
+    Returns:
+        risk_level（等級代碼）與 final_score 陣列
+    """
+    domain = columns["domain_risk"].astype(np.float64)
+    permission = columns["permission_risk"].astype(np.float64)
+    package = columns["package_risk"].astype(np.float64)
+
+    weighted = (domain * config["domain_weight"] +
+                permission * config["permission_weight"] +
+                package * config["package_weight"])
+    max_individual = np.maximum(np.maximum(domain, permission), package)
+    rule_score = np.maximum(weighted, max_individual * config["max_individual_factor"])
+    # 線上路徑混合的是四捨五入到兩位的 risk_breakdown['final_score']，閾值附近的判定需一致
+    rounded_rule_score = np.round(rule_score, 2)
+
+    ml_available = columns["ml_available"].astype(bool)
+    ml_score_100 = np.where(ml_available, columns["ml_risk_score"].astype(np.float64), 0.0)
+    ml_score = ml_score_100 / 100.0
+
+    high_confidence = ml_available & (columns["ml_confidence"] > config["ml_confidence_threshold"])
+    final_score = np.where(
+        high_confidence,
+        ml_score * config["ml_weight"] + rounded_rule_score * config["rule_weight"],
+        rounded_rule_score * config["rule_weight_low_confidence"] + ml_score * config["ml_weight_low_confidence"]
+    )
+
+    ml_level = np.select(
+        [ml_score_100 >= config["ml_high_threshold"], ml_score_100 >= config["ml_medium_threshold"]],
+        [_RISK_LEVEL_CODES["HIGH"], _RISK_LEVEL_CODES["MEDIUM"]],
+        _RISK_LEVEL_CODES["LOW"]
+    )
+
+    def rule_level(score):
+        return np.select(
+            [score >= config["rule_high_threshold"], score >= config["rule_medium_threshold"]],
+            [_RISK_LEVEL_CODES["HIGH"], _RISK_LEVEL_CODES["MEDIUM"]],
+            _RISK_LEVEL_CODES["LOW"]
+        )
+
+    use_ml_level = high_confidence | (ml_available & (ml_score_100 > 0))
+    risk_level = np.where(use_ml_level, ml_level, rule_level(final_score))
+
+    # 回退路徑只使用規則引擎分數（等級以未四捨五入的分數判斷，寫入的分數為四捨五入值）；黑名單不受配置影響
+    method = columns["analysis_method"]
+    fallback = method == _ANALYSIS_METHOD_CODES["rules_only_fallback"]
+    risk_level = np.where(fallback, rule_level(rule_score), risk_level)
+    final_score = np.where(fallback, rounded_rule_score, final_score)
+
+    blocklisted = method == _ANALYSIS_METHOD_CODES["package_blocklist"]
+    risk_level = np.where(blocklisted, _RISK_LEVEL_CODES["CRITICAL"], risk_level)
+    final_score = np.where(blocklisted, 1.0, final_score)
+
+    return {
+        "risk_level": risk_level.astype(np.uint8),
+        "final_score": final_score
+    }
+
+
+def compare_verdicts(before: np.ndarray, after: np.ndarray) -> Dict:
+    """統計判定等級的變化"""
+    transitions = np.zeros((len(RISK_LEVELS), len(RISK_LEVELS)), dtype=np.int64)
+    np.add.at(transitions, (before.astype(np.intp), after.astype(np.intp)), 1)
+
+    changed = int(np.count_nonzero(before != after))
+    total = len(before)
+    return {
+        "total": total,
+        "changed": changed,
+        "changed_ratio": round(changed / total, 4) if total else 0.0,
+        "escalated": int(np.count_nonzero(after > before)),
+        "downgraded": int(np.count_nonzero(after < before)),
+        "before": {level: int(count) for level, count in zip(RISK_LEVELS, transitions.sum(axis=1))},
+        "after": {level: int(count) for level, count in zip(RISK_LEVELS, transitions.sum(axis=0))},
+        "transitions": {
+            f"{RISK_LEVELS[i]}->{RISK_LEVELS[j]}": int(transitions[i, j])
+            for i in range(len(RISK_LEVELS)) for j in range(len(RISK_LEVELS))
+            if i != j and transitions[i, j]
+        }
+    }
+
+
+_shared_store: Optional[FeatureStore] = None
+_shared_store_lock = threading.Lock()
+
+
+def get_feature_store() -> FeatureStore:
+    """取得進程內共享的特徵庫"""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                _shared_store = FeatureStore(os.getenv("FEATURE_STORE_DIR", "./feature_store"))
+    return _shared_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SuiGuard 風險特徵庫")
+    parser.add_argument("--store-dir", type=str,
+                        default=os.getenv("FEATURE_STORE_DIR", "./feature_store"),
+                        help="特徵庫目錄 (default: ./feature_store)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rescore_parser = subparsers.add_parser("rescore", help="以候選評分配置重新評分全部歷史")
+    rescore_parser.add_argument("--config", type=str, required=True, help="候選評分配置 JSON")
+    rescore_parser.add_argument("--baseline-config", type=str, default=None,
+                                help="基準評分配置 JSON（預設為記錄時的判定）")
+    rescore_parser.add_argument("--show", type=int, default=10, help="列出前 N 個判定變化的分析")
+    rescore_parser.add_argument("--output", type=str, default=None, help="將報告保存為 JSON")
+
+    subparsers.add_parser("stats", help="查看特徵庫統計")
+
+    args = parser.parse_args()
+    store = FeatureStore(args.store_dir)
+
+    start_time = time.perf_counter()
+    columns = store.load_columns()
+    total = len(columns["risk_level"])
+    if total == 0:
+        print("⚠️ 特徵庫為空")
+        return
+
+    if args.command == "stats":
+        levels = np.bincount(columns["risk_level"], minlength=len(RISK_LEVELS))
+        methods = np.bincount(columns["analysis_method"], minlength=len(ANALYSIS_METHODS))
+        print(json.dumps({
+            "rows": total,
+            "ml_available": int(columns["ml_available"].sum()),
+            "risk_levels": {level: int(count) for level, count in zip(RISK_LEVELS, levels)},
+            "analysis_methods": {method: int(count) for method, count in zip(ANALYSIS_METHODS, methods)}
+        }, ensure_ascii=False, indent=2))
+        return
+
+    candidate = load_scoring_config(args.config)
+    after = rescore(columns, candidate)["risk_level"]
+
+    # 記錄時的判定用預設配置重新評分，兩者不一致代表記錄時使用了不同配置
+    recorded = np.asarray(columns["risk_level"])
+    replay_mismatch = int(np.count_nonzero(rescore(columns, DEFAULT_SCORING_CONFIG)["risk_level"] != recorded))
+    if args.baseline_config:
+        before = rescore(columns, load_scoring_config(args.baseline_config))["risk_level"]
+    else:
+        before = recorded
+
+    report = compare_verdicts(before, after)
+    report["replay_mismatch_with_default_config"] = replay_mismatch
+    report["elapsed_seconds"] = round(time.perf_counter() - start_time, 3)
+
+    changed_indices = np.flatnonzero(before != after)[:args.show].tolist()
+    rows = store.load_rows(changed_indices)
+    report["examples"] = [
+        {
+            **rows.get(index, {}),
+            "before": RISK_LEVELS[before[index]],
+            "after": RISK_LEVELS[after[index]]
+        }
+        for index in changed_indices
+    ]
+
+    print(f"📊 重新評分 {report['total']} 筆分析，耗時 {report['elapsed_seconds']}s")
+    print(f"   判定變化: {report['changed']} ({report['changed_ratio']:.2%})，"
+          f"升級 {report['escalated']}，降級 {report['downgraded']}")
+    for transition, count in report["transitions"].items():
+        print(f"   {transition}: {count}")
+    if replay_mismatch:
+        print(f"⚠️ {replay_mismatch} 筆記錄與預設配置的重新評分不一致（記錄時可能使用了其他配置）")
+    for example in report["examples"]:
+        print(f"   {example.get('package_ids') or example.get('domain')}: {example['before']} -> {example['after']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ 報告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
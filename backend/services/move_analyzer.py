@@ -53,67 +53,12 @@ class MoveCodeAnalyzer:
         try:
             print(f"🔍 獲取包源代碼: {package_id}")
             
-            rpc_data = {
-                "jsonrpc": "2.0",
-                "id": 1,
-                "method": "sui_getNormalizedMoveModulesByPackage",
-                "params": [package_id]
-            }
+            modules = await self.fetch_normalized_modules(package_id)
+            if modules is None:
+                return None
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.rpc_url, json=rpc_data, timeout=15) as resp:
-                    if resp.status != 200:
-                        print(f"❌ RPC 調用失敗: {resp.status}")
-                        return None
-                    
-                    result = await resp.json()
-                    
-                    if "error" in result:
-                        print(f"❌ RPC 錯誤: {result['error']}")
-                        return None
-                    
-                    if "result" not in result:
-                        print("❌ 響應中缺少 result 字段")
-                        return None
-                    
-                    # 將模組轉換為可分析的文本
-                    modules = result["result"]
-                    source_text = ""
-                    
-                    for module_name, module_data in modules.items():
-                        source_text += f"// Module: {module_name}\n"
-                        
-                        # 提取結構體
-                        if "structs" in module_data:
-                            for struct_name, struct_data in module_data["structs"].items():
-                                source_text += f"struct {struct_name} {{\n"
-                                if "fields" in struct_data:
-                                    for field in struct_data["fields"]:
-                                        source_text += f"  {field.get('name', 'unknown')}: {field.get('type', 'unknown')},\n"
-                                source_text += "}\n\n"
-                        
-                        # 提取函數
-                        if "exposedFunctions" in module_data:
-                            for func_name, func_data in module_data["exposedFunctions"].items():
-                                visibility = func_data.get("visibility", "private")
-                                is_entry = func_data.get("isEntry", False)
-                                
-                                source_text += f"{visibility} "
-                                if is_entry:
-                                    source_text += "entry "
-                                
-                                source_text += f"fun {func_name}("
-                                
-                                # 參數
-                                if "parameters" in func_data:
-                                    params = []
-                                    for param in func_data["parameters"]:
-                                        params.append(f"param: {param}")
-                                    source_text += ", ".join(params)
-                                
-                                source_text += ") {\n  // Function body\n}\n\n"
-                    
-                    return source_text if source_text else "// Empty package"
+            source_text = self.render_normalized_modules(modules)
+            return source_text if source_text else "// Empty package"
                     
         except Exception as e:
             print(f"❌ 獲取源代碼錯誤: {e}")
@@ -121,6 +66,79 @@ class MoveCodeAnalyzer:
             traceback.print_exc()
             return None
     
+    async def fetch_normalized_modules(self, package_id: str) -> Optional[Dict]:
+        """通過 RPC 獲取包的 normalized modules
+        
+        Args:
+            package_id: 包的ID
+            
+        Returns:
+            module 名稱到 normalized module 的字典，如果失敗則返回None
+        """
+        rpc_data = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "sui_getNormalizedMoveModulesByPackage",
+            "params": [package_id]
+        }
+        
+        async with aiohttp.ClientSession() as session:
+            async with session.post(self.rpc_url, json=rpc_data, timeout=15) as resp:
+                if resp.status != 200:
+                    print(f"❌ RPC 調用失敗: {resp.status}")
+                    return None
+                
+                result = await resp.json()
+                
+                if "error" in result:
+                    print(f"❌ RPC 錯誤: {result['error']}")
+                    return None
+                
+                if "result" not in result:
+                    print("❌ 響應中缺少 result 字段")
+                    return None
+                
+                return result["result"]
+    
+    def render_normalized_modules(self, modules: Dict) -> str:
+        """將 normalized modules 轉換為可分析的文本"""
+        source_text = ""
+        
+        for module_name, module_data in modules.items():
+            source_text += f"// Module: {module_name}\n"
+            
+            # 提取結構體
+            if "structs" in module_data:
+                for struct_name, struct_data in module_data["structs"].items():
+                    source_text += f"struct {struct_name} {{\n"
+                    if "fields" in struct_data:
+                        for field in struct_data["fields"]:
+                            source_text += f"  {field.get('name', 'unknown')}: {field.get('type', 'unknown')},\n"
+                    source_text += "}\n\n"
+            
+            # 提取函數
+            if "exposedFunctions" in module_data:
+                for func_name, func_data in module_data["exposedFunctions"].items():
+                    visibility = func_data.get("visibility", "private")
+                    is_entry = func_data.get("isEntry", False)
+                    
+                    source_text += f"{visibility} "
+                    if is_entry:
+                        source_text += "entry "
+                    
+                    source_text += f"fun {func_name}("
+                    
+                    # 參數
+                    if "parameters" in func_data:
+                        params = []
+                        for param in func_data["parameters"]:
+                            params.append(f"param: {param}")
+                        source_text += ", ".join(params)
+                    
+                    source_text += ") {\n  // Function body\n}\n\n"
+        
+        return source_text
+    
     def analyze_dangerous_functions(self, source_code: str) -> List[str]:
         """分析危險函數"""
         found_functions = []
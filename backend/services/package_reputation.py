@@ -0,0 +1,301 @@
+"""
+包信譽清單（黑名單 / 白名單）
+將大型包地址清單編譯為緊湊的二進位檔：Bloom filter 負責快速排除，
+排序後的 32-byte 包地址陣列負責精確確認，以 mmap 載入，啟動時不需解析清單
+
+編譯後的檔案以 os.replace 原子替換，執行中的服務會依檔案 mtime 自動重新載入
+
+使用範例:
+  # 從文字清單編譯黑名單（每行一個包地址，# 開頭為註解）
+  python services/package_reputation.py compile blocklist lists/malicious_packages.txt
+
+  # 查詢包的信譽
+  python services/package_reputation.py check 0x1234...
+
+  # 查看已載入清單的統計
+  python services/package_reputation.py stats
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+try:
+    from .sui_address import normalize_address
+except ImportError:  # 以 python services/package_reputation.py 直接執行
+    from sui_address import normalize_address
+
+logger = logging.getLogger(__name__)
+
+LIST_NAMES = ("blocklist", "allowlist")
+
+_MAGIC = b"SGPR"
+_VERSION = 1
+# magic | version | hash 數量 | 包數量 | Bloom 位元數
+_HEADER = struct.Struct("<4sHHQQ")
+_ID_SIZE = 32
+
+
+def _bloom_positions(raw: bytes, num_hashes: int, num_bits: int) -> Iterable[int]:
+    """雙重雜湊產生 k 個位元位置"""
+    digest = hashlib.blake2b(raw, digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    for i in range(num_hashes):
+        yield (h1 + i * h2) % num_bits
+
+
+def compile_list(package_ids: Iterable[str], output_path: str, false_positive_rate: float = 0.001) -> Dict:
+    """將包地址清單編譯為二進位檔，寫入臨時檔後原子替換
+
+    Returns:
+        編譯統計（有效包數、無效行數、檔案大小）
+    """
+    ids = set()
+    invalid = 0
+    for package_id in package_ids:
+        raw = normalize_address(package_id)
+        if raw is None:
+            invalid += 1
+            continue
+        ids.add(raw)
+    sorted_ids = sorted(ids)
+
+    count = len(sorted_ids)
+    num_bits = max(64, int(math.ceil(-count * math.log(false_positive_rate) / (math.log(2) ** 2))))
+    num_hashes = max(1, int(round(num_bits / max(count, 1) * math.log(2)))) if count else 1
+    num_hashes = min(num_hashes, 16)
+
+    bloom = bytearray((num_bits + 7) // 8)
+    for raw in sorted_ids:
+        for position in _bloom_positions(raw, num_hashes, num_bits):
+            bloom[position >> 3] |= 1 << (position & 7)
+    # 位址陣列按 8 bytes 對齊
+    bloom.extend(b"\0" * (-len(bloom) % 8))
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{output_path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, num_hashes, count, num_bits))
+        f.write(bloom)
+        f.write(b"".join(sorted_ids))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+
+    return {
+        "packages": count,
+        "invalid_lines": invalid,
+        "bloom_bits": num_bits,
+        "num_hashes": num_hashes,
+        "size_bytes": os.path.getsize(output_path)
+    }
+
+
+def read_list_file(path: str) -> List[str]:
+    """讀取文字清單：每行一個包地址，忽略空行與 # 註解"""
+    package_ids = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                package_ids.append(line)
+    return package_ids
+
+
+class CompiledPackageList:
+    """以 mmap 載入的已編譯包清單"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.num_hashes, self.count, self.num_bits = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._mm.close()
+            raise ValueError(f"不支援的清單格式: {path}")
+
+        bloom_size = (self.num_bits + 7) // 8
+        self._bloom_offset = _HEADER.size
+        self._ids_offset = self._bloom_offset + bloom_size + (-bloom_size % 8)
+        if len(self._mm) < self._ids_offset + self.count * _ID_SIZE:
+            self._mm.close()
+            raise ValueError(f"清單檔案不完整: {path}")
+
+    def _maybe_contains(self, raw: bytes) -> bool:
+        mm = self._mm
+        offset = self._bloom_offset
+        for position in _bloom_positions(raw, self.num_hashes, self.num_bits):
+            if not mm[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def _exact_contains(self, raw: bytes) -> bool:
+        mm = self._mm
+        base = self._ids_offset
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = base + mid * _ID_SIZE
+            candidate = mm[start:start + _ID_SIZE]
+            if candidate < raw:
+                lo = mid + 1
+            elif candidate > raw:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def contains(self, raw: bytes) -> bool:
+        return self.count > 0 and self._maybe_contains(raw) and self._exact_contains(raw)
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class PackageReputationStore:
+    """包信譽查詢 - 黑名單優先於白名單，檔案被替換時自動重新載入"""
+
+    def __init__(self, list_dir: str, reload_interval: float = 5.0):
+        self.list_dir = list_dir
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._lists: Dict[str, Optional[CompiledPackageList]] = {name: None for name in LIST_NAMES}
+        self._stamps: Dict[str, Optional[tuple]] = {name: None for name in LIST_NAMES}
+        self._last_check = 0.0
+        self.reload(force=True)
+
+    def list_path(self, name: str) -> str:
+        return os.path.join(self.list_dir, f"{name}.bin")
+
+    def reload(self, force: bool = False):
+        """檢查清單檔案是否被替換，有變更時重新 mmap"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            for name in LIST_NAMES:
+                path = self.list_path(name)
+                try:
+                    stat = os.stat(path)
+                    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                except FileNotFoundError:
+                    stamp = None
+
+                if not force and stamp == self._stamps[name]:
+                    continue
+
+                compiled = None
+                if stamp is not None:
+                    try:
+                        compiled = CompiledPackageList(path)
+                        logger.info(f"✅ 包信譽清單已載入: {name} ({len(compiled)} 個包)")
+                    except (OSError, ValueError) as e:
+                        # 保留舊清單，下次檢查時重試
+                        logger.error(f"❌ 載入包信譽清單失敗 {path}: {e}")
+                        continue
+                # 舊的 mmap 交由 GC 釋放，避免關閉時其他執行緒仍在讀取
+                self._lists[name] = compiled
+                self._stamps[name] = stamp
+
+    def _maybe_reload(self):
+        if time.monotonic() - self._last_check >= self.reload_interval:
+            self.reload()
+
+    def status(self, package_id: str) -> Optional[str]:
+        """查詢包信譽：'blocked'、'allowed' 或 None（不在任何清單中）"""
+        raw = normalize_address(package_id)
+        if raw is None:
+            return None
+
+        self._maybe_reload()
+        blocklist = self._lists["blocklist"]
+        if blocklist is not None and blocklist.contains(raw):
+            return "blocked"
+        allowlist = self._lists["allowlist"]
+        if allowlist is not None and allowlist.contains(raw):
+            return "allowed"
+        return None
+
+    def is_blocked(self, package_id: str) -> bool:
+        return self.status(package_id) == "blocked"
+
+    def is_allowed(self, package_id: str) -> bool:
+        return self.status(package_id) == "allowed"
+
+    def stats(self) -> Dict:
+        self._maybe_reload()
+        return {
+            name: {
+                "packages": len(compiled) if compiled else 0,
+                "path": self.list_path(name),
+                "loaded": compiled is not None
+            }
+            for name, compiled in self._lists.items()
+        }
+
+
+_shared_store: Optional[PackageReputationStore] = None
+_shared_store_lock = threading.Lock()
+
+
+def get_package_reputation_store() -> PackageReputationStore:
+    """取得進程內共享的包信譽清單"""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                _shared_store = PackageReputationStore(
+                    os.getenv("PACKAGE_REPUTATION_DIR", "./package_reputation"),
+                    reload_interval=float(os.getenv("PACKAGE_REPUTATION_RELOAD_INTERVAL", "5"))
+                )
+    return _shared_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SuiGuard 包信譽清單")
+    parser.add_argument("--dir", type=str,
+                        default=os.getenv("PACKAGE_REPUTATION_DIR", "./package_reputation"),
+                        help="清單目錄 (default: ./package_reputation)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = subparsers.add_parser("compile", help="從文字清單編譯二進位清單")
+    compile_parser.add_argument("list_name", choices=LIST_NAMES, help="清單名稱")
+    compile_parser.add_argument("source", type=str, help="文字清單路徑（每行一個包地址）")
+    compile_parser.add_argument("--fp-rate", type=float, default=0.001,
+                                help="Bloom filter 誤判率 (default: 0.001)")
+
+    check_parser = subparsers.add_parser("check", help="查詢包信譽")
+    check_parser.add_argument("package_ids", nargs="+", help="包地址")
+
+    subparsers.add_parser("stats", help="查看清單統計")
+
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        output_path = os.path.join(args.dir, f"{args.list_name}.bin")
+        result = compile_list(read_list_file(args.source), output_path, false_positive_rate=args.fp_rate)
+        print(f"✅ 已編譯 {args.list_name}: {result['packages']} 個包 -> {output_path} ({result['size_bytes']} bytes)")
+        if result["invalid_lines"]:
+            print(f"⚠️ 略過 {result['invalid_lines']} 行無效地址")
+        return
+
+    store = PackageReputationStore(args.dir)
+    if args.command == "check":
+        for package_id in args.package_ids:
+            print(f"{package_id}: {store.status(package_id) or 'unknown'}")
+    elif args.command == "stats":
+        print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+import asyncio
 import re
 from datetime import datetime
 import json
 import aiohttp
 import os
+import time
 import logging
 
+from .similarity_index import ORIGIN_ML, get_similarity_index, VULNERABILITY_NAMES
+from .deployer_index import get_deployer_index, normalize_address
+from .package_reputation import get_package_reputation_store
+from .feature_store import get_feature_store, load_scoring_config, ML_LABELS, RISK_LEVELS, ANALYSIS_METHODS
+
 logger = logging.getLogger(__name__)
 
 class RiskEngine:
@@ -14,7 +21,7 @@ class RiskEngine:
     提供綜合性的安全風險評估和建議
     """
     
-    def __init__(self):
+    def __init__(self, scoring_config: Optional[Dict] = None):
         # ML 服務配置 (通過 HTTP 調用獨立服務)
         self.ml_service_url = os.getenv("ML_SERVICE_URL", "http://localhost:8081")
         self.ml_service_enabled = os.getenv("ENABLE_ML_SERVICE", "true").lower() == "true"
@@ -24,6 +31,16 @@ class RiskEngine:
         if self.ml_service_enabled:
             logger.info(f"🔗 ML 服務 URL: {self.ml_service_url}")
         
+        # 已知漏洞合約相似度索引 (調用 ML 前先查詢)
+        self.similarity_index_enabled = os.getenv("ENABLE_SIMILARITY_INDEX", "true").lower() == "true"
+        self.similarity_threshold = float(os.getenv("SIMILARITY_INDEX_THRESHOLD", "0.92"))
+        
+        # 評分權重與閾值 (可用 RISK_SCORING_CONFIG 指定 JSON 覆蓋)
+        self.scoring_config = scoring_config or load_scoring_config(os.getenv("RISK_SCORING_CONFIG") or None)
+        
+        # 特徵庫 (記錄每次分析的特徵供重新評分)
+        self.feature_store_enabled = os.getenv("ENABLE_FEATURE_STORE", "true").lower() == "true"
+        
         # 漏洞分類映射到風險分數區間 (100分制)
         self.vulnerability_score_ranges = {
             "access_control": (80, 100),    # 存取控制漏洞 - 高風險 (80-100分)
@@ -77,6 +94,13 @@ class RiskEngine:
             "0x0000000000000000000000000000000000000000000000000000000000000002",  # Sui framework
             "0x0000000000000000000000000000000000000000000000000000000000000003"   # Sui system
         }
+        
+        # 官方協議部署者地址 (逗號分隔)
+        self.official_deployers = {
+            normalize_address(address)
+            for address in os.getenv("OFFICIAL_DEPLOYER_ADDRESSES", "").split(",")
+            if normalize_address(address)
+        }
     
     def analyze_domain_risk(self, domain: str) -> Dict:
         """分析域名風險"""
@@ -167,10 +191,15 @@ class RiskEngine:
         }
     
     def analyze_package_risk(self, package_analyses: List[Dict]) -> Dict:
-        """分析智能合約包風險"""
+        """分析智能合約包風險
+
+        package_levels 為每個包自身證據（黑名單、危險函數）的風險等級，不含部署者信譽，
+        寫入部署者索引時使用，避免部署者信譽經由判定結果自我強化
+        """
         risk_score = 0.0
         reasons = []
         analyzed_count = 0
+        package_levels = {}
         
         for analysis in package_analyses:
             if analysis.get('status') != 'success':
@@ -178,30 +207,190 @@ class RiskEngine:
                 
             analyzed_count += 1
             pkg_analysis = analysis.get('analysis', {})
-            package_id = pkg_analysis.get('package_id', '')
+            package_id = pkg_analysis.get('package_id', '') or analysis.get('package_id', '')
             
             # 檢查是否為官方Sui包
             if package_id in self.official_sui_packages:
                 reasons.append("官方Sui套件 - 已驗證安全")
+                package_levels[package_id] = "SAFE"
+                continue
+            
+            # 包信譽清單（Bloom filter + mmap 排序陣列）
+            reputation = get_package_reputation_store().status(package_id) if package_id else None
+            if reputation == "blocked":
+                risk_score += 1.0
+                reasons.append(f"已知惡意包: {package_id[:10]}...")
+                package_levels[package_id] = "CRITICAL"
                 continue
+            if reputation == "allowed":
+                reasons.append(f"已審計包 (信譽白名單): {package_id[:10]}...")
+                package_levels[package_id] = "SAFE"
+                continue
+            
+            # 部署者信譽（記憶體索引查詢，不需 RPC）
+            deployer = self._resolve_deployer(analysis, package_id)
+            if deployer:
+                deployer_risk = self.analyze_deployer_risk(deployer, package_id)
+                reasons.extend(deployer_risk['reasons'])
+                if deployer_risk['official']:
+                    if package_id:
+                        package_levels[package_id] = "SAFE"
+                    continue
+                risk_score += deployer_risk['risk_score']
             
             # 分析危險函數
+            own_score = 0.0
             dangerous_functions = pkg_analysis.get('dangerous_functions', [])
             if len(dangerous_functions) > 10:
-                risk_score += 0.4
+                own_score = 0.4
                 reasons.append(f"檢測到大量危險函數: {len(dangerous_functions)}個")
             elif len(dangerous_functions) > 5:
-                risk_score += 0.2
+                own_score = 0.2
                 reasons.append(f"檢測到多個危險函數: {len(dangerous_functions)}個")
+            risk_score += own_score
+            if package_id:
+                package_levels[package_id] = self._rule_risk_level(own_score)
+        
+        return {
+            "risk_score": min(risk_score, 1.0),
+            "reasons": reasons,
+            "analyzed_packages": analyzed_count,
+            "package_levels": package_levels
+        }
+    
+    def _rule_risk_level(self, score: float) -> str:
+        """規則分數（0-1）對應的風險等級"""
+        if score >= self.scoring_config["rule_high_threshold"]:
+            return "HIGH"
+        if score >= self.scoring_config["rule_medium_threshold"]:
+            return "MEDIUM"
+        return "LOW"
+    
+    def _ml_risk_level(self, ml_classification: Optional[Dict]) -> Optional[str]:
+        """ML 判定（100 分制）對應的風險等級，無有效判定時返回 None"""
+        if not ml_classification or "error" in ml_classification or ml_classification.get('risk_score', 0) <= 0:
+            return None
+        ml_score_100 = ml_classification['risk_score']
+        if ml_score_100 >= self.scoring_config["ml_high_threshold"]:
+            return "HIGH"
+        if ml_score_100 >= self.scoring_config["ml_medium_threshold"]:
+            return "MEDIUM"
+        return "LOW"
+    
+    def _package_verdicts(self, package_analyses: List[Dict], package_levels: Dict[str, str],
+                         ml_classification: Optional[Dict] = None) -> Dict[str, str]:
+        """每個包自身的判定等級（寫入部署者索引用）
+
+        不使用整體請求的等級：整體等級常由域名、權限或其他包決定。
+        只有一個包時 ML 判定的就是該包的代碼，取規則與 ML 等級的較高者；多個包的代碼合併送 ML，無法歸屬，只用規則等級
+        """
+        verdicts = dict(package_levels)
+        analyzed = [a for a in package_analyses if a.get('status') == 'success']
+        ml_level = self._ml_risk_level(ml_classification)
+        if ml_level and len(analyzed) == 1:
+            package_id = analyzed[0].get('analysis', {}).get('package_id', '') or analyzed[0].get('package_id', '')
+            if package_id in verdicts and verdicts[package_id] != "SAFE":
+                verdicts[package_id] = max(verdicts[package_id], ml_level, key=RISK_LEVELS.index)
+        return verdicts
+    
+    def _resolve_deployer(self, analysis: Dict, package_id: str) -> Optional[str]:
+        """取得包的部署者：優先使用請求提供的地址，否則查詢部署者索引"""
+        deployer = analysis.get('deployer') or analysis.get('analysis', {}).get('deployer')
+        if deployer:
+            return deployer
+        if package_id:
+            return get_deployer_index().deployer_of(package_id)
+        return None
+    
+    def analyze_deployer_risk(self, deployer: str, package_id: str = "") -> Dict:
+        """分析部署者風險：官方協議部署者、新部署者、曾發佈高風險包的部署者"""
+        if normalize_address(deployer) in self.official_deployers:
+            return {
+                "risk_score": 0.0,
+                "reasons": [f"官方協議部署者: {deployer[:10]}..."],
+                "official": True
+            }
+        
+        risk_score = 0.0
+        reasons = []
+        deployer_index = get_deployer_index()
+        record = deployer_index.get(deployer)
+        
+        # 除當前包外沒有任何紀錄即視為新部署者
+        other_packages = 0
+        if record:
+            other_packages = record.package_count - (1 if deployer_index.deployer_of(package_id) == record.address else 0)
+        if other_packages <= 0:
+            risk_score += 0.2
+            reasons.append(f"新部署者: {deployer[:10]}... 無歷史發佈紀錄")
+        
+        prior_high_risk = deployer_index.prior_high_risk_count(deployer, exclude_package=package_id)
+        if prior_high_risk > 0:
+            risk_score += 0.4
+            reasons.append(f"部署者曾發佈 {prior_high_risk} 個高風險包")
         
         return {
             "risk_score": min(risk_score, 1.0),
             "reasons": reasons,
-            "analyzed_packages": analyzed_count
+            "official": False
+        }
+    
+    def record_deployer_verdicts(self, package_analyses: List[Dict], package_verdicts: Dict[str, str]):
+        """將每個包自身的判定等級寫入部署者索引（不在 package_verdicts 中的包不寫入）"""
+        try:
+            deployer_index = get_deployer_index()
+            for analysis in package_analyses:
+                if analysis.get('status') != 'success':
+                    continue
+                package_id = analysis.get('analysis', {}).get('package_id', '') or analysis.get('package_id', '')
+                risk_level = package_verdicts.get(package_id)
+                deployer = self._resolve_deployer(analysis, package_id)
+                if deployer and package_id and risk_level:
+                    deployer_index.record(deployer, package_id, risk_level)
+        except Exception as e:
+            logger.error(f"❌ 寫入部署者索引失敗: {e}")
+    
+    def find_blocked_packages(self, package_analyses: List[Dict]) -> List[str]:
+        """返回位於黑名單中的包地址"""
+        store = get_package_reputation_store()
+        blocked = []
+        for analysis in package_analyses:
+            package_id = analysis.get('package_id', '') or analysis.get('analysis', {}).get('package_id', '')
+            if package_id and store.is_blocked(package_id):
+                blocked.append(package_id)
+        return blocked
+    
+    def build_blocklist_verdict(self, blocked_packages: List[str], package_analyses: List[Dict]) -> Dict:
+        """已知惡意包直接判定為 CRITICAL（不取得源碼、不調用 ML）"""
+        reasons = [f"已知惡意包: {package_id}" for package_id in blocked_packages]
+        logger.warning(f"🚫 命中包黑名單: {len(blocked_packages)} 個包，直接判定 CRITICAL")
+        
+        return {
+            "risk_level": "CRITICAL",
+            "confidence": 1.0,
+            "reasons": reasons,
+            "recommendation": "Reject - Known malicious package (Blocklist)",
+            "risk_breakdown": {
+                "package_risk": 1.0,
+                "final_score": 1.0
+            },
+            "ml_analysis": None,
+            "details": {
+                "analyzed_packages": len(package_analyses),
+                "blocked_packages": blocked_packages,
+                "analysis_method": "package_blocklist",
+                "processing_time": 0.0,
+                "timestamp": datetime.now().isoformat()
+            }
         }
     
     def calculate_overall_risk(self, domain: str, permissions: List[str], package_analyses: List[Dict]) -> Dict:
         """綜合風險評估 - 主要方法"""
+        return self._calculate_rule_risk(domain, permissions, package_analyses)[0]
+    
+    def _calculate_rule_risk(self, domain: str, permissions: List[str], package_analyses: List[Dict]) -> Tuple[Dict, Dict]:
+        """規則引擎評估，同時返回未四捨五入的各項分數（寫入特徵庫用）"""
+        config = self.scoring_config
         
         # 各項風險分析
         domain_risk = self.analyze_domain_risk(domain)
@@ -210,9 +399,9 @@ class RiskEngine:
         
         # 計算加權風險分數
         # 域名風險權重最高，因為惡意域名通常是最明顯的危險信號
-        domain_weight = 0.5
-        permission_weight = 0.3
-        package_weight = 0.2
+        domain_weight = config["domain_weight"]
+        permission_weight = config["permission_weight"]
+        package_weight = config["package_weight"]
         
         weighted_risk = (
             domain_risk['risk_score'] * domain_weight +
@@ -228,7 +417,7 @@ class RiskEngine:
         )
         
         # 使用加權平均和最高個別風險的較大值
-        total_risk = max(weighted_risk, max_individual_risk * 0.8)
+        total_risk = max(weighted_risk, max_individual_risk * config["max_individual_factor"])
         
         # 合併所有風險原因
         all_reasons = (
@@ -238,16 +427,22 @@ class RiskEngine:
         )
         
         # 確定風險等級和建議
-        if total_risk >= 0.7:
+        if total_risk >= config["rule_high_threshold"]:
             risk_level = "HIGH"
             recommendation = "拒絕 - 檢測到高安全風險"
-        elif total_risk >= 0.4:
+        elif total_risk >= config["rule_medium_threshold"]:
             risk_level = "MEDIUM" 
             recommendation = "警告 - 請謹慎處理"
         else:
             risk_level = "LOW"
             recommendation = "批准 - 檢測到低風險"
         
+        rule_features = {
+            "domain_risk": domain_risk['risk_score'],
+            "permission_risk": permission_risk['risk_score'],
+            "package_risk": package_risk['risk_score']
+        }
+        
         return {
             "risk_level": risk_level,
             "confidence": round(total_risk, 2),
@@ -262,10 +457,11 @@ class RiskEngine:
             },
             "details": {
                 "analyzed_packages": package_risk['analyzed_packages'],
+                "package_risk_levels": package_risk['package_levels'],
                 "high_risk_permissions": permission_risk.get('high_risk_permissions', 0),
                 "timestamp": datetime.now().isoformat()
             }
-        }
+        }, rule_features
 
     async def classify_smart_contract_vulnerability(self, move_code: str) -> Dict:
         """
@@ -440,21 +636,134 @@ class RiskEngine:
         else:
             return "SAFE", "✅ 批准 - 未檢測到明顯風險 (ML分析)", normalized_score
 
+    def lookup_similar_contract(self, move_code: str) -> Optional[Dict]:
+        """
+        查詢已知漏洞合約索引，若有足夠相似的合約則直接返回判定結果（不調用 ML）
+        返回格式與 ML 服務一致，並附上最相近合約的資訊
+        """
+        if not self.similarity_index_enabled:
+            return None
+        
+        try:
+            start_time = time.time()
+            matches = get_similarity_index().query(move_code, k=1)
+            if not matches or matches[0]["similarity"] < self.similarity_threshold:
+                return None
+            
+            nearest = matches[0]
+            label = nearest["label"]
+            similarity = nearest["similarity"]
+            risk_score = nearest.get("risk_score") or 90
+            
+            if risk_score >= 70:
+                risk_level = "HIGH"
+            elif risk_score >= 40:
+                risk_level = "MEDIUM"
+            else:
+                risk_level = "LOW"
+            
+            logger.info(f"🎯 相似度索引命中: {label} (相似度: {similarity:.3f}, 來源: {nearest['source']})")
+            
+            return {
+                "classification": label,
+                "vulnerability_type": VULNERABILITY_NAMES.get(label, label),
+                "probabilities": {label: round(similarity, 4)},
+                "max_probability": round(similarity, 4),
+                "risk_score": risk_score,
+                "risk_level": risk_level,
+                "reasoning": f"與已知漏洞合約 {nearest['source']} 高度相似 (相似度 {similarity:.2f})",
+                "model_version": "similarity-index",
+                "processing_time": round(time.time() - start_time, 2),
+                "analysis_source": "similarity_index",
+                "nearest_contract": {
+                    "source": nearest["source"],
+                    "label": label,
+                    "similarity": round(similarity, 4)
+                }
+            }
+        except Exception as e:
+            logger.error(f"❌ 相似度索引查詢失敗: {e}")
+            return None
+    
+    def record_ml_verdict(self, move_code: str, ml_result: Dict, package_analyses: List[Dict]):
+        """將 ML 判定為漏洞的合約以 ml 來源追加到相似度索引（未經確認，不參與比對；以 CLI confirm 確認後才參與）"""
+        if not self.similarity_index_enabled:
+            return
+        
+        classification = ml_result.get("classification", "safe")
+        if classification == "safe" or "error" in ml_result or ml_result.get("service_status") == "disabled":
+            return
+        
+        try:
+            package_ids = [a.get("package_id") for a in package_analyses if a.get("package_id")]
+            source = ",".join(package_ids) if package_ids else f"ml_verdict:{datetime.now().isoformat()}"
+            if get_similarity_index().add(move_code, classification, source, risk_score=ml_result.get("risk_score"),
+                                          origin=ORIGIN_ML):
+                logger.info(f"📥 已加入相似度索引: {classification} ({source})")
+        except Exception as e:
+            logger.error(f"❌ 寫入相似度索引失敗: {e}")
+
+    def record_features(self, domain: str, package_analyses: List[Dict], result: Dict, rule_features: Dict,
+                        ml_classification: Optional[Dict], analysis_method: str, final_score: float = 1.0):
+        """將本次分析的特徵與 ML 原始輸出寫入特徵庫（供調整權重後重新評分）"""
+        if not self.feature_store_enabled:
+            return
+        
+        try:
+            features = {
+                "timestamp": time.time(),
+                **rule_features,
+                "analysis_method": ANALYSIS_METHODS.index(analysis_method),
+                "risk_level": RISK_LEVELS.index(result["risk_level"]),
+                "final_score": final_score
+            }
+            if ml_classification:
+                probabilities = ml_classification.get('probabilities', {})
+                features.update({
+                    "ml_available": 1,
+                    "ml_risk_score": ml_classification.get('risk_score', 0),
+                    "ml_confidence": ml_classification.get('confidence', 0),
+                    "ml_max_probability": ml_classification.get('max_probability', 0),
+                    **{f"prob_{label}": probabilities.get(label, 0) for label in ML_LABELS}
+                })
+            
+            package_ids = [a.get('package_id') for a in package_analyses if a.get('package_id')]
+            get_feature_store().append(features, {"domain": domain, "package_ids": package_ids})
+        except Exception as e:
+            logger.error(f"❌ 寫入特徵庫失敗: {e}")
+    
     async def analyze_with_ml_integration(self, domain: str, permissions: List[str], 
                                         package_analyses: List[Dict], move_source_code: str = "") -> Dict:
         """
         結合規則引擎和機器學習的綜合風險分析
         """
+        # 已知惡意包直接短路
+        blocked_packages = self.find_blocked_packages(package_analyses)
+        if blocked_packages:
+            verdict = self.build_blocklist_verdict(blocked_packages, package_analyses)
+            # 只有黑名單中的包記為 CRITICAL，同一請求中的其他包沒有經過分析，不寫入
+            self.record_deployer_verdicts(package_analyses, {package_id: "CRITICAL" for package_id in blocked_packages})
+            self.record_features(domain, package_analyses, verdict, {}, None, "package_blocklist")
+            return verdict
+        
+        config = self.scoring_config
+        rule_features = {}
         try:
             # 基礎規則引擎分析
-            rule_based_analysis = self.calculate_overall_risk(domain, permissions, package_analyses)
+            rule_based_analysis, rule_features = self._calculate_rule_risk(domain, permissions, package_analyses)
             
             # 機器學習智能合約漏洞分類
             ml_classification = None
             ml_risk_score = 0.0
             
             if move_source_code.strip():
-                ml_classification = await self.classify_smart_contract_vulnerability(move_source_code)
+                # 先查詢已知漏洞合約索引，命中時不調用 ML
+                ml_classification = self.lookup_similar_contract(move_source_code)
+                if ml_classification is None:
+                    ml_classification = await self.classify_smart_contract_vulnerability(move_source_code)
+                    # 特徵化與索引寫入在執行緒中進行，不阻塞事件迴圈
+                    await asyncio.to_thread(self.record_ml_verdict, move_source_code, ml_classification,
+                                            package_analyses)
                 # 使用新的100分制風險分數 (轉換為0-1範圍)
                 ml_risk_score = ml_classification.get('risk_score', 0) / 100.0
             
@@ -462,16 +771,16 @@ class RiskEngine:
             rule_risk_score = rule_based_analysis['risk_breakdown']['final_score']
             
             # 計算綜合風險分數
-            if ml_classification and ml_classification.get('confidence', 0) > 0.3:
+            if ml_classification and ml_classification.get('confidence', 0) > config["ml_confidence_threshold"]:
                 # ML 分類可信度高時，給予更高權重
-                final_risk_score = (ml_risk_score * 0.6) + (rule_risk_score * 0.4)
+                final_risk_score = (ml_risk_score * config["ml_weight"]) + (rule_risk_score * config["rule_weight"])
                 confidence_boost = 0.1
                 # 使用 ML 100 分制風險分數判斷等級
                 ml_score_100 = ml_classification.get('risk_score', 0)
-                if ml_score_100 >= 70:
+                if ml_score_100 >= config["ml_high_threshold"]:
                     risk_level = "HIGH"
                     recommendation = "Reject - High security risk detected (ML+Rules)"
-                elif ml_score_100 >= 40:
+                elif ml_score_100 >= config["ml_medium_threshold"]:
                     risk_level = "MEDIUM"
                     recommendation = "Warning - Please proceed with caution (ML+Rules)"
                 else:
@@ -479,15 +788,16 @@ class RiskEngine:
                     recommendation = "Approve - Low risk detected (ML+Rules)"
             else:
                 # ML 分類不可用或可信度低時，主要依賴規則引擎
-                final_risk_score = (rule_risk_score * 0.8) + (ml_risk_score * 0.2)
+                final_risk_score = ((rule_risk_score * config["rule_weight_low_confidence"]) +
+                                    (ml_risk_score * config["ml_weight_low_confidence"]))
                 confidence_boost = 0.0
                 # 如果有 ML 分數，使用 ML 100 分制判斷（即使信心度低）
                 if ml_classification and ml_classification.get('risk_score', 0) > 0:
                     ml_score_100 = ml_classification.get('risk_score', 0)
-                    if ml_score_100 >= 70:
+                    if ml_score_100 >= config["ml_high_threshold"]:
                         risk_level = "HIGH"
                         recommendation = "Reject - High security risk detected (ML+Rules)"
-                    elif ml_score_100 >= 40:
+                    elif ml_score_100 >= config["ml_medium_threshold"]:
                         risk_level = "MEDIUM"
                         recommendation = "Warning - Please proceed with caution (ML+Rules)"
                     else:
@@ -495,10 +805,10 @@ class RiskEngine:
                         recommendation = "Approve - Low risk detected (ML+Rules)"
                 else:
                     # 純規則引擎判斷
-                    if final_risk_score >= 0.7:
+                    if final_risk_score >= config["rule_high_threshold"]:
                         risk_level = "HIGH"
                         recommendation = "Reject - High security risk detected (Rules)"
-                    elif final_risk_score >= 0.4:
+                    elif final_risk_score >= config["rule_medium_threshold"]:
                         risk_level = "MEDIUM"
                         recommendation = "Warning - Please proceed with caution (Rules)"
                     else:
@@ -513,7 +823,10 @@ class RiskEngine:
                     f"(confidence: {ml_classification.get('confidence', 0):.2f})"
                 )
             
-            return {
+            self.record_deployer_verdicts(package_analyses, self._package_verdicts(
+                package_analyses, rule_based_analysis['details']['package_risk_levels'], ml_classification))
+            
+            result = {
                 "risk_level": risk_level,
                 "confidence": round(final_risk_score + confidence_boost, 2),
                 "reasons": all_reasons,
@@ -533,10 +846,16 @@ class RiskEngine:
                     "processing_time": ml_classification.get('processing_time', 0) if ml_classification else 0
                 }
             }
+            self.record_features(domain, package_analyses, result, rule_features, ml_classification,
+                                 "hybrid_ml_rules", final_risk_score)
+            return result
             
         except Exception as e:
             # 如果ML分析失敗，回退到純規則引擎
-            rule_analysis = self.calculate_overall_risk(domain, permissions, package_analyses)
+            rule_analysis, rule_features = self._calculate_rule_risk(domain, permissions, package_analyses)
             rule_analysis['details']['ml_analysis_error'] = str(e)
             rule_analysis['details']['analysis_method'] = "rules_only_fallback"
+            self.record_deployer_verdicts(package_analyses, rule_analysis['details']['package_risk_levels'])
+            self.record_features(domain, package_analyses, rule_analysis, rule_features, None,
+                                 "rules_only_fallback", rule_analysis['risk_breakdown']['final_score'])
             return rule_analysis
@@ -0,0 +1,587 @@
+"""
+已知漏洞合約相似度索引
+將 Move 代碼（源代碼或 normalized modules 轉出的文本）轉為特徵向量，
+以 NumPy 實作 flat / IVF 檢索，向量以 memory-map 方式從磁碟載入
+
+使用範例:
+  # 從訓練數據集建立索引（IVF 16 個分區）
+  python services/similarity_index.py build --dataset ml/contract_bug_dataset.jsonl --ivf-lists 16
+
+  # 查詢最相近的已知漏洞合約
+  python services/similarity_index.py query --file my_contract.move
+
+  # 覆核 ML 判定寫入的紀錄：列出待覆核、確認（可修正標籤）或駁回
+  python services/similarity_index.py pending
+  python services/similarity_index.py confirm 0x1234... --label capability_leak
+  python services/similarity_index.py reject 0x5678...
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 數據集輸出文字到 ML 服務分類標籤的映射
+DATASET_LABELS = {
+    "resource leak": "resource_leak",
+    "arithmetic overflow": "arithmetic_overflow",
+    "unchecked return": "unchecked_return",
+    "cross-module pollution": "cross_module_pollution",
+    "capability leak": "capability_leak",
+}
+
+# 漏洞類型的中文名稱（與 ML 服務一致）
+VULNERABILITY_NAMES = {
+    "capability_leak": "Capability Leak (權限洩漏)",
+    "arithmetic_overflow": "Arithmetic Overflow (算術溢位)",
+    "cross_module_pollution": "Cross-Module Pollution (跨模組污染)",
+    "unchecked_return": "Unchecked Return (未檢查返回值)",
+    "resource_leak": "Resource Leak (資源洩漏)",
+    "safe": "未發現明顯漏洞"
+}
+
+# 索引紀錄的來源：只有經確認的紀錄（數據集標註、人工覆核確認）參與比對；ML 自己的判定只保存供人工覆核，
+# 否則誤報會被索引命中後再次當成判定結果，自我強化
+ORIGIN_DATASET = "dataset"
+ORIGIN_ML = "ml"
+ORIGIN_REVIEWED = "reviewed"
+ORIGIN_REJECTED = "rejected"
+
+REVIEW_ACTIONS = {"confirm": ORIGIN_REVIEWED, "reject": ORIGIN_REJECTED}
+
+# 攤銷追加成本：緩衝區倍增擴充；新紀錄先以 flat 方式檢索，累積到一定數量才重建 IVF 倒排表
+_MIN_CAPACITY = 64
+_MIN_PENDING_ROWS = 256
+
+_COMMENT_PATTERN = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+_NUMBER_PATTERN = re.compile(r"\b0x[0-9a-fA-F]+\b|\b\d+(?:u8|u16|u32|u64|u128|u256)?\b")
+_STRING_PATTERN = re.compile(r'b?"(?:[^"\\]|\\.)*"')
+_TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|::|[-+*/%<>=!&|^]=?|[{}()\[\];,.:]")
+
+
+def entry_origin(entry: Dict) -> str:
+    """紀錄的來源（舊版紀錄沒有 origin 欄位：ML 判定的來源為 package ID 或 ml_verdict:時間）"""
+    origin = entry.get("origin")
+    if origin:
+        return origin
+    source = entry.get("source", "")
+    return ORIGIN_ML if source.startswith(("0x", "ml_verdict:")) else ORIGIN_DATASET
+
+
+def is_confirmed(entry: Dict) -> bool:
+    """紀錄是否參與比對（未覆核或已駁回的 ML 判定不參與）"""
+    return entry_origin(entry) not in (ORIGIN_ML, ORIGIN_REJECTED)
+
+
+def _grow(buffer: np.ndarray, size: int) -> np.ndarray:
+    """容量不足時以倍增方式換成新的緩衝區（不修改原緩衝區，舊快照仍可讀取）"""
+    if len(buffer) >= size:
+        return buffer
+    grown = np.zeros(max(size, 2 * len(buffer), _MIN_CAPACITY), dtype=buffer.dtype)
+    grown[:len(buffer)] = buffer
+    return grown
+
+
+def label_from_dataset_output(output: str) -> Optional[str]:
+    """從數據集的 output 欄位解析漏洞標籤，未發現漏洞時返回 'safe'"""
+    output_lower = output.lower()
+    for keyword, label in DATASET_LABELS.items():
+        if keyword in output_lower:
+            return label
+    if "未發現" in output or "安全" in output:
+        return "safe"
+    return None
+
+
+class ContractSimilarityIndex:
+    """已知漏洞合約相似度索引
+
+    磁碟格式（index_dir 下）:
+      manifest.json     維度、筆數、IVF 分區數
+      vectors.f32       N x dim float32，依列號寫入，尾端可能有倍增預留的零填充（以筆數為準）
+      assignments.i32   每筆向量所屬的 IVF 分區（僅 IVF 模式）
+      centroids.f32     IVF 分區中心 L x dim
+      entries.jsonl     每筆向量的標籤與來源（origin 為 dataset 或 ml）
+      reviews.jsonl     人工覆核紀錄（列號、confirm/reject、修正後標籤），僅追加寫入
+
+    寫入在鎖內替換陣列參考或寫入快照筆數之後的位置，查詢先在鎖內取得同一版本的參考再於鎖外計算。
+    覆核紀錄由 CLI 寫入，執行中的服務依 reviews.jsonl 的 mtime 重新套用
+    """
+
+    def __init__(self, index_dir: str, dim: int = 1024, n_probe: int = 4, reload_interval: float = 5.0):
+        self.index_dir = index_dir
+        self.dim = dim
+        self.n_probe = n_probe
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._count = 0
+        self._vector_capacity = 0
+        self._vectors = None
+        self._entries: List[Dict] = []
+        self._confirmed = np.zeros(0, dtype=bool)  # 每筆紀錄是否參與比對（容量緩衝區，前 _count 筆有效）
+        self._centroids = None
+        self._assignments = None
+        self._list_order = None
+        self._list_offsets = None
+        self._indexed_count = 0  # 已納入倒排表的筆數，之後的紀錄以 flat 方式檢索
+        self._reviews_stamp = None
+        self._reviews_offset = 0
+        self._last_review_check = 0.0
+        self.load()
+
+    # ------------------------------------------------------------------
+    # 特徵
+    # ------------------------------------------------------------------
+
+    def featurize(self, code: str) -> np.ndarray:
+        """將 Move 代碼轉為 L2 正規化的特徵向量（token 1-3 gram 特徵雜湊）"""
+        text = _COMMENT_PATTERN.sub(" ", code)
+        text = _STRING_PATTERN.sub(" STR ", text)
+        text = _NUMBER_PATTERN.sub(" NUM ", text)
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not tokens:
+            return vector
+
+        counts: Dict[str, int] = {}
+        for n in (1, 2, 3):
+            for i in range(len(tokens) - n + 1):
+                gram = " ".join(tokens[i:i + n])
+                counts[gram] = counts.get(gram, 0) + 1
+
+        for gram, count in counts.items():
+            digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = 1.0 if value & 1 else -1.0
+            vector[(value >> 1) % self.dim] += sign * (1.0 + np.log(count))
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    # ------------------------------------------------------------------
+    # 載入與保存
+    # ------------------------------------------------------------------
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def load(self):
+        """從磁碟載入索引（向量使用 memory-map）"""
+        manifest_path = self._path("manifest.json")
+        if not os.path.exists(manifest_path):
+            return
+
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        self.dim = manifest["dim"]
+        with open(self._path("entries.jsonl"), "r", encoding="utf-8") as f:
+            self._entries = [json.loads(line) for line in f if line.strip()]
+
+        # 以向量檔實際大小為準，避免部分寫入的尾端紀錄（預留的零填充由 entries 筆數截掉）
+        self._vector_capacity = os.path.getsize(self._path("vectors.f32")) // (self.dim * 4)
+        self._count = min(len(self._entries), self._vector_capacity)
+        self._entries = self._entries[:self._count]
+        self._confirmed = np.array([is_confirmed(entry) for entry in self._entries], dtype=bool)
+        self._remap_vectors()
+
+        if manifest.get("ivf_lists", 0) > 0:
+            self._centroids = np.fromfile(self._path("centroids.f32"), dtype=np.float32).reshape(-1, self.dim)
+            self._assignments = np.fromfile(self._path("assignments.i32"), dtype=np.int32)[:self._count]
+            self._rebuild_inverted_lists()
+
+        self._reload_reviews()
+        logger.info(f"✅ 相似度索引已載入: {self._count} 筆, IVF 分區={self.ivf_lists}")
+
+    def _remap_vectors(self):
+        """映射整個向量檔（含預留容量），只在檔案擴充時重新映射"""
+        if self._vector_capacity > 0:
+            self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r",
+                                      shape=(self._vector_capacity, self.dim))
+        else:
+            self._vectors = None
+
+    def _rebuild_inverted_lists(self):
+        assignments = self._assignments[:self._count]
+        self._list_order = np.argsort(assignments, kind="stable")
+        self._list_offsets = np.searchsorted(
+            assignments[self._list_order], np.arange(len(self._centroids) + 1)
+        )
+        self._indexed_count = self._count
+
+    def _write_manifest(self):
+        manifest = {
+            "dim": self.dim,
+            "count": self._count,
+            "ivf_lists": self.ivf_lists,
+            "updated_at": datetime.now().isoformat()
+        }
+        tmp_path = self._path("manifest.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self._path("manifest.json"))
+
+    @property
+    def ivf_lists(self) -> int:
+        return 0 if self._centroids is None else len(self._centroids)
+
+    def __len__(self) -> int:
+        return self._count
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+
+    def add(self, code: str, label: str, source: str, risk_score: Optional[int] = None,
+            origin: str = ORIGIN_DATASET) -> bool:
+        """追加一筆已標記的合約，若已有幾乎相同的向量則跳過
+
+        經確認的紀錄只與其他經確認的紀錄比較是否重複（已有相同的 ML 紀錄時仍會寫入）
+
+        Returns:
+            是否實際寫入
+        """
+        vector = self.featurize(code)
+        if not vector.any():
+            return False
+
+        confirmed = origin != ORIGIN_ML
+        with self._lock:
+            nearest = self._search(vector, 1, self._snapshot(), include_unconfirmed=not confirmed)
+            if nearest and nearest[0]["similarity"] >= 0.999:
+                return False
+
+            os.makedirs(self.index_dir, exist_ok=True)
+            entry = {
+                "label": label,
+                "source": source,
+                "origin": origin,
+                "risk_score": risk_score,
+                "added_at": datetime.now().isoformat()
+            }
+
+            # 依列號寫入（覆蓋上次中斷留下的半筆向量）；容量不足時倍增擴充檔案並重新映射
+            row = self._count
+            grown = row >= self._vector_capacity
+            fd = os.open(self._path("vectors.f32"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if grown:
+                    self._vector_capacity = max(2 * self._vector_capacity, _MIN_CAPACITY)
+                    os.ftruncate(fd, self._vector_capacity * self.dim * 4)
+                os.pwrite(fd, vector.astype(np.float32).tobytes(), row * self.dim * 4)
+            finally:
+                os.close(fd)
+            with open(self._path("entries.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+            if self._centroids is not None:
+                assignment = np.int32(np.argmax(self._centroids @ vector))
+                fd = os.open(self._path("assignments.i32"), os.O_WRONLY | os.O_CREAT, 0o644)
+                try:
+                    os.pwrite(fd, assignment.tobytes(), row * 4)
+                finally:
+                    os.close(fd)
+                self._assignments = _grow(self._assignments, row + 1)
+                self._assignments[row] = assignment
+
+            self._entries.append(entry)
+            self._confirmed = _grow(self._confirmed, row + 1)
+            self._confirmed[row] = confirmed
+            self._count += 1
+            if grown:
+                self._remap_vectors()
+            if self._centroids is not None and \
+                    self._count - self._indexed_count >= max(_MIN_PENDING_ROWS, self._indexed_count // 8):
+                self._rebuild_inverted_lists()
+            self._write_manifest()
+
+        return True
+
+    def build_ivf(self, n_lists: int, n_iter: int = 20, seed: int = 0):
+        """以球面 k-means 建立 IVF 分區（n_lists=0 表示回到 flat 模式）"""
+        with self._lock:
+            if n_lists <= 0 or self._count == 0:
+                self._centroids = None
+                self._assignments = None
+                for name in ("centroids.f32", "assignments.i32"):
+                    if os.path.exists(self._path(name)):
+                        os.remove(self._path(name))
+                self._write_manifest()
+                return
+
+            vectors = np.asarray(self._vectors[:self._count])
+            n_lists = min(n_lists, self._count)
+            rng = np.random.default_rng(seed)
+            centroids = vectors[rng.choice(self._count, n_lists, replace=False)].copy()
+
+            for _ in range(n_iter):
+                assignments = np.argmax(vectors @ centroids.T, axis=1)
+                for list_id in range(n_lists):
+                    members = vectors[assignments == list_id]
+                    if len(members):
+                        centroid = members.sum(axis=0)
+                        centroids[list_id] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+            self._centroids = centroids.astype(np.float32)
+            self._assignments = np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+            self._centroids.tofile(self._path("centroids.f32"))
+            self._assignments.tofile(self._path("assignments.i32"))
+            self._rebuild_inverted_lists()
+            self._write_manifest()
+
+    # ------------------------------------------------------------------
+    # 人工覆核
+    # ------------------------------------------------------------------
+
+    def _apply_reviews(self, records: List[Dict]):
+        """套用覆核紀錄（呼叫端須持有鎖）；以新的 _confirmed 陣列替換參考"""
+        confirmed = self._confirmed.copy()
+        for record in records:
+            row = record.get("row")
+            origin = REVIEW_ACTIONS.get(record.get("action"))
+            if origin is None or not isinstance(row, int) or not 0 <= row < self._count:
+                continue
+            entry = {**self._entries[row], "origin": origin, "reviewed_at": record.get("reviewed_at")}
+            label = record.get("label")
+            if label and label != entry["label"]:
+                entry.setdefault("ml_label", entry["label"])
+                entry["label"] = label
+            self._entries[row] = entry
+            confirmed[row] = is_confirmed(entry)
+        self._confirmed = confirmed
+
+    def _reload_reviews(self):
+        """讀取 reviews.jsonl 新追加的覆核紀錄（檔案變短時從頭重新套用）"""
+        path = self._path("reviews.jsonl")
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._reviews_stamp:
+            return
+
+        with self._lock:
+            offset = self._reviews_offset if stat.st_size >= self._reviews_offset else 0
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            # 只處理完整的行，寫入中的尾端留待下次
+            complete = data[:data.rfind(b"\n") + 1]
+            records = []
+            for line in complete.decode("utf-8").splitlines():
+                if line.strip():
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        logger.warning(f"⚠️ 略過無法解析的覆核紀錄: {line[:80]}")
+            self._apply_reviews(records)
+            self._reviews_offset = offset + len(complete)
+            self._reviews_stamp = stamp
+        if records:
+            logger.info(f"🔄 已套用 {len(records)} 筆相似度索引覆核紀錄")
+
+    def _maybe_reload_reviews(self):
+        if time.monotonic() - self._last_review_check >= self.reload_interval:
+            self._last_review_check = time.monotonic()
+            self._reload_reviews()
+
+    def pending(self) -> List[Dict]:
+        """待覆核的 ML 判定紀錄"""
+        self._reload_reviews()
+        with self._lock:
+            entries = self._entries[:self._count]
+        return [{**entry, "row": row} for row, entry in enumerate(entries) if entry_origin(entry) == ORIGIN_ML]
+
+    def review(self, sources: List[str], action: str, label: Optional[str] = None) -> List[int]:
+        """確認或駁回 ML 判定寫入的紀錄
+
+        sources 可為紀錄的完整來源或其中一個 package ID；確認後的紀錄參與比對，label 可修正 ML 的標籤
+
+        Returns:
+            實際覆核的列號
+        """
+        if action not in REVIEW_ACTIONS:
+            raise ValueError(f"Unknown review action: {action}")
+        self._reload_reviews()
+
+        targets = set(sources)
+        reviewed_at = datetime.now().isoformat()
+        with self._lock:
+            records = []
+            for row, entry in enumerate(self._entries[:self._count]):
+                if entry_origin(entry) == ORIGIN_DATASET:
+                    continue
+                if entry["source"] not in targets and not targets.intersection(entry["source"].split(",")):
+                    continue
+                if entry_origin(entry) == REVIEW_ACTIONS[action] and (label is None or label == entry["label"]):
+                    continue
+                record = {"row": row, "action": action, "reviewed_at": reviewed_at}
+                if label:
+                    record["label"] = label
+                records.append(record)
+            if not records:
+                return []
+
+            with open(self._path("reviews.jsonl"), "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                f.flush()
+                self._reviews_offset = f.tell()
+            self._reviews_stamp = None
+            self._apply_reviews(records)
+        return [record["row"] for record in records]
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+
+    def _snapshot(self) -> Tuple:
+        """目前版本的陣列參考（呼叫端須持有鎖）；add 只寫入快照筆數之後的位置或替換參考，鎖外讀取仍一致"""
+        return (self._count, self._vectors, self._entries, self._confirmed, self._centroids,
+                self._list_order, self._list_offsets, self._indexed_count)
+
+    def _search(self, vector: np.ndarray, k: int, snapshot: Tuple, include_unconfirmed: bool = False) -> List[Dict]:
+        count, vectors, entries, confirmed, centroids, list_order, list_offsets, indexed_count = snapshot
+        if count == 0:
+            return []
+
+        if centroids is not None:
+            probes = np.argsort(-(centroids @ vector))[:self.n_probe]
+            # 上次重建倒排表之後新增的紀錄尚未分區，全部納入比對
+            rows = np.concatenate([list_order[list_offsets[p]:list_offsets[p + 1]] for p in probes] +
+                                  [np.arange(indexed_count, count)])
+            rows.sort()
+        else:
+            rows = np.arange(count)
+        if not include_unconfirmed:
+            rows = rows[confirmed[rows]]
+        if len(rows) == 0:
+            return []
+        similarities = vectors[rows] @ vector
+
+        top = np.argsort(-similarities)[:k]
+        return [
+            {**entries[int(rows[i])], "similarity": float(similarities[i]), "row": int(rows[i])}
+            for i in top
+        ]
+
+    def query(self, code: str, k: int = 1, include_unconfirmed: bool = False) -> List[Dict]:
+        """查詢最相近的 k 筆已知合約（預設只比對經確認的紀錄，include_unconfirmed 時包含 ML 判定）"""
+        vector = self.featurize(code)
+        if not vector.any():
+            return []
+        self._maybe_reload_reviews()
+        with self._lock:
+            snapshot = self._snapshot()
+        return self._search(vector, k, snapshot, include_unconfirmed)
+
+
+_shared_index: Optional[ContractSimilarityIndex] = None
+_shared_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> ContractSimilarityIndex:
+    """取得進程內共享的索引實例（RiskEngine 每次請求都會重新建立，索引需要共享）"""
+    global _shared_index
+    if _shared_index is None:
+        with _shared_index_lock:
+            if _shared_index is None:
+                _shared_index = ContractSimilarityIndex(
+                    index_dir=os.getenv("SIMILARITY_INDEX_DIR", "./similarity_index"),
+                    n_probe=int(os.getenv("SIMILARITY_INDEX_NPROBE", "4")),
+                    reload_interval=float(os.getenv("SIMILARITY_INDEX_RELOAD_INTERVAL", "5"))
+                )
+    return _shared_index
+
+
+def build_from_dataset(index: ContractSimilarityIndex, dataset_path: str) -> int:
+    """將數據集中的漏洞樣本寫入索引（未發現漏洞的樣本略過）"""
+    added = 0
+    with open(dataset_path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("//") or line.startswith("#"):
+                continue
+            try:
+                sample = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            label = label_from_dataset_output(sample.get("output", ""))
+            if label is None or label == "safe":
+                continue
+
+            source = f"{os.path.basename(dataset_path)}:{line_num}"
+            if index.add(sample["input"], label, source, risk_score=90):
+                added += 1
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SuiGuard 已知漏洞合約相似度索引")
+    parser.add_argument("--index-dir", type=str,
+                        default=os.getenv("SIMILARITY_INDEX_DIR", "./similarity_index"),
+                        help="索引目錄 (default: ./similarity_index)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="從數據集建立或追加索引")
+    build_parser.add_argument("--dataset", type=str, default="ml/contract_bug_dataset.jsonl",
+                              help="數據集路徑 (default: ml/contract_bug_dataset.jsonl)")
+    build_parser.add_argument("--ivf-lists", type=int, default=0,
+                              help="IVF 分區數，0 表示 flat 檢索 (default: 0)")
+
+    query_parser = subparsers.add_parser("query", help="查詢相近合約")
+    query_parser.add_argument("--file", type=str, required=True, help="Move 源代碼檔案")
+    query_parser.add_argument("-k", type=int, default=3, help="返回筆數 (default: 3)")
+    query_parser.add_argument("--include-unconfirmed", action="store_true",
+                              help="包含 ML 判定寫入、未經確認的紀錄（供人工覆核）")
+
+    subparsers.add_parser("pending", help="列出待覆核的 ML 判定紀錄")
+
+    for action, help_text in (("confirm", "確認 ML 判定紀錄，之後參與比對"),
+                              ("reject", "駁回 ML 判定紀錄，不再列為待覆核")):
+        review_parser = subparsers.add_parser(action, help=help_text)
+        review_parser.add_argument("sources", nargs="+", help="紀錄來源或其中的 package ID")
+        if action == "confirm":
+            review_parser.add_argument("--label", type=str, default=None,
+                                       choices=[label for label in VULNERABILITY_NAMES if label != "safe"],
+                                       help="修正後的漏洞標籤（預設沿用 ML 判定）")
+
+    args = parser.parse_args()
+    index = ContractSimilarityIndex(args.index_dir)
+
+    if args.command == "build":
+        added = build_from_dataset(index, args.dataset)
+        index.build_ivf(args.ivf_lists)
+        print(f"✅ 新增 {added} 筆，索引共 {len(index)} 筆 (IVF 分區: {index.ivf_lists})")
+    elif args.command == "query":
+        with open(args.file, "r", encoding="utf-8") as f:
+            code = f.read()
+        for match in index.query(code, k=args.k, include_unconfirmed=args.include_unconfirmed):
+            print(f"{match['similarity']:.4f}  {match['label']:<24} {entry_origin(match):<8} {match['source']}")
+    elif args.command == "pending":
+        entries = index.pending()
+        for entry in entries:
+            print(f"{entry['row']:>6}  {entry['label']:<24} {entry.get('risk_score') or '-':>4}  "
+                  f"{entry.get('added_at', '')[:19]}  {entry['source']}")
+        print(f"共 {len(entries)} 筆待覆核")
+    else:
+        rows = index.review(args.sources, args.command, label=getattr(args, "label", None))
+        print(f"✅ 已{'確認' if args.command == 'confirm' else '駁回'} {len(rows)} 筆: {rows}")
+
+
+if __name__ == "__main__":
+    main()
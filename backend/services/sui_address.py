@@ -0,0 +1,25 @@
+"""
+Sui 地址（包 ID、部署者地址）的二進位表示
+部署者索引與包信譽清單都以 32 bytes 儲存地址，短地址左側補零
+"""
+
+from typing import Optional
+
+
+def normalize_address(address: str) -> Optional[bytes]:
+    """將 0x 開頭的 Sui 地址轉為 32 bytes（短地址左側補零），格式不正確時返回 None"""
+    if not address:
+        return None
+    hex_part = address.strip().lower()
+    if hex_part.startswith("0x"):
+        hex_part = hex_part[2:]
+    if not hex_part or len(hex_part) > 64:
+        return None
+    try:
+        return bytes.fromhex(hex_part.rjust(64, "0"))
+    except ValueError:
+        return None
+
+
+def format_address(raw: bytes) -> str:
+    return "0x" + raw.hex()